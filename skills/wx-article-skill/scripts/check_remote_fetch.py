@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+远程图片下载的连接复用检查：在本机起一个 HTTP 服务器，让同一主机上的请求先超时、
+再请求正常的图片，确认超时留下的半截连接不会被后续请求复用。
+
+服务器与下载缓存都是临时的，不访问网络，也不读写本机缓存。
+"""
+
+import argparse
+import http.server
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from converter import RemoteImageFetcher, Reporter
+
+PNG = (b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x02\x00\x00\x00"
+       b"\x90wS\xde\x00\x00\x00\x0cIDATx\x9cc\xf8\xcf\xc0\x00\x00\x03\x01\x01\x00\xc9\xfe\x92\xef"
+       b"\x00\x00\x00\x00IEND\xaeB`\x82")
+
+
+class ImageHandler(http.server.BaseHTTPRequestHandler):
+    """/ok 立即返回图片；/slow-headers 迟迟不响应；/slow-body 只发一部分正文就停住"""
+
+    protocol_version = "HTTP/1.1"
+    delay = 2.0
+
+    def do_GET(self):
+        if self.path == "/slow-headers":
+            time.sleep(self.delay)
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(PNG)))
+        self.end_headers()
+        if self.path == "/slow-body":
+            self.wfile.write(PNG[:8])
+            self.wfile.flush()
+            time.sleep(self.delay)
+        self.wfile.write(PNG)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def check(base: str, cache_root: Path, first: str, timeout: float) -> Tuple[bool, str]:
+    """同一线程依次请求 first 与 /ok：first 应失败，/ok 应成功"""
+    fetcher = RemoteImageFetcher(cache_root=cache_root, max_workers=1, timeout=timeout, reporter=Reporter())
+    results = fetcher.fetch_all([base + first, base + "/ok"])
+    if results[base + first] is not None:
+        return False, f"{first} did not time out"
+    path = results[base + "/ok"]
+    if path is None:
+        return False, "/ok failed after the timeout"
+    if path.read_bytes() != PNG:
+        return False, "/ok downloaded wrong content"
+    return True, "/ok downloaded after the timeout"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that a timed-out keep-alive connection is not reused")
+    parser.add_argument("--timeout", type=float, default=0.5, help="Fetcher timeout in seconds (default: 0.5)")
+    args = parser.parse_args()
+
+    ImageHandler.delay = args.timeout * 4
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), ImageHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    failures: List[str] = []
+    try:
+        for first in ("/slow-headers", "/slow-body"):
+            with tempfile.TemporaryDirectory() as cache:
+                ok, message = check(base, Path(cache), first, args.timeout)
+            print(f"{'[OK]' if ok else '[X]'} {first}: {message}")
+            if not ok:
+                failures.append(first)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,14 +5,1074 @@
 支持图片提取和重命名
 """
 
+import asyncio
+import base64
+import bisect
+import copy
+import datetime
+import functools
+import hashlib
+import http.client
+import itertools
 import json
+import math
 import os
 import re
 import shutil
+import struct
 import sys
+import threading
+import time
 import urllib.parse
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List, Tuple, Optional
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple, Optional, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+try:
+    import yaml  # 可选依赖，用于解析 front matter
+except ImportError:
+    yaml = None
+
+try:
+    from PIL import Image, ImageOps  # 可选依赖，仅用于图片优化
+except ImportError:
+    Image = None
+    ImageOps = None
+
+
+# 转换器版本：发布号加本文件（含默认规则表）的内容哈希，任何改动都会使
+# 依赖图、解析快照与预览清单中的旧结果失效，无需记得手动递增
+CONVERTER_RELEASE = "2.1.0"
+CONVERTER_VERSION = f"{CONVERTER_RELEASE}+{hashlib.sha1(Path(__file__).read_bytes()).hexdigest()[:12]}"
+
+
+def cache_dir(*parts: str) -> Path:
+    """本地缓存目录，可通过环境变量 WX_ARTICLE_CACHE_DIR 覆盖"""
+    root = os.environ.get("WX_ARTICLE_CACHE_DIR")
+    base = Path(root) if root else Path.home() / ".cache" / "wx-article-skill"
+    path = base.joinpath(*parts)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+# ============================================
+# 进度事件
+# ============================================
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LEVEL_NAMES = {DEBUG: "debug", INFO: "info", WARNING: "warning", ERROR: "error"}
+
+
+class Reporter:
+    """结构化进度事件与计数器
+
+    事件以 (级别, 名称, 字段) 分发给订阅者；没有订阅者或级别低于所有订阅阈值时
+    emit 立即返回，不做任何格式化。计数器始终累加，可通过 merge 汇总并行任务的结果。
+    """
+
+    def __init__(self):
+        self.sinks: List[Tuple[int, Callable[[Dict[str, Any]], None]]] = []
+        self.min_level = ERROR + 1
+        self.counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, sink: Callable[[Dict[str, Any]], None], level: int = INFO):
+        """注册回调，sink 接收事件字典 {"event", "level", ...字段}"""
+        self.sinks.append((level, sink))
+        self.min_level = min(self.min_level, level)
+
+    def enabled(self, level: int) -> bool:
+        return level >= self.min_level
+
+    def emit(self, level: int, event: str, **fields):
+        if level < self.min_level:
+            return
+        record = {"event": event, "level": level, **fields}
+        for sink_level, sink in self.sinks:
+            if level >= sink_level:
+                sink(record)
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, counters: Dict[str, int]):
+        """合并其他 Reporter（如工作进程）返回的计数"""
+        with self._lock:
+            for name, n in counters.items():
+                self.counters[name] = self.counters.get(name, 0) + n
+
+
+class ConsoleSink:
+    """按模板把事件格式化为人类可读的日志行，WARNING 及以上写入 stderr"""
+
+    MESSAGES = {
+        "vault.detected": "[INFO] Detected Obsidian Vault Root: {root}",
+        "image.copied": "[OK] {source} -> {name}",
+        "image.missing": "[!] Image not found: {path} -> {name} (Search paths: {search_paths})",
+        "image.copy_failed": "[X] Copy failed: {source} - {error}",
+        "remote.http_error": "[!] Remote image HTTP {status}: {url}",
+        "remote.failed": "[!] Remote image failed: {url} - {error}",
+        "optimize.unavailable": "[INFO] Pillow not installed, skipping image optimization",
+        "optimize.done": "[OK] Optimized {name}",
+        "optimize.failed": "[X] Optimize failed: {source} - {error}",
+        "assets.dirs": "[INFO] Assets directories: {dirs}",
+        "note.missing": "[!] Note not found: {name}",
+        "note.section_missing": "[!] Section not found: {name}#{anchor}",
+        "note.cycle": "[!] Skipped circular note embed: {chain}",
+        "output.written": "[OK] Generated: {path}",
+        "output.unchanged": "[SKIP] Unchanged: {path}",
+        "publish.summary": "[INFO] Written: {written} file(s), {copied} image(s), {optimized} optimized; "
+                           "skipped: {skipped} unchanged file(s), {reused} unchanged image(s)",
+        "extract.summary": "{message}",
+        "document.stats": "[INFO] {cjk_chars} CJK chars, {words} words, {images} image(s), "
+                          "{headings} heading(s), ~{minutes} min read",
+        "inline.summary": "[INFO] Inlined {inlined} image(s) ({cached} from cache)",
+        "run.counters": "[INFO] Counters: {counters}",
+        "stage.done": "[INFO] Stage finished: {stage} ({seconds:.3f}s)",
+        "conversion.done": "[INFO] Converted in {seconds:.3f}s",
+    }
+
+    def __init__(self, stream=None, err_stream=None):
+        self.stream = stream
+        self.err_stream = err_stream
+
+    def __call__(self, record: Dict[str, Any]):
+        template = self.MESSAGES.get(record["event"])
+        if template:
+            line = template.format(**record)
+        else:
+            fields = " ".join(f"{k}={v}" for k, v in record.items() if k not in ("event", "level"))
+            line = f"[{LEVEL_NAMES.get(record['level'], record['level'])}] {record['event']} {fields}"
+        if record["level"] >= WARNING:
+            stream = self.err_stream or sys.stderr
+        else:
+            stream = self.stream or sys.stdout
+        stream.write(line + "\n")
+
+
+class JSONLinesSink:
+    """机器可读的事件流，每行一个 JSON 对象"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def __call__(self, record: Dict[str, Any]):
+        record = dict(record, level=LEVEL_NAMES.get(record["level"], record["level"]), ts=time.time())
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            self.stream.write(line + "\n")
+
+
+# ============================================
+# 运行指标
+# ============================================
+
+# 进程内共享缓存（主题、文件哈希、图片尺寸、代码高亮、公式）的命中统计，与具体转换的 Reporter 无关
+_CACHE_STATS = Reporter()
+
+
+class StageTimer:
+    """依次计时转换的各个阶段，阶段结束时发出带耗时（秒）的 DEBUG 级 stage.done 事件"""
+
+    __slots__ = ("reporter", "started", "_last")
+
+    def __init__(self, reporter: Reporter):
+        self.reporter = reporter
+        self.started = self._last = time.perf_counter()
+
+    def restart(self):
+        """从现在开始计下一阶段，跳过中间由其他函数计时的部分"""
+        self._last = time.perf_counter()
+
+    def done(self, stage: str):
+        now = time.perf_counter()
+        self.reporter.emit(DEBUG, "stage.done", stage=stage, seconds=now - self._last)
+        self._last = now
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+
+class Histogram:
+    """分桶耗时直方图（Prometheus 语义），另保留最近的样本用于计算分位数"""
+
+    def __init__(self, buckets: Tuple[float, ...], window: int = 1024):
+        self.buckets = buckets
+        # 最后一格对应 +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent: deque = deque(maxlen=window)
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def cumulative(self) -> List[int]:
+        return list(itertools.accumulate(self.counts))
+
+    def summary(self, quantiles: Tuple[float, ...]) -> Dict[str, Any]:
+        samples = sorted(self.recent)
+        result = {"count": self.count, "sum": round(self.sum, 6),
+                  "mean": round(self.sum / self.count, 6) if self.count else None}
+        for q in quantiles:
+            key = f"p{q * 100:g}"
+            result[key] = round(samples[min(int(q * len(samples)), len(samples) - 1)], 6) if samples else None
+        return result
+
+
+class Metrics:
+    """长期运行的转换服务的进程内指标，可导出为 Prometheus 文本格式或 JSON 快照
+
+    作为 Reporter 的订阅者，只处理每次转换几条的 stage.done / conversion.done 事件来累积耗时直方图；
+    字节数、图片、输出等计数直接读取 Reporter 的计数器，缓存命中读取进程内统计，
+    解析与图片处理的内部循环没有额外开销。
+
+        metrics = Metrics(reporter)
+        convert_file(..., reporter=reporter)
+        text = metrics.prometheus()
+    """
+
+    PREFIX = "wx_article"
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    QUANTILES = (0.5, 0.9, 0.99)
+
+    def __init__(self, reporter: Reporter):
+        self.reporter = reporter
+        self.started = time.time()
+        self.conversions = Histogram(self.BUCKETS)
+        self.stages: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+        reporter.subscribe(self, DEBUG)
+
+    def __call__(self, record: Dict[str, Any]):
+        event = record["event"]
+        if event == "stage.done":
+            with self._lock:
+                histogram = self.stages.get(record["stage"])
+                if histogram is None:
+                    histogram = self.stages[record["stage"]] = Histogram(self.BUCKETS)
+                histogram.observe(record["seconds"])
+        elif event == "conversion.done":
+            with self._lock:
+                self.conversions.observe(record["seconds"])
+
+    @staticmethod
+    def cache_stats() -> Dict[str, Dict[str, Any]]:
+        """{缓存名: {hits, misses, hit_rate}}"""
+        caches: Dict[str, Dict[str, Any]] = {}
+        for name, n in dict(_CACHE_STATS.counters).items():
+            cache, _, kind = name.rpartition(".")
+            caches.setdefault(cache, {"hits": 0, "misses": 0})[kind] = n
+        for stats in caches.values():
+            total = stats["hits"] + stats["misses"]
+            stats["hit_rate"] = round(stats["hits"] / total, 4) if total else None
+        return caches
+
+    def snapshot(self) -> Dict[str, Any]:
+        """当前指标的 JSON 快照"""
+        uptime = time.time() - self.started
+        counters = dict(self.reporter.counters)
+        with self._lock:
+            latency = {
+                "conversion": self.conversions.summary(self.QUANTILES),
+                "stages": {stage: h.summary(self.QUANTILES) for stage, h in sorted(self.stages.items())},
+            }
+        return {
+            "uptime_seconds": round(uptime, 3),
+            "conversions_per_second": round(counters.get("conversions", 0) / uptime, 3) if uptime else None,
+            "counters": counters,
+            "caches": self.cache_stats(),
+            "latency": latency,
+        }
+
+    def prometheus(self) -> str:
+        """Prometheus 文本格式（text/plain; version=0.0.4）"""
+        p = self.PREFIX
+        lines = [f"# HELP {p}_start_time_seconds Start time of the metrics registry since unix epoch.",
+                 f"# TYPE {p}_start_time_seconds gauge",
+                 f"{p}_start_time_seconds {self.started:.3f}"]
+
+        for name, n in sorted(dict(self.reporter.counters).items()):
+            metric = f"{p}_{re.sub(r'[^A-Za-z0-9_]', '_', name)}_total"
+            lines += [f"# HELP {metric} Reporter counter {name}.",
+                      f"# TYPE {metric} counter",
+                      f"{metric} {n}"]
+
+        caches = self.cache_stats()
+        for kind in ("hits", "misses"):
+            metric = f"{p}_cache_{kind}_total"
+            lines += [f"# HELP {metric} In-process cache {kind}.", f"# TYPE {metric} counter"]
+            lines += [f'{metric}{{cache="{cache}"}} {stats[kind]}' for cache, stats in sorted(caches.items())]
+
+        with self._lock:
+            lines += self._histogram_lines(f"{p}_conversion_seconds", "Markdown to HTML conversion time.",
+                                           [("", self.conversions)])
+            lines += self._histogram_lines(f"{p}_stage_seconds", "Time spent in each conversion stage.",
+                                           [(f'stage="{s}",', h) for s, h in sorted(self.stages.items())])
+        return "\n".join(lines) + "\n"
+
+    def _histogram_lines(self, metric: str, help_text: str,
+                         series: List[Tuple[str, Histogram]]) -> List[str]:
+        lines = [f"# HELP {metric} {help_text}", f"# TYPE {metric} histogram"]
+        for labels, histogram in series:
+            bounds = [repr(b) for b in histogram.buckets] + ["+Inf"]
+            for bound, n in zip(bounds, histogram.cumulative()):
+                lines.append(f'{metric}_bucket{{{labels}le="{bound}"}} {n}')
+            suffix = f"{{{labels.rstrip(',')}}}" if labels else ""
+            lines.append(f"{metric}_sum{suffix} {histogram.sum:.6f}")
+            lines.append(f"{metric}_count{suffix} {histogram.count}")
+        return lines
+
+    def write(self, path: Path):
+        """写入文件：.prom / .txt 为 Prometheus 文本格式，其余为 JSON 快照"""
+        path = Path(path)
+        if path.suffix in (".prom", ".txt"):
+            data = self.prometheus()
+        else:
+            data = json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+        atomic_write_bytes(path, data.encode("utf-8"))
+
+
+# ============================================
+# 图片尺寸探测
+# ============================================
+
+_DIGEST_CACHE: Dict[Tuple[str, int, int], str] = {}
+
+
+def file_digest(path: Path) -> str:
+    """计算文件内容哈希，按 (路径, 大小, 修改时间) 缓存，未变化的文件只读一次"""
+    path = Path(path)
+    stat = path.stat()
+    key = (str(path), stat.st_size, stat.st_mtime_ns)
+    digest = _DIGEST_CACHE.get(key)
+    if digest is not None:
+        _CACHE_STATS.count("digest.hits")
+    else:
+        _CACHE_STATS.count("digest.misses")
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        _DIGEST_CACHE[key] = digest
+    return digest
+
+
+class ImageProbe:
+    """只读取文件头获取图片尺寸（PNG/JPEG/GIF/WebP/SVG），不解码图片"""
+
+    # JPEG 中携带尺寸信息的 SOF 标记（排除 DHT/JPG/DAC）
+    _JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+                 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+    def __init__(self):
+        self._cache: Dict[Any, Optional[Tuple[int, int]]] = {}
+
+    def probe(self, path: Path, digest: str = None) -> Optional[Tuple[int, int]]:
+        """返回 (宽, 高)，无法识别时返回 None
+
+        已知内容哈希时按哈希缓存；否则按 (路径, 大小, 修改时间) 缓存，不为探测而读取整个文件。
+        """
+        path = Path(path)
+        if digest is not None:
+            key = digest
+        else:
+            try:
+                stat = path.stat()
+            except OSError:
+                return None
+            key = (str(path), stat.st_size, stat.st_mtime_ns)
+        if key in self._cache:
+            _CACHE_STATS.count("probe.hits")
+            return self._cache[key]
+        _CACHE_STATS.count("probe.misses")
+        try:
+            with open(path, "rb") as f:
+                size = self._read_size(f)
+        except (OSError, struct.error, ValueError, IndexError):
+            size = None
+        self._cache[key] = size
+        return size
+
+    def _read_size(self, f) -> Optional[Tuple[int, int]]:
+        head = f.read(32)
+        if head.startswith(b"\x89PNG\r\n\x1a\n") and head[12:16] == b"IHDR":
+            return struct.unpack(">II", head[16:24])
+        if head[:6] in (b"GIF87a", b"GIF89a"):
+            return struct.unpack("<HH", head[6:10])
+        if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+            return self._webp_size(head)
+        if head[:2] == b"\xff\xd8":
+            f.seek(2)
+            return self._jpeg_size(f)
+        if b"<svg" in head or head.lstrip().startswith((b"<?xml", b"<!--")):
+            return self._svg_size(head + f.read(4096))
+        return None
+
+    def _webp_size(self, head: bytes) -> Optional[Tuple[int, int]]:
+        # 文件头不足 30 字节（截断的文件）时无法读出尺寸
+        if len(head) < 30:
+            return None
+        chunk = head[12:16]
+        if chunk == b"VP8 " and head[23:26] == b"\x9d\x01\x2a":
+            w, h = struct.unpack("<HH", head[26:30])
+            return w & 0x3FFF, h & 0x3FFF
+        if chunk == b"VP8L" and head[20] == 0x2F:
+            bits = struct.unpack("<I", head[21:25])[0]
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b"VP8X":
+            w = int.from_bytes(head[24:27], "little") + 1
+            h = int.from_bytes(head[27:30], "little") + 1
+            return w, h
+        return None
+
+    def _jpeg_size(self, f) -> Optional[Tuple[int, int]]:
+        """逐段跳读 JPEG，遇到 SOF 即返回；EXIF 方向为 5-8 时交换宽高"""
+        rotated = False
+        while True:
+            byte = f.read(1)
+            if not byte:
+                return None
+            if byte != b"\xff":
+                continue
+            marker = f.read(1)
+            while marker == b"\xff":
+                marker = f.read(1)
+            if not marker:
+                return None
+            code = marker[0]
+            if code in (0x01, 0xD8) or 0xD0 <= code <= 0xD7:
+                continue
+            if code in (0xD9, 0xDA):
+                return None
+            length = struct.unpack(">H", f.read(2))[0]
+            if code in self._JPEG_SOF:
+                h, w = struct.unpack(">xHH", f.read(5))
+                return (h, w) if rotated else (w, h)
+            if code == 0xE1:
+                segment = f.read(length - 2)
+                rotated = self._exif_orientation(segment) in (5, 6, 7, 8)
+            else:
+                f.seek(length - 2, 1)
+
+    def _exif_orientation(self, segment: bytes) -> int:
+        if not segment.startswith(b"Exif\x00\x00"):
+            return 1
+        tiff = segment[6:]
+        endian = "<" if tiff[:2] == b"II" else ">"
+        offset = struct.unpack(endian + "I", tiff[4:8])[0]
+        count = struct.unpack(endian + "H", tiff[offset:offset + 2])[0]
+        for i in range(count):
+            entry = offset + 2 + i * 12
+            tag = struct.unpack(endian + "H", tiff[entry:entry + 2])[0]
+            if tag == 0x0112:
+                return struct.unpack(endian + "H", tiff[entry + 8:entry + 10])[0]
+        return 1
+
+    def _svg_size(self, head: bytes) -> Optional[Tuple[int, int]]:
+        match = re.search(rb"<svg\b[^>]*>", head, re.DOTALL)
+        if not match:
+            return None
+        tag = match.group(0)
+
+        def attr(name: bytes) -> Optional[float]:
+            m = re.search(rb"\s" + name + rb"\s*=\s*[\"']\s*([\d.]+)(px)?\s*[\"']", tag)
+            return float(m.group(1)) if m else None
+
+        w, h = attr(b"width"), attr(b"height")
+        if w and h:
+            return round(w), round(h)
+        m = re.search(rb"viewBox\s*=\s*[\"']\s*[-\d.]+[\s,]+[-\d.]+[\s,]+([\d.]+)[\s,]+([\d.]+)", tag)
+        if m:
+            return round(float(m.group(1))), round(float(m.group(2)))
+        return None
+
+
+# 默认共享的探测器，跨多次转换复用缓存
+_IMAGE_PROBE = ImageProbe()
+
+
+# ============================================
+# 远程图片下载
+# ============================================
+
+class RemoteImageFetcher:
+    """并发下载 http(s) 图片
+
+    每个工作线程按主机复用 keep-alive 连接；下载结果以内容哈希存入磁盘缓存，
+    并记录 ETag/Last-Modified。缓存未过期时不发起任何请求，过期后发送条件请求。
+    """
+
+    CONTENT_TYPES = {
+        "image/png": ".png", "image/jpeg": ".jpg", "image/jpg": ".jpg",
+        "image/gif": ".gif", "image/webp": ".webp", "image/svg+xml": ".svg",
+    }
+    MAX_REDIRECTS = 5
+
+    def __init__(self, cache_root: Path = None, max_workers: int = 8,
+                 timeout: float = 15.0, max_age: int = 7 * 24 * 3600,
+                 reporter: Reporter = None):
+        self.cache_root = Path(cache_root) if cache_root else cache_dir("remote")
+        self.objects_dir = self.cache_root / "objects"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.cache_root / "index.json"
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_age = max_age
+        self.reporter = reporter or Reporter()
+        self.requests = 0
+        self._index: Dict[str, Dict[str, Any]] = self._load_index()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._connections: List[http.client.HTTPConnection] = []
+
+    @staticmethod
+    def is_remote(path: str) -> bool:
+        return path.lower().startswith(("http://", "https://"))
+
+    def _load_index(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self):
+        tmp = self.index_path.with_name(f"index.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._index, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.index_path)
+
+    def fetch_all(self, urls: List[str]) -> Dict[str, Optional[Path]]:
+        """并发获取一组 URL，返回 {url: 缓存文件路径或 None}"""
+        unique = list(dict.fromkeys(urls))
+        results: Dict[str, Optional[Path]] = {}
+        pending = []
+        for url in unique:
+            cached = self._fresh_entry(url)
+            if cached:
+                self.reporter.count("remote.cache_hits")
+                results[url] = cached
+            else:
+                pending.append(url)
+
+        if pending:
+            try:
+                with ThreadPoolExecutor(max_workers=min(self.max_workers, len(pending))) as pool:
+                    for url, path in zip(pending, pool.map(self.fetch, pending)):
+                        results[url] = path
+            finally:
+                for conn in self._connections:
+                    conn.close()
+                self._connections.clear()
+                self._save_index()
+        return results
+
+    def _object_path(self, entry: Dict[str, Any]) -> Path:
+        return self.objects_dir / entry["digest"][:2] / f"{entry['digest']}{entry['ext']}"
+
+    def _fresh_entry(self, url: str) -> Optional[Path]:
+        entry = self._index.get(url)
+        if not entry:
+            return None
+        path = self._object_path(entry)
+        if not path.exists():
+            return None
+        # 服务器给出的 max-age 与本地配置取较小者
+        max_age = min(entry.get("max_age", self.max_age), self.max_age)
+        if time.time() - entry.get("fetched_at", 0) < max_age:
+            return path
+        return None
+
+    def _connection(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        conns = getattr(self._local, "conns", None)
+        if conns is None:
+            conns = self._local.conns = {}
+        key = (scheme, netloc)
+        conn = conns.get(key)
+        if conn is None:
+            cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+            conn = cls(netloc, timeout=self.timeout)
+            conns[key] = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _drop_connection(self, scheme: str, netloc: str):
+        conn = self._local.conns.pop((scheme, netloc), None)
+        if conn:
+            conn.close()
+
+    def fetch(self, url: str) -> Optional[Path]:
+        """下载单个 URL（可在线程池中调用），失败时返回 None"""
+        with self._lock:
+            entry = dict(self._index.get(url) or {})
+        current = url
+        parts = response = None
+        try:
+            for _ in range(self.MAX_REDIRECTS + 1):
+                parts = urllib.parse.urlsplit(current)
+                target = parts.path or "/"
+                if parts.query:
+                    target += "?" + parts.query
+                headers = {"User-Agent": "wx-article-skill", "Accept": "image/*"}
+                if entry and self._object_path(entry).exists():
+                    if entry.get("etag"):
+                        headers["If-None-Match"] = entry["etag"]
+                    if entry.get("last_modified"):
+                        headers["If-Modified-Since"] = entry["last_modified"]
+                response = self._request(parts.scheme, parts.netloc, target, headers)
+
+                if response.status in (301, 302, 303, 307, 308):
+                    location = response.getheader("Location")
+                    response.read()
+                    if not location:
+                        break
+                    current = urllib.parse.urljoin(current, location)
+                    continue
+                if response.status == 304 and entry:
+                    response.read()
+                    entry.update(fetched_at=time.time(), max_age=self._max_age(response))
+                    with self._lock:
+                        self._index[url] = entry
+                    self.reporter.count("remote.revalidated")
+                    return self._object_path(entry)
+                if response.status != 200:
+                    response.read()
+                    self.reporter.count("remote.failed")
+                    self.reporter.emit(WARNING, "remote.http_error", url=url, status=response.status)
+                    return None
+                self.reporter.count("remote.downloaded")
+                return self._store(url, current, response)
+        except (OSError, http.client.HTTPException) as e:
+            self.reporter.count("remote.failed")
+            self.reporter.emit(WARNING, "remote.failed", url=url, error=e)
+        finally:
+            # 响应没有读完（超时或中途出错）时连接处于未知状态，不能再复用
+            if response is not None and not response.isclosed():
+                self._drop_connection(parts.scheme, parts.netloc)
+        return None
+
+    def _request(self, scheme: str, netloc: str, target: str,
+                 headers: Dict[str, str]) -> http.client.HTTPResponse:
+        """发送请求；复用的连接被服务器关闭时重连一次"""
+        for attempt in range(2):
+            conn = self._connection(scheme, netloc)
+            try:
+                conn.request("GET", target, headers=headers)
+                with self._lock:
+                    self.requests += 1
+                return conn.getresponse()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                self._drop_connection(scheme, netloc)
+                if attempt:
+                    raise
+            except BaseException:
+                # 超时等其他错误：请求已发出一半，丢弃连接
+                self._drop_connection(scheme, netloc)
+                raise
+
+    def _max_age(self, response: http.client.HTTPResponse) -> int:
+        match = re.search(r"max-age=(\d+)", response.getheader("Cache-Control") or "")
+        return int(match.group(1)) if match else self.max_age
+
+    def _store(self, url: str, final_url: str, response: http.client.HTTPResponse) -> Path:
+        """边下载边计算哈希，写入内容寻址的对象文件"""
+        content_type = (response.getheader("Content-Type") or "").split(";")[0].strip().lower()
+        ext = self.CONTENT_TYPES.get(content_type)
+        if not ext:
+            ext = Path(urllib.parse.urlsplit(final_url).path).suffix.lower()
+            if ext not in ['.png', '.jpg', '.jpeg', '.gif', '.webp', '.svg']:
+                ext = '.png'
+
+        h = hashlib.sha1()
+        tmp = self.objects_dir / f"download.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            for chunk in iter(lambda: response.read(1 << 16), b""):
+                h.update(chunk)
+                f.write(chunk)
+        entry = {
+            "digest": h.hexdigest(),
+            "ext": ext,
+            "etag": response.getheader("ETag"),
+            "last_modified": response.getheader("Last-Modified"),
+            "fetched_at": time.time(),
+            "max_age": self._max_age(response),
+        }
+        path = self._object_path(entry)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp, path)
+        with self._lock:
+            self._index[url] = entry
+        return path
+
+
+# ============================================
+# 原子写入与共享图片清单
+# ============================================
+
+class ManifestLock:
+    """跨线程、跨进程的文件锁，用于保护共享的图片清单"""
+
+    _thread_locks: Dict[str, threading.Lock] = {}
+    _guard = threading.Lock()
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with self._guard:
+            self._thread_lock = self._thread_locks.setdefault(str(self.path.resolve()), threading.Lock())
+        self._file = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        try:
+            self._file = open(self.path, "a+b")
+            if fcntl:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            else:
+                while True:
+                    try:
+                        self._file.seek(0)
+                        msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        continue
+        except BaseException:
+            if self._file:
+                self._file.close()
+            self._thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            if fcntl:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._file.close()
+            self._thread_lock.release()
+
+
+def atomic_write_bytes(path: Path, data: bytes):
+    """写入同目录临时文件后重命名，替换是原子的"""
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+def write_if_changed(path: Path, text: str, reporter: "Reporter" = None) -> bool:
+    """内容与现有文件一致时跳过写入（保持 mtime 不变），否则原子替换；返回是否写入"""
+    reporter = reporter or Reporter()
+    path = Path(path)
+    data = text.encode("utf-8")
+    try:
+        if path.stat().st_size == len(data):
+            with open(path, "rb") as f:
+                unchanged = hashlib.sha1(f.read()).digest() == hashlib.sha1(data).digest()
+            if unchanged:
+                reporter.count("outputs.skipped")
+                reporter.emit(INFO, "output.unchanged", path=path)
+                return False
+    except OSError:
+        pass
+    path.parent.mkdir(parents=True, exist_ok=True)
+    atomic_write_bytes(path, data)
+    reporter.count("outputs.written")
+    reporter.count("outputs.bytes_written", len(data))
+    reporter.emit(INFO, "output.written", path=path)
+    return True
+
+
+def write_stream_if_changed(path: Path, chunks: Iterable[bytes], reporter: "Reporter" = None) -> bool:
+    """边产出边写入同目录临时文件并计算哈希，内存中只保留当前块
+
+    与现有文件一致时丢弃临时文件（保持 mtime 不变），否则原子替换；返回是否写入。
+    """
+    reporter = reporter or Reporter()
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    h = hashlib.sha1()
+    size = 0
+    try:
+        with open(tmp, "wb") as out:
+            for data in chunks:
+                out.write(data)
+                h.update(data)
+                size += len(data)
+        try:
+            unchanged = path.stat().st_size == size and file_digest(path) == h.hexdigest()
+        except OSError:
+            unchanged = False
+        if unchanged:
+            reporter.count("outputs.skipped")
+            reporter.emit(INFO, "output.unchanged", path=path)
+            return False
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    reporter.count("outputs.written")
+    reporter.count("outputs.bytes_written", size)
+    reporter.emit(INFO, "output.written", path=path)
+    return True
+
+
+def atomic_copy(source: Path, dest: Path):
+    """先写入同目录临时文件再重命名，读者不会看到写了一半的文件"""
+    tmp = dest.with_name(f".{dest.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        shutil.copy2(source, tmp)
+        os.replace(tmp, dest)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+# ============================================
+# 笔记嵌入（Obsidian ![[note]]）
+# ============================================
+
+class Note:
+    """解析后的笔记：去掉 front matter 的正文行、标题与块标记位置，相对路径图片已改写为绝对路径"""
+
+    __slots__ = ("path", "lines", "headings", "blocks")
+
+    HEADING = re.compile(r'(#{1,6})\s+(.*?)\s*#*\s*$')
+    BLOCK_ID = re.compile(r'\s\^([A-Za-z0-9-]+)\s*$')
+    IMAGE = re.compile(r'(!\[[^\]]*\]\()([^\)]+)(\))')
+
+    def __init__(self, path: Path, text: str):
+        self.path = path
+        lines = text.split("\n")
+        if lines and lines[0].strip() == "---":
+            end = next((i for i in range(1, len(lines)) if lines[i].strip() in ("---", "...")), None)
+            if end is not None:
+                lines = lines[end + 1:]
+        # [(行号, 级别, 标题文本)]，代码块中的 # 行不算标题
+        self.headings: List[Tuple[int, int, str]] = []
+        # 块标记 ^id -> 行号；标记本身不显示
+        self.blocks: Dict[str, int] = {}
+        in_code = False
+        for i, line in enumerate(lines):
+            if line.startswith("```"):
+                in_code = not in_code
+                continue
+            if in_code:
+                continue
+            match = self.HEADING.match(line)
+            if match:
+                self.headings.append((i, len(match.group(1)), match.group(2).strip()))
+            block = self.BLOCK_ID.search(line)
+            if block:
+                self.blocks[block.group(1)] = i
+                line = lines[i] = line[:block.start()]
+            if "](" in line:
+                lines[i] = self.IMAGE.sub(self._absolute_image, line)
+        self.lines = lines
+
+    def _absolute_image(self, match) -> str:
+        """笔记目录下的相对路径图片改为绝对路径，嵌入到其他目录的文章后仍能找到"""
+        url = match.group(2).strip()
+        if RemoteImageFetcher.is_remote(url) or url.startswith("data:"):
+            return match.group(0)
+        candidate = self.path.parent / urllib.parse.unquote(url)
+        if candidate.is_file():
+            return f"{match.group(1)}{candidate.resolve().as_posix()}{match.group(3)}"
+        return match.group(0)
+
+    def section(self, anchor: str) -> Optional[str]:
+        """按锚点取内容：空锚点为全文，"标题#子标题" 逐级缩小范围，"^id" 为块引用；找不到返回 None"""
+        start, end = 0, len(self.lines)
+        for part in filter(None, (p.strip() for p in anchor.split("#"))):
+            if part.startswith("^"):
+                return self._block(part[1:], start, end)
+            for index, (line, level, text) in enumerate(self.headings):
+                if start <= line < end and text.lower() == part.lower():
+                    following = (l for l, lv, _ in self.headings[index + 1:] if lv <= level)
+                    start, end = line, min(next(following, len(self.lines)), end)
+                    break
+            else:
+                return None
+        return "\n".join(self.lines[start:end]).strip("\n")
+
+    def _block(self, block_id: str, start: int, end: int) -> Optional[str]:
+        """块引用：带 " ^id" 标记的行所在的段落"""
+        line = self.blocks.get(block_id)
+        if line is None or not start <= line < end:
+            return None
+        first = line
+        while first > start and self.lines[first - 1].strip():
+            first -= 1
+        return "\n".join(self.lines[first:line + 1])
+
+
+# 进程内笔记缓存：(路径, 大小, 修改时间) -> Note；被多篇文章嵌入的公共片段每批只解析一次
+_NOTE_CACHE: Dict[Tuple[str, int, int], Note] = {}
+# 目录 -> {小写笔记名: 路径}，每个库只扫描一次
+_NOTE_INDEX: Dict[str, Dict[str, Path]] = {}
+# 目录 -> 重建索引后仍找不到的小写笔记名；同一批中再次缺失时不再重建索引
+_NOTE_MISSES: Dict[str, set] = {}
+
+
+def load_note(path: Path) -> Note:
+    """读取并解析笔记，按 (路径, 大小, 修改时间) 缓存"""
+    stat = path.stat()
+    key = (str(path), stat.st_size, stat.st_mtime_ns)
+    note = _NOTE_CACHE.get(key)
+    if note is not None:
+        _CACHE_STATS.count("note.hits")
+        return note
+    _CACHE_STATS.count("note.misses")
+    with open(path, "r", encoding="utf-8") as f:
+        note = Note(path, f.read())
+    _NOTE_CACHE[key] = note
+    return note
+
+
+class NoteEmbedder:
+    """把 Obsidian 笔记嵌入 ![[note]]、![[note#标题]]、![[note#^块]] 展开为被引用的 Markdown
+
+    被嵌入的内容中的嵌入递归展开；循环引用或超过 MAX_DEPTH 层时跳过并报警。
+    目标不是笔记（图片、附件）的嵌入原样保留，交给 ImageExtractor；找不到的笔记改为普通文字。
+    代码块内的嵌入不处理。
+    """
+
+    MAX_DEPTH = 10
+    EMBED_PATTERN = re.compile(r'!\[\[([^\]]*?)\]\]')
+    IMAGE_EXTS = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.svg', '.bmp')
+    # 带扩展名且找不到同名笔记的嵌入视为附件（pdf 等），原样保留
+    ATTACHMENT = re.compile(r'\.(?!md$)[A-Za-z0-9]{1,5}$', re.IGNORECASE)
+
+    def __init__(self, input_dir: Path, vault_root: Path = None, reporter: Reporter = None):
+        self.reporter = reporter or Reporter()
+        self.input_dir = Path(input_dir)
+        self.root = Path(vault_root) if vault_root else self._find_vault_root()
+        # 本次展开用到的笔记，用于依赖图
+        self.notes: List[str] = []
+        # 找不到或无法读取的笔记名
+        self.missing: List[str] = []
+        self._refreshed = False
+
+    def _find_vault_root(self) -> Path:
+        current = self.input_dir.resolve()
+        for _ in range(10):
+            if (current / ".obsidian").is_dir():
+                return current
+            if current.parent == current:
+                break
+            current = current.parent
+        return self.input_dir.resolve()
+
+    def expand(self, markdown: str, source: Path = None) -> str:
+        """展开嵌入；source 为文章自身路径，嵌入链绕回文章时按循环处理"""
+        if "![[" not in markdown:
+            return markdown
+        return self._expand(markdown, [str(Path(source).resolve())] if source else [])
+
+    def _expand(self, text: str, stack: List[str]) -> str:
+        lines = text.split("\n")
+        in_code = False
+        for i, line in enumerate(lines):
+            if line.startswith("```"):
+                in_code = not in_code
+            elif not in_code and "![[" in line:
+                lines[i] = self.EMBED_PATTERN.sub(lambda m: self._replace(m, stack), line)
+        return "\n".join(lines)
+
+    def _replace(self, match, stack: List[str]) -> str:
+        target = match.group(1).split("|", 1)[0].strip()
+        name, _, anchor = target.partition("#")
+        name = name.strip()
+        if not name or name.lower().endswith(self.IMAGE_EXTS):
+            return match.group(0)
+        path = self.find_note(name)
+        if path is None:
+            if self.ATTACHMENT.search(name):
+                return match.group(0)
+            self._report_missing(name)
+            return match.group(0)[1:]
+        key = str(path)
+        if key in stack or len(stack) >= self.MAX_DEPTH:
+            self.reporter.emit(WARNING, "note.cycle", name=target, chain=" -> ".join(
+                Path(p).stem for p in stack + [key]))
+            return ""
+        try:
+            content = load_note(path).section(anchor)
+        except (OSError, UnicodeDecodeError):
+            self._report_missing(name)
+            return match.group(0)[1:]
+        if key not in self.notes:
+            self.notes.append(key)
+        if content is None:
+            self.reporter.emit(WARNING, "note.section_missing", name=name, anchor=anchor)
+            return match.group(0)[1:]
+        return self._expand(content, stack + [key])
+
+    def _report_missing(self, name: str):
+        if name not in self.missing:
+            self.missing.append(name)
+        self.reporter.emit(WARNING, "note.missing", name=name)
+
+    def find_note(self, name: str) -> Optional[Path]:
+        """按名称（可带相对路径与 .md）查找笔记：先试相对路径，再查库内索引"""
+        filename = name if name.lower().endswith(".md") else name + ".md"
+        if "/" in name:
+            for base in (self.input_dir, self.root):
+                candidate = base / filename
+                if candidate.is_file():
+                    return candidate.resolve()
+        key = Path(filename).stem.lower()
+        path = self._index().get(key)
+        if path is not None and path.is_file():
+            return path
+        root = str(self.root)
+        if self._refreshed or key in _NOTE_MISSES.get(root, ()):
+            return None
+        # 索引在进程内共享，可能早于笔记创建或删除；每次展开最多重建一次，
+        # 重建后仍找不到的名字记下来，之后的文章缺同一篇笔记时不再扫描整个库
+        self._refreshed = True
+        path = self._index(rebuild=True).get(key)
+        if path is not None and path.is_file():
+            return path
+        _NOTE_MISSES[root].add(key)
+        return None
+
+    def _index(self, rebuild: bool = False) -> Dict[str, Path]:
+        root = str(self.root)
+        index = _NOTE_INDEX.get(root)
+        if index is None or rebuild:
+            index = {}
+            # 同名笔记取路径最短的（离库根最近）
+            for path in sorted(self.root.rglob("*.md"), key=lambda p: (len(p.parts), str(p))):
+                if any(part.startswith(".") for part in path.relative_to(self.root).parts):
+                    continue
+                index.setdefault(path.stem.lower(), path.resolve())
+            _NOTE_INDEX[root] = index
+            _NOTE_MISSES[root] = set()
+        return index
 
 
 # ============================================
@@ -20,15 +1080,35 @@ from typing import Any, Dict, List, Tuple, Optional
 # ============================================
 
 class ImageExtractor:
-    """图片提取器，负责复制和重命名图片，支持 Obsidian 库"""
+    """图片提取器，负责复制和重命名图片，支持 Obsidian 库
+
+    多个转换（线程或进程）可以共用同一输出目录：文件名通过加锁的
+    images/.manifest.json 分配，相同内容复用同一文件名，写入采用临时文件加重命名。
+    """
+
+    MANIFEST_NAME = ".manifest.json"
+
+    # 同时匹配 Obsidian ![[filename|alt]] 与标准 ![alt](path)，单次扫描
+    IMAGE_PATTERN = re.compile(r'!\[\[(.*?)\]\]|!\[([^\]]*)\]\(([^\)]+)\)')
 
-    def __init__(self, input_dir: Path, output_dir: Path, assets_dirs: List[Path] = None):
+    def __init__(self, input_dir: Path, output_dir: Path, assets_dirs: List[Path] = None,
+                 probe: ImageProbe = None, fetcher: RemoteImageFetcher = None,
+                 reporter: Reporter = None):
+        self.reporter = reporter or Reporter()
         self.input_dir = Path(input_dir)
         self.output_dir = Path(output_dir)
         self.images_dir = self.output_dir / "images"
         self.assets_dirs = [Path(d) for d in (assets_dirs or [])]
         self.mapping: Dict[str, str] = {}
-        self.counter = 1
+        self.missing: List[str] = []
+        self.digests: Dict[str, str] = {}
+        self.dimensions: Dict[str, Tuple[int, int]] = {}
+        self.manifest_path = self.images_dir / self.MANIFEST_NAME
+        self.probe = probe or _IMAGE_PROBE
+        # fetcher 为 None 时远程图片保留原链接
+        self.fetcher = fetcher
+        self.remote_files: Dict[str, Optional[Path]] = {}
+        self._pending: List[Tuple[str, Optional[Path], str]] = []
         
         # 尝试检测 Obsidian 库根目录
         self.obsidian_root = self._detect_obsidian_root()
@@ -41,7 +1121,7 @@ class ImageExtractor:
         for _ in range(10):
             obsidian_config = current / ".obsidian"
             if obsidian_config.exists() and obsidian_config.is_dir():
-                print(f"[INFO] Detected Obsidian Vault Root: {current}")
+                self.reporter.emit(INFO, "vault.detected", root=current)
                 return current
             parent = current.parent
             if parent == current:  # 到达系统根目录
@@ -88,64 +1168,168 @@ class ImageExtractor:
 
     def extract_images(self, markdown: str) -> str:
         """从 Markdown 中提取图片并更新路径"""
-        self.images_dir.mkdir(parents=True, exist_ok=True)
+        markdown = self.resolve_images(markdown)
+        self.copy_images()
+        return markdown
+
+    def resolve_images(self, markdown: str) -> str:
+        """查找图片并分配文件名，返回更新路径后的 Markdown；复制留给 copy_images
 
-        # 处理 Obsidian Wiki 链接 ![[filename]] 或 ![[filename|alt]]
-        def replace_wiki_image(match):
+        两步分开后，复制可以与解析并行进行。
+        """
+        self.images_dir.mkdir(parents=True, exist_ok=True)
+        matches = list(self.IMAGE_PATTERN.finditer(markdown))
+
+        # 先收集远程图片并发下载
+        remote_urls = [
+            m.group(3).strip() for m in matches
+            if m.group(3) and RemoteImageFetcher.is_remote(m.group(3).strip())
+        ]
+        if remote_urls and self.fetcher:
+            self.remote_files.update(self.fetcher.fetch_all(remote_urls))
+
+        refs = [self._parse_ref(m) for m in matches]
+        sources: Dict[str, Optional[Path]] = {}
+        for ref in refs:
+            if ref and ref[1] not in sources:
+                sources[ref[1]] = self._find_image_file(ref[1])
+        names = self._allocate_names(sources)
+        self.reporter.count("images.resolved", sum(1 for source in sources.values() if source))
+        self._pending = [(path, source, names[path]) for path, source in sources.items()]
+
+        pieces = []
+        last = 0
+        for match, ref in zip(matches, refs):
+            pieces.append(markdown[last:match.start()])
+            if ref:
+                alt_text, original_path = ref
+                pieces.append(f'![{alt_text}](images/{names[original_path]})')
+            else:
+                pieces.append(match.group(0))
+            last = match.end()
+        pieces.append(markdown[last:])
+        return "".join(pieces)
+
+    def copy_images(self):
+        """复制 resolve_images 找到的图片"""
+        pending, self._pending = self._pending, []
+        for original_path, source_file, new_filename in pending:
+            self._copy_image(original_path, source_file, new_filename)
+
+    def _parse_ref(self, match) -> Optional[Tuple[str, str]]:
+        """解析图片引用为 (alt, 原始路径)；需保留原样时返回 None"""
+        if match.group(1) is not None:
+            # Obsidian Wiki 链接 ![[filename]] 或 ![[filename|alt]]
             content = match.group(1)
             if '|' in content:
                 filename, alt_text = content.split('|', 1)
             else:
                 filename, alt_text = content, content
-            
             # 清理文件名两侧空白
-            filename = filename.strip()
-            new_filename = self._copy_image(filename)
-            return f'![{alt_text}](images/{new_filename})'
-
-        # 先替换 Wiki 链接
-        markdown = re.sub(r'!\[\[(.*?)\]\]', replace_wiki_image, markdown)
-
-        # 处理标准 Markdown 链接 ![alt](path)
-        def replace_std_image(match):
-            alt_text = match.group(1)
-            original_path = match.group(2)
-            # 解码 URL (例如 "image%20name.png" -> "image name.png")
-            original_path = urllib.parse.unquote(original_path)
-            new_filename = self._copy_image(original_path)
-            return f'![{alt_text}](images/{new_filename})'
-
-        updated_markdown = re.sub(r'!\[([^\]]*)\]\(([^\)]+)\)', replace_std_image, markdown)
-        return updated_markdown
-
-    def _copy_image(self, original_path: str) -> str:
-        """复制图片到输出目录并重命名"""
-        source_file = self._find_image_file(original_path)
+            return alt_text, filename.strip()
+
+        # 标准 Markdown 链接 ![alt](path)
+        alt_text = match.group(2)
+        original_path = match.group(3).strip()
+        if RemoteImageFetcher.is_remote(original_path):
+            if not self.remote_files.get(original_path):
+                return None
+            return alt_text, original_path
+        # 解码 URL (例如 "image%20name.png" -> "image name.png")
+        return alt_text, urllib.parse.unquote(original_path)
+
+    def _image_key(self, original_path: str, source_file: Optional[Path]) -> Tuple[str, str]:
+        """返回 (清单键, 扩展名)：找到的图片按内容哈希，缺失的按原始路径"""
         if source_file:
             ext = source_file.suffix.lower()
             if ext not in ['.png', '.jpg', '.jpeg', '.gif', '.webp', '.svg']:
                 ext = '.png'
-        else:
-            ext = self._get_extension(original_path)
-        
-        new_filename = f"img_{self.counter:03d}{ext}"
-        self.counter += 1
-        
+            return f"{file_digest(source_file)}{ext}", ext
+        return f"missing:{original_path}", self._get_extension(original_path)
+
+    def _allocate_names(self, sources: Dict[str, Optional[Path]]) -> Dict[str, str]:
+        """在清单锁内一次性为本文档的所有图片分配文件名"""
+        keys = {path: self._image_key(path, src) for path, src in sources.items()}
+        names: Dict[str, str] = {}
+        with ManifestLock(self.images_dir / ".manifest.lock"):
+            manifest = self._load_manifest()
+            files = manifest["files"]
+            used = set(files.values())
+            changed = False
+            for original_path, (key, ext) in keys.items():
+                name = files.get(key)
+                if name is None:
+                    while True:
+                        name = f"img_{manifest['counter']:03d}{ext}"
+                        manifest["counter"] += 1
+                        # 跳过已被占用或目录中已有（旧版本遗留）的文件名
+                        if name not in used and not (self.images_dir / name).exists():
+                            break
+                    files[key] = name
+                    used.add(name)
+                    changed = True
+                names[original_path] = name
+            if changed:
+                self._save_manifest(manifest)
+        return names
+
+    def _load_manifest(self) -> Dict[str, Any]:
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+        manifest.setdefault("counter", 1)
+        manifest.setdefault("files", {})
+        return manifest
+
+    def _save_manifest(self, manifest: Dict[str, Any]):
+        tmp = self.manifest_path.with_name(f".manifest.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.manifest_path)
+
+    def _copy_image(self, original_path: str, source_file: Optional[Path], new_filename: str):
+        """复制图片到输出目录；文件名与内容一一对应，已存在时无需重复写入"""
         if not source_file:
-            print(f"[!] Image not found: {original_path} -> {new_filename} (Search paths: {len(self.search_paths)})", file=sys.stderr)
-            return new_filename
-            
+            self.missing.append(original_path)
+            self.reporter.count("images.missing")
+            self.reporter.emit(WARNING, "image.missing", path=original_path, name=new_filename,
+                               search_paths=len(self.search_paths))
+            return
+
         dest_file = self.images_dir / new_filename
         try:
-            shutil.copy2(source_file, dest_file)
-            print(f"[OK] {source_file.name} -> {new_filename}")
+            if dest_file.exists():
+                # 可能是优化后的版本，按实际内容记录哈希
+                digest = file_digest(dest_file)
+                self.reporter.count("images.reused")
+            else:
+                atomic_copy(source_file, dest_file)
+                digest = file_digest(source_file)
+                self.reporter.count("images.copied")
+                self.reporter.count("images.bytes_copied", source_file.stat().st_size)
+            self.reporter.emit(INFO, "image.copied", source=source_file.name, name=new_filename)
             self.mapping[str(source_file)] = new_filename
+            self.digests[new_filename] = digest
         except Exception as e:
-            print(f"[X] Copy failed: {source_file} - {e}", file=sys.stderr)
-        return new_filename
+            self.reporter.count("images.failed")
+            self.reporter.emit(ERROR, "image.copy_failed", source=source_file, error=e)
+
+    def probe_dimensions(self) -> Dict[str, Tuple[int, int]]:
+        """探测已复制图片的尺寸，返回 {相对 URL: (宽, 高)}"""
+        for new_filename, digest in self.digests.items():
+            size = self.probe.probe(self.images_dir / new_filename, digest)
+            if size and size[0] > 0 and size[1] > 0:
+                self.dimensions[f"images/{new_filename}"] = size
+        return self.dimensions
 
     def _find_image_file(self, original_path: str) -> Optional[Path]:
         """查找图片文件"""
+        # 0. 已下载的远程图片
+        if original_path in self.remote_files:
+            return self.remote_files[original_path]
+
         # 1. 尝试直接路径（绝对路径）
         direct_path = Path(original_path)
         if direct_path.exists() and direct_path.is_file():
@@ -197,36 +1381,888 @@ class ImageExtractor:
         return msg
 
 
+# ============================================
+# 图片优化 (可选，依赖 Pillow)
+# ============================================
+
+def _optimize_image_file(source: str, target: str, settings: Dict[str, Any]) -> bool:
+    """进程池任务：缩放并重新编码单张图片，丢弃 EXIF 等元数据
+
+    结果不比原图小且无需缩放时返回 False，由调用方保留原图。
+    """
+    src = Path(source)
+    with Image.open(src) as im:
+        im = ImageOps.exif_transpose(im)
+        # 宽度与总像素数都不超限：超长截图宽度不大，但解码后同样占用大量内存
+        scale = min(1.0, settings["max_width"] / im.width,
+                    math.sqrt(settings["max_pixels"] / (im.width * im.height)))
+        resized = scale < 1.0
+        if resized:
+            size = (max(1, int(im.width * scale)), max(1, int(im.height * scale)))
+            im = im.resize(size, Image.LANCZOS)
+
+        ext = src.suffix.lower()
+        params: Dict[str, Any] = {}
+        icc = im.info.get("icc_profile")
+        if icc:
+            params["icc_profile"] = icc
+        if ext in (".jpg", ".jpeg"):
+            if im.mode not in ("RGB", "L"):
+                im = im.convert("RGB")
+            params.update(format="JPEG", quality=settings["quality"], optimize=True, progressive=True)
+        elif ext == ".webp":
+            params.update(format="WEBP", quality=settings["quality"], method=6)
+        else:
+            params.update(format="PNG", optimize=True)
+
+        tmp = Path(f"{target}.{os.getpid()}.tmp")
+        im.save(tmp, **params)
+
+    if not resized and tmp.stat().st_size >= src.stat().st_size:
+        tmp.unlink()
+        return False
+    os.replace(tmp, target)
+    return True
+
+
+class ImageOptimizer:
+    """压缩超出体积、宽度或像素数限制的图片，结果按 (源内容哈希, 参数) 缓存
+
+    未安装 Pillow 时原样跳过。GIF（可能含动画）与 SVG 不处理。
+    """
+
+    SUPPORTED = ('.png', '.jpg', '.jpeg', '.webp')
+
+    def __init__(self, max_bytes: int = 1024 * 1024, max_width: int = 1080,
+                 quality: int = 85, workers: int = None, cache_root: Path = None,
+                 reporter: Reporter = None, max_pixels: int = 16 * 1024 * 1024):
+        self.reporter = reporter or Reporter()
+        self.settings = {"max_bytes": max_bytes, "max_width": max_width, "max_pixels": max_pixels,
+                         "quality": quality}
+        self.workers = workers
+        self.cache_root = Path(cache_root) if cache_root else None
+        self.optimized: List[str] = []
+
+    @property
+    def available(self) -> bool:
+        return Image is not None
+
+    def _cache_key(self, digest: str, ext: str) -> str:
+        payload = json.dumps([digest, ext, self.settings], sort_keys=True)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    def _needs_work(self, path: Path, size: Optional[Tuple[int, int]]) -> bool:
+        if path.suffix.lower() not in self.SUPPORTED:
+            return False
+        if path.stat().st_size > self.settings["max_bytes"]:
+            return True
+        return bool(size) and (size[0] > self.settings["max_width"]
+                               or size[0] * size[1] > self.settings["max_pixels"])
+
+    def optimize(self, extractor: "ImageExtractor") -> List[str]:
+        """优化提取器已复制的图片（原地替换），返回被改写的文件名"""
+        if not self.available:
+            self.reporter.emit(INFO, "optimize.unavailable")
+            return []
+        store = self.cache_root or cache_dir("optimized")
+        store.mkdir(parents=True, exist_ok=True)
+        self.optimized = []
+
+        jobs: Dict[str, Path] = {}
+        for new_filename, digest in extractor.digests.items():
+            dest = extractor.images_dir / new_filename
+            if not self._needs_work(dest, extractor.probe.probe(dest, digest)):
+                continue
+            cached = store / f"{self._cache_key(digest, dest.suffix.lower())}{dest.suffix.lower()}"
+            if not cached.exists():
+                jobs[new_filename] = cached
+
+        if jobs:
+            self._run_jobs(extractor, jobs)
+
+        for new_filename, digest in list(extractor.digests.items()):
+            dest = extractor.images_dir / new_filename
+            cached = store / f"{self._cache_key(digest, dest.suffix.lower())}{dest.suffix.lower()}"
+            if not cached.exists() or cached.stat().st_size == 0:
+                continue
+            atomic_copy(cached, dest)
+            optimized_digest = file_digest(dest)
+            extractor.digests[new_filename] = optimized_digest
+            # 已优化的文件下次会按新内容哈希复用；写入空标记，避免仍超限时被反复重编码
+            done = store / f"{self._cache_key(optimized_digest, dest.suffix.lower())}{dest.suffix.lower()}"
+            if not done.exists():
+                done.touch()
+            self.optimized.append(new_filename)
+            self.reporter.count("images.optimized")
+            self.reporter.emit(INFO, "optimize.done", name=new_filename)
+        return self.optimized
+
+    def _run_jobs(self, extractor: "ImageExtractor", jobs: Dict[str, Path]):
+        """在进程池中执行重编码；无收益的图片写入空标记文件，下次直接跳过"""
+        items = [(str(extractor.images_dir / name), cached) for name, cached in jobs.items()]
+        if len(items) == 1:
+            src, cached = items[0]
+            try:
+                if not _optimize_image_file(src, str(cached), self.settings):
+                    cached.touch()
+            except Exception as e:
+                self.reporter.count("images.optimize_failed")
+                self.reporter.emit(ERROR, "optimize.failed", source=src, error=e)
+            return
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = [
+                (pool.submit(_optimize_image_file, src, str(cached), self.settings), src, cached)
+                for src, cached in items
+            ]
+            for future, src, cached in futures:
+                try:
+                    if not future.result():
+                        cached.touch()
+                except Exception as e:
+                    self.reporter.count("images.optimize_failed")
+                    self.reporter.emit(ERROR, "optimize.failed", source=src, error=e)
+
+
+# ============================================
+# 单文件输出（图片内联）
+# ============================================
+
+class InlineImageWriter:
+    """把 images/ 中不超过阈值的图片以 base64 data URI 嵌入 HTML，其余保留相对链接
+
+    base64 按块编码后直接写入输出文件，编码结果按内容哈希缓存在本地缓存目录；
+    无论图片多大，内存中只保留一个块。
+    """
+
+    # 3 的倍数，保证每块编码后无填充，可直接拼接
+    CHUNK_SIZE = 3 * 64 * 1024
+
+    MIME_TYPES = {
+        ".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".gif": "image/gif",
+        ".webp": "image/webp", ".svg": "image/svg+xml",
+    }
+
+    SRC_PATTERN = re.compile(r'(<img src=")images/([^"/]+)(")')
+
+    def __init__(self, max_bytes: int = 256 * 1024, cache_root: Path = None, reporter: Reporter = None):
+        self.reporter = reporter or Reporter()
+        self.max_bytes = max_bytes
+        self.cache_root = Path(cache_root) if cache_root else None
+
+    def write(self, path: Path, html: Union[str, Iterable[str]], extractor: "ImageExtractor") -> bool:
+        """流式写出内联后的 HTML；内容与现有文件一致时跳过，返回是否写入
+
+        html 可以是逐块产出的片段（<img> 标签不会跨片段），边产出边内联写出。
+        """
+        store = self.cache_root or cache_dir("inline")
+        store.mkdir(parents=True, exist_ok=True)
+        chunks = [html] if isinstance(html, str) else html
+        return write_stream_if_changed(path, self._inline(chunks, extractor, store), self.reporter)
+
+    def _inline(self, chunks: Iterable[str], extractor: "ImageExtractor", store: Path) -> Iterator[bytes]:
+        for chunk in chunks:
+            last = 0
+            for m in self.SRC_PATTERN.finditer(chunk):
+                source = extractor.images_dir / m.group(2)
+                mime = self.MIME_TYPES.get(source.suffix.lower())
+                if not mime or not source.is_file() or source.stat().st_size > self.max_bytes:
+                    continue
+                yield chunk[last:m.start()].encode("utf-8")
+                yield f'{m.group(1)}data:{mime};base64,'.encode("ascii")
+                digest = extractor.digests.get(m.group(2)) or file_digest(source)
+                yield from self._stream_base64(source, store / f"{digest}.b64")
+                yield m.group(3).encode("ascii")
+                last = m.end()
+                self.reporter.count("images.inlined")
+            yield chunk[last:].encode("utf-8")
+
+    def _stream_base64(self, source: Path, cached: Path) -> Iterator[bytes]:
+        """产出图片的 base64 编码：命中缓存时直接读取，否则边编码边产出并写入缓存"""
+        try:
+            f = open(cached, "rb")
+        except OSError:
+            f = None
+        if f is not None:
+            with f:
+                yield from iter(lambda: f.read(self.CHUNK_SIZE), b"")
+            self.reporter.count("inline.cache_hits")
+            return
+
+        tmp = cached.with_name(f".{cached.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(source, "rb") as f, open(tmp, "wb") as cache:
+                for chunk in iter(lambda: f.read(self.CHUNK_SIZE), b""):
+                    encoded = base64.b64encode(chunk)
+                    cache.write(encoded)
+                    yield encoded
+            os.replace(tmp, cached)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+
+
 # ============================================
 # 主题加载系统
 # ============================================
 
+# 进程内主题缓存：路径 -> ((大小, 修改时间), 主题)
+_THEME_CACHE: Dict[str, Tuple[Tuple[int, int], Dict[str, Any]]] = {}
+
+
 class ThemeManager:
     """主题管理器，支持加载和切换主题"""
 
     def __init__(self, themes_dir: str = None):
         if themes_dir is None:
-            themes_dir = Path(__file__).parent / "themes"
+            # 脚本目录下的 themes/，或技能根目录下的 themes/
+            here = Path(__file__).parent
+            themes_dir = here / "themes"
+            if not themes_dir.exists():
+                themes_dir = here.parent / "themes"
         self.themes_dir = Path(themes_dir)
-        self._cache: Dict[str, Dict[str, Any]] = {}
 
     def list_themes(self) -> list[str]:
         """列出所有可用主题"""
         if not self.themes_dir.exists():
             return []
-        return [f.stem for f in self.themes_dir.glob("*.json") if f.name != "_schema"]
+        return [f.stem for f in self.themes_dir.glob("*.json") if f.stem != "_schema"]
+
+    def theme_path(self, name: str) -> Path:
+        """主题配置文件路径"""
+        return self.themes_dir / f"{name}.json"
 
     def load_theme(self, name: str) -> Dict[str, Any]:
-        """加载指定主题配置"""
-        if name in self._cache:
-            return self._cache[name]
-        theme_path = self.themes_dir / f"{name}.json"
-        if not theme_path.exists():
-            raise FileNotFoundError(f"Theme '{name}' not found: {theme_path}")
+        """加载指定主题配置
+
+        解析结果在进程内缓存，每次返回独立副本，调用方可自由修改；主题文件修改后自动重新加载。
+        """
+        theme_path = self.theme_path(name)
+        try:
+            stat = theme_path.stat()
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Theme '{name}' not found: {theme_path}") from None
+        signature = (stat.st_size, stat.st_mtime_ns)
+        cached = _THEME_CACHE.get(str(theme_path))
+        if cached is not None and cached[0] == signature:
+            _CACHE_STATS.count("theme.hits")
+            return copy.deepcopy(cached[1])
+        _CACHE_STATS.count("theme.misses")
         with open(theme_path, "r", encoding="utf-8") as f:
             theme = json.load(f)
-        self._cache[name] = theme
-        return theme
+        _THEME_CACHE[str(theme_path)] = (signature, theme)
+        return copy.deepcopy(theme)
+
+
+# ============================================
+# 代码高亮
+# ============================================
+
+def _words(*words: str) -> str:
+    return r"\b(?:" + "|".join(words) + r")\b"
+
+
+_DQ_STRING = r'"(?:[^"\\\n]|\\.)*"'
+_SQ_STRING = r"'(?:[^'\\\n]|\\.)*'"
+_TRIPLE_STRING = r'"""[\s\S]*?"""' + r"|'''[\s\S]*?'''"
+_C_COMMENT = r"//[^\n]*|/\*[\s\S]*?\*/"
+_NUMBER = r"\b(?:0[xXbBoO][0-9a-fA-F_]+|\d[\d_]*(?:\.\d+)?(?:[eE][+-]?\d+)?)[jJlLfFuU]?\b"
+_FUNCTION = r"\b[A-Za-z_]\w*(?=\s*\()"
+
+
+def _c_like(keywords: List[str], builtins: List[str],
+            extra: List[Tuple[str, str]] = None) -> List[Tuple[str, str]]:
+    """C 系语言（JS/Java/Go/Rust/C/C++ 等）共用的规则"""
+    return [
+        ("comment", _C_COMMENT),
+        ("string", r"`(?:[^`\\]|\\.)*`|" + _DQ_STRING + "|" + _SQ_STRING),
+    ] + (extra or []) + [
+        ("keyword", _words(*keywords)),
+        ("builtin", _words(*builtins)),
+        ("number", _NUMBER),
+        ("function", _FUNCTION),
+    ]
+
+
+# 词法表：语言 -> [(记号类型, 正则)]，每种语言组合为一个正则，首次使用时编译
+SYNTAX_RULES: Dict[str, List[Tuple[str, str]]] = {
+    "python": [
+        ("comment", r"#[^\n]*"),
+        ("string", r"(?:\b[rRbBuUfF]{1,2})?(?:" + _TRIPLE_STRING + "|" + _DQ_STRING + "|" + _SQ_STRING + ")"),
+        ("meta", r"@[\w.]+"),
+        ("keyword", _words("and", "as", "assert", "async", "await", "break", "class", "continue", "def",
+                           "del", "elif", "else", "except", "finally", "for", "from", "global", "if",
+                           "import", "in", "is", "lambda", "nonlocal", "not", "or", "pass", "raise",
+                           "return", "try", "while", "with", "yield")),
+        ("builtin", _words("True", "False", "None", "self", "cls", "print", "len", "range", "str", "int",
+                           "float", "list", "dict", "set", "tuple", "bool", "open", "super", "isinstance",
+                           "enumerate", "zip", "map", "filter", "sorted", "min", "max", "sum", "any", "all",
+                           "type", "object", "Exception")),
+        ("number", _NUMBER),
+        ("function", _FUNCTION),
+    ],
+    "javascript": _c_like(
+        ["async", "await", "break", "case", "catch", "class", "const", "continue", "default", "delete",
+         "do", "else", "export", "extends", "finally", "for", "from", "function", "if", "import", "in",
+         "instanceof", "let", "new", "of", "return", "static", "switch", "throw", "try", "typeof", "var",
+         "void", "while", "yield", "interface", "type", "enum", "implements", "readonly", "as"],
+        ["true", "false", "null", "undefined", "this", "console", "window", "document", "Math", "JSON",
+         "Promise", "Array", "Object", "String", "Number", "Boolean", "NaN", "Infinity", "require", "module"]),
+    "java": _c_like(
+        ["abstract", "break", "case", "catch", "class", "continue", "default", "do", "else", "enum",
+         "extends", "final", "finally", "for", "if", "implements", "import", "instanceof", "interface",
+         "new", "package", "private", "protected", "public", "return", "static", "super", "switch",
+         "synchronized", "this", "throw", "throws", "try", "void", "volatile", "while", "var", "record"],
+        ["true", "false", "null", "int", "long", "double", "float", "boolean", "char", "byte", "short",
+         "String", "System", "Integer", "List", "Map", "Object"],
+        [("meta", r"@\w+")]),
+    "c": _c_like(
+        ["auto", "break", "case", "catch", "class", "const", "constexpr", "continue", "default", "delete",
+         "do", "else", "enum", "extern", "for", "goto", "if", "inline", "namespace", "new", "operator",
+         "private", "protected", "public", "return", "sizeof", "static", "struct", "switch", "template",
+         "this", "throw", "try", "typedef", "typename", "union", "using", "virtual", "volatile", "while"],
+        ["int", "long", "short", "char", "float", "double", "void", "bool", "unsigned", "signed",
+         "size_t", "true", "false", "NULL", "nullptr", "std", "printf", "malloc", "free"],
+        [("meta", r"#\s*[a-z]+\b")]),
+    "go": _c_like(
+        ["break", "case", "chan", "const", "continue", "default", "defer", "else", "fallthrough", "for",
+         "func", "go", "goto", "if", "import", "interface", "map", "package", "range", "return", "select",
+         "struct", "switch", "type", "var"],
+        ["true", "false", "nil", "iota", "int", "int64", "uint", "float64", "string", "bool", "byte",
+         "rune", "error", "make", "new", "len", "cap", "append", "panic", "recover", "fmt"]),
+    "rust": _c_like(
+        ["as", "async", "await", "break", "const", "continue", "crate", "else", "enum", "extern", "fn",
+         "for", "if", "impl", "in", "let", "loop", "match", "mod", "move", "mut", "pub", "ref", "return",
+         "self", "Self", "static", "struct", "super", "trait", "type", "unsafe", "use", "where", "while"],
+        ["true", "false", "Some", "None", "Ok", "Err", "i32", "i64", "u8", "u32", "u64", "usize", "f64",
+         "bool", "str", "String", "Vec", "Option", "Result", "Box"],
+        [("meta", r"#!?\[[^\]\n]*\]|\b\w+!")]),
+    "bash": [
+        ("comment", r"(?<![\w$])#[^\n]*"),
+        ("string", _DQ_STRING + r"|'[^']*'"),
+        ("variable", r"\$\{[^}\n]*\}|\$\w+|\$[@#?$!*0-9]"),
+        ("keyword", _words("if", "then", "else", "elif", "fi", "for", "in", "do", "done", "case", "esac",
+                           "while", "until", "function", "return", "export", "local", "readonly", "set")),
+        ("builtin", _words("echo", "cd", "ls", "pwd", "cat", "grep", "sed", "awk", "source", "sudo", "git",
+                           "python", "python3", "pip", "npm", "npx", "node", "curl", "wget", "mkdir", "rm",
+                           "cp", "mv", "chmod", "chown", "docker", "make", "exit", "printf", "test")),
+        ("attr", r"(?<=\s)--?[A-Za-z][\w-]*"),
+        ("number", r"\b\d+\b"),
+    ],
+    "json": [
+        ("property", r'"(?:[^"\\\n]|\\.)*"(?=\s*:)'),
+        ("string", _DQ_STRING),
+        ("number", r"-?\b\d+(?:\.\d+)?(?:[eE][+-]?\d+)?\b"),
+        ("keyword", _words("true", "false", "null")),
+    ],
+    "yaml": [
+        ("comment", r"(?<!\S)#[^\n]*"),
+        ("property", r"(?<![\w.\-])[\w.\-]+(?=[ \t]*:(?:\s|$))"),
+        ("string", _DQ_STRING + "|" + _SQ_STRING),
+        ("keyword", _words("true", "false", "null", "yes", "no", "on", "off")),
+        ("number", r"-?\b\d+(?:\.\d+)?\b"),
+    ],
+    "sql": [
+        ("comment", r"--[^\n]*|/\*[\s\S]*?\*/"),
+        ("string", _SQ_STRING),
+        ("keyword", r"(?i:" + _words("select", "from", "where", "and", "or", "not", "insert", "into",
+                                     "values", "update", "set", "delete", "create", "table", "drop",
+                                     "alter", "join", "left", "right", "inner", "outer", "on", "as",
+                                     "group", "by", "order", "having", "limit", "offset", "distinct",
+                                     "union", "all", "null", "is", "in", "like", "between", "case",
+                                     "when", "then", "else", "end", "primary", "key", "index", "with") + ")"),
+        ("number", _NUMBER),
+        ("function", _FUNCTION),
+    ],
+    "css": [
+        ("comment", r"/\*[\s\S]*?\*/"),
+        ("string", _DQ_STRING + "|" + _SQ_STRING),
+        ("meta", r"@[\w-]+"),
+        ("property", r"[\w-]+(?=\s*:[^:{}]*[;}\n])"),
+        ("number", r"#[0-9a-fA-F]{3,8}\b|-?\b\d+(?:\.\d+)?(?:px|em|rem|%|vh|vw|s|ms|deg)?"),
+        ("tag", r"[.#]?[A-Za-z][\w-]*(?=[^{};]*\{)"),
+    ],
+    "html": [
+        ("comment", r"<!--[\s\S]*?-->"),
+        ("tag", r"</?[A-Za-z][\w:-]*|/?>"),
+        ("attr", r"\b[\w:-]+(?==)"),
+        ("string", _DQ_STRING + "|" + _SQ_STRING),
+    ],
+}
+
+SYNTAX_ALIASES = {
+    "py": "python", "python3": "python", "js": "javascript", "jsx": "javascript", "ts": "javascript",
+    "typescript": "javascript", "tsx": "javascript", "node": "javascript", "sh": "bash", "shell": "bash",
+    "zsh": "bash", "console": "bash", "yml": "yaml", "cpp": "c", "c++": "c", "h": "c", "hpp": "c",
+    "csharp": "c", "cs": "c", "kotlin": "java", "kt": "java", "golang": "go", "rs": "rust",
+    "xml": "html", "svg": "html", "vue": "html", "scss": "css", "less": "css", "jsonc": "json",
+    "mysql": "sql", "postgresql": "sql", "sqlite": "sql",
+}
+
+_COMPILED_SYNTAX: Dict[str, Tuple[Any, List[str]]] = {}
+_HIGHLIGHT_CACHE: "OrderedDict[Tuple[str, str, str], str]" = OrderedDict()
+_HIGHLIGHT_CACHE_SIZE = 1024
+_HIGHLIGHT_LOCK = threading.Lock()
+
+
+def _escape_code(code: str) -> str:
+    return code.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+class SyntaxHighlighter:
+    """按主题 syntax 样式高亮代码，输出带内联样式的 span
+
+    每种语言的规则组合为一个正则，一次 finditer 完成词法分析；
+    结果按 (语言, 代码哈希, 主题样式) 缓存，重复的代码块不会重复计算。
+    """
+
+    def __init__(self, styles: Dict[str, str]):
+        self.styles = styles
+        self.style_key = hashlib.sha1(json.dumps(styles, sort_keys=True).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def resolve_language(lang: str) -> Optional[str]:
+        lang = lang.split()[0].lower() if lang and lang.strip() else ""
+        lang = SYNTAX_ALIASES.get(lang, lang)
+        return lang if lang in SYNTAX_RULES else None
+
+    @staticmethod
+    def _compiled(lang: str) -> Tuple[Any, List[str]]:
+        compiled = _COMPILED_SYNTAX.get(lang)
+        if compiled is None:
+            rules = SYNTAX_RULES[lang]
+            pattern = re.compile("|".join(f"(?P<t{i}>{rx})" for i, (_, rx) in enumerate(rules)))
+            compiled = _COMPILED_SYNTAX[lang] = (pattern, [token for token, _ in rules])
+        return compiled
+
+    def highlight(self, lang: str, code: str) -> Optional[str]:
+        """返回高亮后的 HTML；不支持的语言返回 None"""
+        lang = self.resolve_language(lang)
+        if lang is None:
+            return None
+        key = (lang, hashlib.sha1(code.encode("utf-8")).hexdigest(), self.style_key)
+        with _HIGHLIGHT_LOCK:
+            cached = _HIGHLIGHT_CACHE.get(key)
+            if cached is not None:
+                _HIGHLIGHT_CACHE.move_to_end(key)
+                _CACHE_STATS.count("highlight.hits")
+                return cached
+        _CACHE_STATS.count("highlight.misses")
+
+        pattern, tokens = self._compiled(lang)
+        spans = {f"t{i}": self.styles.get(token) for i, token in enumerate(tokens)}
+        out = []
+        last = 0
+        for m in pattern.finditer(code):
+            style = spans[m.lastgroup]
+            if not style:
+                continue
+            start, end = m.span()
+            if start > last:
+                out.append(_escape_code(code[last:start]))
+            out.append(f'<span style="{style}">{_escape_code(m.group())}</span>')
+            last = end
+        out.append(_escape_code(code[last:]))
+        result = "".join(out)
+
+        with _HIGHLIGHT_LOCK:
+            _HIGHLIGHT_CACHE[key] = result
+            if len(_HIGHLIGHT_CACHE) > _HIGHLIGHT_CACHE_SIZE:
+                _HIGHLIGHT_CACHE.popitem(last=False)
+        return result
+
+
+# ============================================
+# 数学公式渲染
+# ============================================
+
+class MathRenderer:
+    """把常用 LaTeX 转换为微信可显示的静态 HTML（Unicode 符号 + sub/sup + 内联样式）
+
+    渲染结果按 (模式, 公式) 持久化缓存在本地缓存目录，同一系列文章中重复的公式只渲染一次。
+    无法识别的命令原样保留。
+    """
+
+    # 缓存格式版本，渲染逻辑变化时递增
+    VERSION = 1
+
+    SYMBOLS = {
+        # 希腊字母
+        "alpha": "α", "beta": "β", "gamma": "γ", "delta": "δ", "epsilon": "ϵ", "varepsilon": "ε",
+        "zeta": "ζ", "eta": "η", "theta": "θ", "vartheta": "ϑ", "iota": "ι", "kappa": "κ",
+        "lambda": "λ", "mu": "μ", "nu": "ν", "xi": "ξ", "pi": "π", "varpi": "ϖ", "rho": "ρ",
+        "sigma": "σ", "varsigma": "ς", "tau": "τ", "upsilon": "υ", "phi": "ϕ", "varphi": "φ",
+        "chi": "χ", "psi": "ψ", "omega": "ω",
+        "Gamma": "Γ", "Delta": "Δ", "Theta": "Θ", "Lambda": "Λ", "Xi": "Ξ", "Pi": "Π",
+        "Sigma": "Σ", "Upsilon": "Υ", "Phi": "Φ", "Psi": "Ψ", "Omega": "Ω",
+        # 运算与关系
+        "pm": "±", "mp": "∓", "times": "×", "div": "÷", "cdot": "·", "ast": "∗", "circ": "∘",
+        "leq": "≤", "le": "≤", "geq": "≥", "ge": "≥", "neq": "≠", "ne": "≠", "approx": "≈",
+        "equiv": "≡", "sim": "∼", "simeq": "≃", "cong": "≅", "propto": "∝", "ll": "≪", "gg": "≫",
+        "in": "∈", "notin": "∉", "ni": "∋", "subset": "⊂", "supset": "⊃", "subseteq": "⊆",
+        "supseteq": "⊇", "cup": "∪", "cap": "∩", "setminus": "∖", "emptyset": "∅", "varnothing": "∅",
+        "land": "∧", "wedge": "∧", "lor": "∨", "vee": "∨", "neg": "¬", "lnot": "¬",
+        "forall": "∀", "exists": "∃", "infty": "∞", "partial": "∂", "nabla": "∇",
+        "to": "→", "rightarrow": "→", "leftarrow": "←", "gets": "←", "leftrightarrow": "↔",
+        "Rightarrow": "⇒", "Leftarrow": "⇐", "Leftrightarrow": "⇔", "implies": "⇒", "iff": "⇔",
+        "mapsto": "↦", "uparrow": "↑", "downarrow": "↓", "mid": "∣", "vert": "|", "lvert": "|",
+        "rvert": "|", "Vert": "‖",
+        "sum": "∑", "prod": "∏", "coprod": "∐", "int": "∫", "iint": "∬", "iiint": "∭", "oint": "∮",
+        "ldots": "…", "cdots": "⋯", "vdots": "⋮", "ddots": "⋱", "dots": "…",
+        "angle": "∠", "perp": "⊥", "parallel": "∥", "degree": "°", "prime": "′", "hbar": "ℏ",
+        "ell": "ℓ", "Re": "ℜ", "Im": "ℑ", "aleph": "ℵ", "star": "⋆", "bullet": "•",
+        "langle": "⟨", "rangle": "⟩", "lfloor": "⌊", "rfloor": "⌋", "lceil": "⌈", "rceil": "⌉",
+        "\\": "<br />", "{": "{", "}": "}", "|": "‖", "%": "%", "$": "$", "&": "&amp;", "#": "#", "_": "_",
+        # 空白
+        ",": "\u2009", ":": "\u2005", ";": "\u2004", "!": "", " ": " ", "quad": "\u2003",
+        "qquad": "\u2003\u2003",
+    }
+    FUNCTIONS = {"sin", "cos", "tan", "cot", "sec", "csc", "arcsin", "arccos", "arctan", "sinh",
+                 "cosh", "tanh", "log", "ln", "lg", "exp", "lim", "max", "min", "sup", "inf",
+                 "det", "gcd", "deg", "dim", "ker", "arg", "Pr", "mod"}
+    BLACKBOARD = {"R": "ℝ", "N": "ℕ", "Z": "ℤ", "Q": "ℚ", "C": "ℂ", "P": "ℙ", "E": "𝔼"}
+    # 忽略的尺寸/定界命令，仅保留其后的定界符
+    IGNORED = {"left", "right", "big", "Big", "bigg", "Bigg", "bigl", "bigr", "Bigl", "Bigr",
+               "displaystyle", "textstyle", "limits", "nolimits"}
+    RELATIONS = set("=<>") | {"≤", "≥", "≠", "≈", "≡", "→", "⇒", "⇔", "∈", "±", "∓", "×", "÷", "+", "−"}
+
+    TOKEN = re.compile(r"\\([A-Za-z]+|.)|([{}^_])|(\s+)|(.)", re.DOTALL)
+
+    def __init__(self, cache_path: Path = None):
+        self.cache_path = cache_path
+        self._memo: Optional[Dict[str, str]] = None
+        self._dirty: Dict[str, str] = {}
+        # 解析状态保存在实例上，多线程共用时串行渲染
+        self._lock = threading.Lock()
+
+    # ---------- 缓存 ----------
+
+    def _cache_file(self) -> Path:
+        return self.cache_path or cache_dir("math") / "memo.json"
+
+    def _load(self) -> Dict[str, str]:
+        if self._memo is None:
+            with self._lock:
+                if self._memo is None:
+                    self._memo = self._read_memo()
+        return self._memo
+
+    def _read_memo(self) -> Dict[str, str]:
+        try:
+            with open(self._cache_file(), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        """把本次新渲染的公式合并写回持久缓存（文件锁内读-改-写）"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        if not dirty:
+            return
+        path = self._cache_file()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with ManifestLock(path.with_name(path.name + ".lock")):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    merged = json.load(f)
+            except (OSError, ValueError):
+                merged = {}
+            merged.update(dirty)
+            atomic_write_bytes(path, json.dumps(merged, ensure_ascii=False).encode("utf-8"))
+
+    def render(self, latex: str, display: bool = False) -> str:
+        """渲染公式，命中缓存时直接返回"""
+        key = hashlib.sha1(f"{self.VERSION}|{int(display)}|{latex}".encode("utf-8")).hexdigest()
+        memo = self._load()
+        html = memo.get(key)
+        if html is not None:
+            _CACHE_STATS.count("math.hits")
+        else:
+            _CACHE_STATS.count("math.misses")
+            with self._lock:
+                try:
+                    html = self._render(latex.strip())
+                except (IndexError, ValueError):
+                    html = _escape_code(latex)
+                memo[key] = html
+                self._dirty[key] = html
+        return html
+
+    # ---------- 解析 ----------
+
+    def _render(self, latex: str) -> str:
+        self._tokens = [m for m in self.TOKEN.finditer(latex)]
+        self._pos = 0
+        html = self._parse_group(top=True)
+        # 合并相邻的斜体变量
+        return html.replace("</i><i>", "").strip()
+
+    def _next(self):
+        token = self._tokens[self._pos]
+        self._pos += 1
+        return token
+
+    def _peek(self):
+        return self._tokens[self._pos] if self._pos < len(self._tokens) else None
+
+    def _parse_group(self, top: bool = False) -> str:
+        """解析到匹配的 } 或结尾"""
+        out = []
+        while self._pos < len(self._tokens):
+            token = self._peek()
+            if token.group(2) == "}":
+                if top:
+                    raise ValueError("unbalanced }")
+                self._pos += 1
+                return "".join(out).strip()
+            if token.group(2) in ("^", "_"):
+                self._pos += 1
+                tag = "sup" if token.group(2) == "^" else "sub"
+                out.append(f'<{tag} style="font-size: 75%;">{self._parse_argument()}</{tag}>')
+                continue
+            out.append(self._parse_atom())
+        if not top:
+            raise ValueError("missing }")
+        return "".join(out)
+
+    def _parse_argument(self) -> str:
+        """读取一个参数：{...} 或单个记号"""
+        token = self._peek()
+        while token is not None and token.group(3):
+            self._pos += 1
+            token = self._peek()
+        if token is None:
+            raise ValueError("missing argument")
+        if token.group(2) == "{":
+            self._pos += 1
+            return self._parse_group()
+        return self._parse_atom()
+
+    def _raw_argument(self) -> str:
+        """读取 {...} 中的原始文本（用于 \\text 等）"""
+        self._parse_whitespace()
+        token = self._next()
+        if token.group(2) != "{":
+            return _escape_code(token.group(0))
+        depth, parts = 1, []
+        while True:
+            token = self._next()
+            if token.group(2) == "{":
+                depth += 1
+            elif token.group(2) == "}":
+                depth -= 1
+                if depth == 0:
+                    return _escape_code("".join(parts))
+            parts.append(token.group(1) if token.group(1) in ("{", "}", "%", "$", "&", "#", "_") else token.group(0))
+
+    def _parse_whitespace(self):
+        while self._peek() is not None and self._peek().group(3):
+            self._pos += 1
+
+    def _parse_atom(self) -> str:
+        token = self._next()
+        command, brace, space, char = token.groups()
+        if space:
+            return ""
+        if brace == "{":
+            return self._parse_group()
+        if char is not None:
+            return self._render_char(char)
+        if command is None:
+            raise ValueError("unexpected token")
+
+        if command == "begin":
+            # 矩阵、对齐等环境不支持，整条公式保留原文
+            raise ValueError("unsupported environment")
+        if command in self.IGNORED:
+            # \left. / \right. 表示空定界符
+            if command in ("left", "right") and self._peek() is not None and self._peek().group(4) == ".":
+                self._pos += 1
+            return ""
+        if command in ("frac", "dfrac", "tfrac"):
+            num = self._parse_argument()
+            den = self._parse_argument()
+            return ('<span style="display: inline-block; vertical-align: middle; text-align: center; margin: 0 2px;">'
+                    f'<span style="display: block; padding: 0 3px; border-bottom: 1px solid;">{num}</span>'
+                    f'<span style="display: block; padding: 0 3px;">{den}</span></span>')
+        if command == "sqrt":
+            index = ""
+            if self._peek() is not None and self._peek().group(4) == "[":
+                self._pos += 1
+                parts = []
+                while self._peek() is not None and self._peek().group(4) != "]":
+                    parts.append(self._parse_atom())
+                if self._peek() is None:
+                    raise ValueError("missing ]")
+                self._pos += 1
+                index = f'<sup style="font-size: 60%; margin-right: -4px;">{"".join(parts)}</sup>'
+            body = self._parse_argument()
+            return f'{index}√<span style="border-top: 1px solid; padding: 0 1px;">{body}</span>'
+        if command in ("text", "textrm", "mathrm", "operatorname", "textit", "mbox"):
+            return f'<span style="font-style: normal;">{self._raw_argument()}</span>'
+        if command in ("mathbf", "textbf", "boldsymbol", "bm"):
+            return f'<b>{self._parse_argument()}</b>'
+        if command == "mathbb":
+            text = self._raw_argument()
+            return "".join(self.BLACKBOARD.get(c, c) for c in text)
+        if command in ("overline", "bar"):
+            return f'<span style="border-top: 1px solid;">{self._parse_argument()}</span>'
+        if command in ("hat", "widehat"):
+            return f'{self._parse_argument()}\u0302'
+        if command in ("vec", "overrightarrow"):
+            return f'{self._parse_argument()}\u20d7'
+        if command in ("dot",):
+            return f'{self._parse_argument()}\u0307'
+        if command in self.FUNCTIONS:
+            return f'<span style="font-style: normal;">{command}</span>\u2009'
+        symbol = self.SYMBOLS.get(command)
+        if symbol is not None:
+            return f" {symbol} " if symbol in self.RELATIONS else symbol
+        return _escape_code(token.group(0))
+
+    def _render_char(self, char: str) -> str:
+        if char == "-":
+            char = "−"
+        if char in self.RELATIONS:
+            return f" {_escape_code(char)} "
+        if char.isalpha() and char.isascii():
+            return f"<i>{char}</i>"
+        if char == "'":
+            return "′"
+        return _escape_code(char)
+
+
+# 默认共享的公式渲染器，缓存在进程内只加载一次
+_MATH_RENDERER = MathRenderer()
+
+
+# ============================================
+# 语法规则注册表
+# ============================================
+
+class BlockState:
+    """块级解析的状态：输出的块列表、当前列表类型、逐行接管函数与文档元数据"""
+
+    # capture 返回 RETRY 表示结束接管，且当前行交还给块级规则重新分发
+    RETRY = "retry"
+
+    def __init__(self, meta: Dict[str, Any]):
+        self.blocks: List[Tuple[Any, ...]] = []
+        self.meta = meta
+        self.list_kind: Optional[str] = None
+        # 非 None 时后续每一行都交给它处理（代码块等多行结构），返回 False 表示结束接管；
+        # 文档结束时以 None 调用一次
+        self.capture: Optional[Callable[[Optional[str]], Any]] = None
+        self.toc_index: Optional[int] = None
+
+    def add(self, kind: str, *args):
+        self.blocks.append((kind, *args))
+
+    def close_list(self):
+        if self.list_kind:
+            self.add("list_close", self.list_kind)
+            self.list_kind = None
+
+    def open_list(self, kind: str):
+        if self.list_kind != kind:
+            self.close_list()
+            self.add("list_open", kind)
+            self.list_kind = kind
+
+
+class _RuleMatch:
+    """把组合正则中某条规则的分组映射回规则自身的编号，处理函数可照常使用 match.group(n)"""
+
+    __slots__ = ("_match", "_offset", "_count")
+
+    def __init__(self, match, offset: int, count: int):
+        self._match = match
+        self._offset = offset
+        self._count = count
+
+    def group(self, index: int = 0) -> Optional[str]:
+        if index == 0:
+            return self._match.group(self._offset)
+        return self._match.group(self._offset + index)
+
+    def groups(self) -> Tuple[Optional[str], ...]:
+        return tuple(self._match.group(self._offset + i) for i in range(1, self._count + 1))
+
+
+class CompiledRules:
+    """编译后的规则：行内规则合成一个正则，块级规则按行首字符建立分发表"""
+
+    def __init__(self, block_rules: List[Dict[str, Any]], inline_rules: List[Dict[str, Any]],
+                 renderers: Dict[str, Callable]):
+        self.renderers = dict(renderers)
+
+        # 行首字符 -> 按优先级排列的候选规则；starts 为 None 的规则对所有字符生效
+        block_rules = sorted(block_rules, key=lambda r: r["priority"])
+        self.any_rules = [r for r in block_rules if r["starts"] is None]
+        self.block_table: Dict[str, List[Dict[str, Any]]] = {}
+        for char in {c for r in block_rules if r["starts"] for c in r["starts"]}:
+            self.block_table[char] = [r for r in block_rules if r["starts"] is None or char in r["starts"]]
+
+        # 每条行内规则包一层命名组，记录其分组在组合正则中的起始编号
+        inline_rules = sorted(inline_rules, key=lambda r: r["priority"])
+        parts = []
+        self.inline_handlers: Dict[str, Tuple[Callable, int, int]] = {}
+        group = 1
+        for i, rule in enumerate(inline_rules):
+            name = f"r{i}"
+            parts.append(f"(?P<{name}>{rule['pattern']})")
+            count = re.compile(rule["pattern"]).groups
+            self.inline_handlers[name] = (rule["handler"], group, count)
+            group += count + 1
+        self.inline_pattern = re.compile("|".join(parts)) if parts else None
+
+    def block_candidates(self, line: str) -> List[Dict[str, Any]]:
+        stripped = line.lstrip()
+        return self.block_table.get(stripped[:1], self.any_rules)
+
+
+class RuleRegistry:
+    """Markdown 语法规则注册表
+
+    块级规则：pattern 从行首匹配（re.match），starts 为可能的首个非空白字符（None 表示任意），
+    handler(parser, state, match) 向 state 添加块，返回 False 表示放弃、交给下一条规则。
+    行内规则：所有 pattern 组合为一个正则，整段文本只扫描一次；handler(parser, match) 返回 HTML。
+    行内 pattern 中不能使用编号反向引用。
+    renderer(parser, *args) 把同名块渲染为 HTML。
+
+    priority 数值小的先尝试。可以基于已有注册表复制后扩展：
+        rules = RuleRegistry(DEFAULT_RULES)
+        rules.add_inline("footnote", r"\\[\\^(\\w+)\\]", handle_footnote, priority=5)
+    """
+
+    def __init__(self, base: "RuleRegistry" = None):
+        self.block_rules: List[Dict[str, Any]] = list(base.block_rules) if base else []
+        self.inline_rules: List[Dict[str, Any]] = list(base.inline_rules) if base else []
+        self.renderers: Dict[str, Callable] = dict(base.renderers) if base else {}
+        self._compiled: Optional[CompiledRules] = None
+
+    def add_block(self, name: str, pattern: str, handler: Callable, starts: str = None,
+                  priority: int = 100):
+        self.block_rules = [r for r in self.block_rules if r["name"] != name]
+        self.block_rules.append({"name": name, "pattern": re.compile(pattern), "handler": handler,
+                                 "starts": starts, "priority": priority})
+        self._compiled = None
+
+    def add_inline(self, name: str, pattern: str, handler: Callable, priority: int = 100):
+        self.inline_rules = [r for r in self.inline_rules if r["name"] != name]
+        self.inline_rules.append({"name": name, "pattern": pattern, "handler": handler,
+                                  "priority": priority})
+        self._compiled = None
+
+    def add_renderer(self, kind: str, renderer: Callable):
+        self.renderers[kind] = renderer
+        self._compiled = None
+
+    def compile(self) -> CompiledRules:
+        """编译规则，结果缓存到下次修改注册表为止"""
+        if self._compiled is None:
+            self._compiled = CompiledRules(self.block_rules, self.inline_rules, self.renderers)
+        return self._compiled
 
 
 # ============================================
@@ -234,159 +2270,383 @@ class ThemeManager:
 # ============================================
 
 class MarkdownParser:
-    """轻量级 Markdown 解析器，针对微信文章优化"""
-
-    def __init__(self, theme: Dict[str, Any], use_real_images: bool = True):
+    """轻量级 Markdown 解析器，针对微信文章优化
+
+    parse 的同一次逐行扫描中顺带收集文档元数据（front matter、目录、字数、阅读时长），
+    结果保存在 self.metadata。块级与行内语法由 RuleRegistry 定义，传入 rules 可扩展语法。
+    """
+
+    CJK_PATTERN = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af]')
+    WORD_PATTERN = re.compile(r"[A-Za-z0-9]+(?:['’.\-][A-Za-z0-9]+)*")
+    # 统计字数时去掉链接/图片地址和 HTML 标签
+    MARKUP_PATTERN = re.compile(r'\]\([^)]*\)|<[^>]+>')
+    # 阅读速度：中文 400 字/分钟，英文 200 词/分钟，每张图片 12 秒
+    CJK_PER_MINUTE = 400
+    WORDS_PER_MINUTE = 200
+    SECONDS_PER_IMAGE = 12
+    # 脚注式链接只处理外部链接；公众号文章链接在微信内可以直接点击，保持原样
+    FOOTNOTE_URL = re.compile(r'https?://', re.IGNORECASE)
+    WECHAT_URL = re.compile(r'https?://mp\.weixin\.qq\.com/', re.IGNORECASE)
+    TABLE_DELIMITER = re.compile(r'\s*\|?\s*:?-+:?\s*(?:\|\s*:?-+:?\s*)*\|?\s*\Z')
+    # 主题未定义 table 样式时的默认值
+    TABLE_DEFAULTS = {
+        "wrapper": "overflow-x: auto; margin-bottom: 15px;",
+        "table": "width: 100%; border-collapse: collapse; font-size: 14px;",
+        "th": "border: 1px solid #d0d7de; padding: 6px 10px; font-weight: bold;",
+        "td": "border: 1px solid #d0d7de; padding: 6px 10px;",
+    }
+
+    def __init__(self, theme: Dict[str, Any], use_real_images: bool = True,
+                 image_sizes: Dict[str, Tuple[int, int]] = None, math: MathRenderer = None,
+                 inject_toc: bool = False, rules: RuleRegistry = None,
+                 footnote_links: bool = False):
         self.theme = theme
+        self.footnote_links = footnote_links
+        # 脚注式链接：URL -> (编号, 首次出现的链接文字)，按 URL 去重
+        self.footnotes: "OrderedDict[str, Tuple[int, str]]" = OrderedDict()
+        self.rules = (rules or DEFAULT_RULES).compile()
+        self.inject_toc = inject_toc
+        self.metadata: Dict[str, Any] = {}
         self.use_real_images = use_real_images
+        self.image_sizes = image_sizes or {}
+        syntax = theme["components"].get("syntax")
+        self.highlighter = SyntaxHighlighter(syntax) if syntax else None
+        self.math = math or _MATH_RENDERER
+
+    def parse_with_metadata(self, markdown: str) -> Tuple[str, Dict[str, Any]]:
+        """解析 Markdown，返回 (HTML, 元数据)"""
+        html = self.parse(markdown)
+        return html, self.metadata
 
     def parse(self, markdown: str) -> str:
         """将 Markdown 解析为 HTML"""
+        return self.render_blocks(self.parse_blocks(markdown))
+
+    def parse_blocks(self, markdown: str) -> List[Tuple[Any, ...]]:
+        """逐行扫描得到与主题无关的块列表 [(类型, 参数...)]，同时收集元数据"""
         lines = markdown.split("\n")
-        html_lines = []
-        in_code_block = False
-        code_lang = ""
-        code_content = []
-        in_details = False
-        details_content = []
-        in_ul = False
-        in_ol = False
-        list_items = []
-
-        for line in lines:
-            # 处理折叠块
-            if line.strip().startswith("<details>"):
-                style = self.theme["components"]["blocks"].get("details", "")
-                html_lines.append(f'<details style="{style}">')
-                continue
-            elif line.strip().startswith("<summary>"):
-                style = self.theme["components"]["blocks"].get("summary", "")
-                content = line.replace("<summary>", "").replace("</summary>", "").strip()
-                html_lines.append(f'<summary style="{style}">{self._inline_parse(content)}</summary>')
+        meta = self.metadata = {
+            "title": None, "front_matter": {}, "toc": [],
+            "words": 0, "cjk_chars": 0, "images": 0, "code_lines": 0, "reading_minutes": 0,
+        }
+        body_start = self._parse_front_matter(lines, meta)
+        if meta["front_matter"].get("title"):
+            meta["title"] = str(meta["front_matter"]["title"])
+        state = BlockState(meta)
+
+        for line in itertools.islice(lines, body_start, None):
+            if state.capture is not None:
+                result = state.capture(line)
+                if result is not False and result is not BlockState.RETRY:
+                    continue
+                state.capture = None
+                if result is False:
+                    continue
+
+            # 空行 - 保持列表状态
+            if not line.strip():
                 continue
-            elif line.strip().startswith("</details>"):
-                html_lines.append('</details>')
+            if self.inject_toc and line.strip().lower() == "[toc]":
+                # 目录不能落在列表内部
+                state.close_list()
+                state.toc_index = len(state.blocks)
                 continue
 
-            # 代码块处理
-            if line.startswith("```"):
-                # 先处理未完成的列表
-                if in_ul:
-                    html_lines.append(self._render_ul_close())
-                    in_ul = False
-                elif in_ol:
-                    html_lines.append(self._render_ol_close())
-                    in_ol = False
-
-                if not in_code_block:
-                    in_code_block = True
-                    code_lang = line[3:].strip() or "text"
-                else:
-                    html_lines.append(self._render_code_block(code_lang, "\n".join(code_content)))
-                    code_content = []
-                    in_code_block = False
-                continue
+            for rule in self.rules.block_candidates(line):
+                match = rule["pattern"].match(line)
+                if match and rule["handler"](self, state, match) is not False:
+                    break
+            # 开启多行结构的行（如 ```lang）不计入正文字数
+            if state.capture is None:
+                self._count_text(line, meta)
 
-            if in_code_block:
-                code_content.append(line)
-                continue
+        if state.capture is not None:
+            state.capture(None)
+        # 结束未关闭的列表
+        state.close_list()
+
+        meta["reading_minutes"] = self._reading_minutes(meta)
+        if self.inject_toc and meta["toc"]:
+            state.blocks.insert(state.toc_index or 0, ("toc",))
+        return state.blocks
+
+    def render_blocks(self, blocks: List[Tuple[Any, ...]]) -> str:
+        """按主题渲染块列表"""
+        return "\n".join(self.iter_render(blocks))
+
+    def iter_render(self, blocks: List[Tuple[Any, ...]]):
+        """逐块产出 HTML；脚注式链接的参考资料在最后产出"""
+        renderers = self.rules.renderers
+        self.footnotes = OrderedDict()
+        for block in blocks:
+            yield renderers[block[0]](self, *block[1:])
+        if self.footnotes:
+            yield self._render_footnotes()
+
+    # ---------- 块级规则 ----------
+
+    def _block_fence(self, state: BlockState, match) -> None:
+        # 先处理未完成的列表
+        state.close_list()
+        lang = match.group(1).strip() or "text"
+        code_content = []
 
-            # 标题处理 - 先结束未完成的列表
-            if line.startswith("#### ") or line.startswith("### ") or line.startswith("## "):
-                if in_ul:
-                    html_lines.append(self._render_ul_close())
-                    in_ul = False
-                elif in_ol:
-                    html_lines.append(self._render_ol_close())
-                    in_ol = False
-
-            if line.startswith("#### "):
-                html_lines.append(self._render_h4(line[5:]))
-            elif line.startswith("### "):
-                html_lines.append(self._render_h3(line[4:]))
-            elif line.startswith("## "):
-                html_lines.append(self._render_h2(line[3:]))
-            # 水平线
-            elif line.strip() == "---":
-                if in_ul:
-                    html_lines.append(self._render_ul_close())
-                    in_ul = False
-                elif in_ol:
-                    html_lines.append(self._render_ol_close())
-                    in_ol = False
-                html_lines.append(self._render_hr())
-            # 引用块
-            elif line.startswith("> "):
-                if in_ul:
-                    html_lines.append(self._render_ul_close())
-                    in_ul = False
-                elif in_ol:
-                    html_lines.append(self._render_ol_close())
-                    in_ol = False
-                html_lines.append(self._render_quote(line[2:]))
-            # 任务列表
-            elif re.match(r'^[\s]*[-*+]\s*\[[x\s]\]', line):
-                list_type = "ul"  # 任务列表属于无序列表
-                if list_type == "ul" and not in_ul:
-                    if in_ol:
-                        html_lines.append(self._render_ol_close())
-                        in_ol = False
-                    html_lines.append(self._render_ul_open())
-                    in_ul = True
-                elif list_type == "ol" and not in_ol:
-                    if in_ul:
-                        html_lines.append(self._render_ul_close())
-                        in_ul = False
-                    html_lines.append(self._render_ol_open())
-                    in_ol = True
-                html_lines.append(self._render_task_item(line))
-            # 图片
-            elif line.startswith("![") and "](" in line:
-                if in_ul:
-                    html_lines.append(self._render_ul_close())
-                    in_ul = False
-                elif in_ol:
-                    html_lines.append(self._render_ol_close())
-                    in_ol = False
-                html_lines.append(self._render_image(line))
-            # 空行 - 保持列表状态
-            elif line.strip() == "":
-                continue
-            # 无序列表项
-            elif re.match(r'^[\s]*[-*+]\s', line):
-                if not in_ul:
-                    if in_ol:
-                        html_lines.append(self._render_ol_close())
-                        in_ol = False
-                    html_lines.append(self._render_ul_open())
-                    in_ul = True
-                html_lines.append(self._render_list_item(line, False))
-            # 有序列表项
-            elif re.match(r'^[\s]*\d+\.\s', line):
-                if not in_ol:
-                    if in_ul:
-                        html_lines.append(self._render_ul_close())
-                        in_ul = False
-                    html_lines.append(self._render_ol_open())
-                    in_ol = True
-                html_lines.append(self._render_list_item(line, True))
-            # 普通段落
+        def capture(line: Optional[str]) -> bool:
+            # line 为 None 表示文档结束，未闭合的代码块直接丢弃
+            if line is None or line.startswith("```"):
+                if line is not None:
+                    state.add("code", lang, "\n".join(code_content))
+                return False
+            code_content.append(line)
+            state.meta["code_lines"] += 1
+            return True
+
+        state.capture = capture
+
+    def _block_details(self, state: BlockState, match) -> None:
+        state.add("details_open")
+
+    def _block_summary(self, state: BlockState, match) -> None:
+        line = match.string
+        state.add("summary", line.replace("<summary>", "").replace("</summary>", "").strip())
+
+    def _block_details_close(self, state: BlockState, match) -> None:
+        state.add("details_close")
+
+    def _block_heading(self, state: BlockState, match) -> None:
+        state.close_list()
+        level = len(match.group(1))
+        state.meta["toc"].append({"level": level, "text": match.group(2).strip()})
+        state.add("heading", level, match.group(2))
+
+    def _block_hr(self, state: BlockState, match) -> None:
+        state.close_list()
+        state.add("hr")
+
+    def _block_quote(self, state: BlockState, match) -> None:
+        state.close_list()
+        state.add("quote", match.group(1))
+
+    def _block_task(self, state: BlockState, match) -> None:
+        # 任务列表属于无序列表
+        state.open_list("ul")
+        state.add("task", match.group(1).lower() == "x", match.group(2))
+
+    def _block_image(self, state: BlockState, match) -> Optional[bool]:
+        line = match.string
+        if "](" not in line:
+            return False
+        state.close_list()
+        image = re.match(r'!\[([^\]]*)\]\(([^\)]+)\)', line)
+        if image:
+            state.add("image", *image.groups())
+        else:
+            state.add("raw", "")
+        return None
+
+    def _block_list_item(self, state: BlockState, match) -> None:
+        state.open_list("ol" if match.group(1)[0].isdigit() else "ul")
+        state.add("item", match.group(2))
+
+    def _block_table(self, state: BlockState, match) -> None:
+        """GFM 表格：表头行之后必须是列数一致的分隔行，否则表头按段落处理
+
+        对齐方式与列数在分隔行确定一次，每个数据行单独成块并补齐/截断到表头列数；
+        写出文件时逐行渲染、逐行写出，大表格不会整张拼成字符串。
+        """
+        header_line = match.string
+        header = self._split_table_row(header_line)
+
+        def capture_rows(line: Optional[str]):
+            if line is None or not line.strip() or "|" not in line:
+                state.add("table_close")
+                return False if line is None or not line.strip() else BlockState.RETRY
+            cells = self._split_table_row(line)
+            state.add("table_row", (cells + [""] * len(header))[:len(header)])
+            self._count_text(line, state.meta)
+            return True
+
+        def capture_delimiter(line: Optional[str]):
+            aligns = self._parse_table_alignment(line, len(header)) if line is not None else None
+            self._count_text(header_line, state.meta)
+            if aligns is None:
+                self._block_paragraph(state, match)
+                return BlockState.RETRY
+            state.close_list()
+            state.add("table_open", aligns)
+            state.add("table_head", header)
+            state.capture = capture_rows
+            return True
+
+        state.capture = capture_delimiter
+
+    @staticmethod
+    def _split_table_row(line: str) -> List[str]:
+        row = line.strip()
+        if row.startswith("|"):
+            row = row[1:]
+        if row.endswith("|") and not row.endswith("\\|"):
+            row = row[:-1]
+        return [cell.strip().replace("\\|", "|") for cell in re.split(r"(?<!\\)\|", row)]
+
+    def _parse_table_alignment(self, line: str, columns: int) -> Optional[List[Optional[str]]]:
+        """解析分隔行，返回每列对齐方式；不是分隔行或列数不符时返回 None"""
+        if "|" not in line or "-" not in line or not self.TABLE_DELIMITER.match(line):
+            return None
+        cells = self._split_table_row(line)
+        if len(cells) != columns:
+            return None
+        aligns = []
+        for cell in cells:
+            if cell.startswith(":") and cell.endswith(":"):
+                aligns.append("center")
+            elif cell.endswith(":"):
+                aligns.append("right")
+            elif cell.startswith(":"):
+                aligns.append("left")
             else:
-                if in_ul:
-                    html_lines.append(self._render_ul_close())
-                    in_ul = False
-                elif in_ol:
-                    html_lines.append(self._render_ol_close())
-                    in_ol = False
-                html_lines.append(self._render_paragraph(line))
+                aligns.append(None)
+        return aligns
 
-        # 结束未关闭的列表
-        if in_ul:
-            html_lines.append(self._render_ul_close())
-        elif in_ol:
-            html_lines.append(self._render_ol_close())
+    def _block_paragraph(self, state: BlockState, match) -> None:
+        state.close_list()
+        state.add("paragraph", match.string)
+
+    # ---------- 块渲染 ----------
+
+    def _render_details_open(self) -> str:
+        style = self.theme["components"]["blocks"].get("details", "")
+        return f'<details style="{style}">'
+
+    def _render_summary(self, text: str) -> str:
+        style = self.theme["components"]["blocks"].get("summary", "")
+        return f'<summary style="{style}">{self._inline_parse(text)}</summary>'
+
+    def _render_details_close(self) -> str:
+        return '</details>'
+
+    def _render_heading(self, level: int, text: str) -> str:
+        return getattr(self, f"_render_h{level}")(text)
 
-        return "\n".join(html_lines)
+    def _render_list_open(self, kind: str) -> str:
+        return self._render_ol_open() if kind == "ol" else self._render_ul_open()
+
+    def _render_list_close(self, kind: str) -> str:
+        return self._render_ol_close() if kind == "ol" else self._render_ul_close()
+
+    def _render_toc_block(self) -> str:
+        return self._render_toc(self.metadata["toc"])
+
+    def _render_raw(self, html: str) -> str:
+        return html
+
+    def _render_table_open(self, aligns: List[Optional[str]]) -> str:
+        """表格开始：按列预先算好单元格样式，之后每行只做拼接"""
+        styles = dict(self.TABLE_DEFAULTS, **self.theme["components"].get("table", {}))
+        self._table_cells = tuple(
+            [f'<{tag} style="{styles[tag]}{f" text-align: {align};" if align else ""}">' for align in aligns]
+            for tag in ("th", "td")
+        )
+        return f'<section style="{styles["wrapper"]}"><table style="{styles["table"]}">'
+
+    def _render_table_head(self, cells: List[str]) -> str:
+        return self._render_table_cells(cells, self._table_cells[0], "th", "<thead>") + "</thead><tbody>"
+
+    def _render_table_row(self, cells: List[str]) -> str:
+        return self._render_table_cells(cells, self._table_cells[1], "td", "")
+
+    def _render_table_cells(self, cells: List[str], opens: List[str], tag: str, prefix: str) -> str:
+        inline = self._inline_parse
+        return prefix + "<tr>" + "".join(
+            f"{open_tag}{inline(cell)}</{tag}>" for open_tag, cell in zip(opens, cells)) + "</tr>"
+
+    def _render_table_close(self) -> str:
+        return "</tbody></table></section>"
+
+    def _parse_front_matter(self, lines: List[str], meta: Dict[str, Any]) -> int:
+        """解析开头的 YAML front matter，返回正文起始行号
+
+        只向前查看到结束分隔符为止；遇到不像 YAML 的行则视为普通内容。
+        """
+        if not lines or lines[0].strip() != "---":
+            return 0
+        for i in range(1, len(lines)):
+            line = lines[i]
+            if line.strip() in ("---", "..."):
+                if i == 1:
+                    return 0
+                text = "\n".join(lines[1:i])
+                meta["front_matter"] = self._load_yaml(text)
+                return i + 1
+            stripped = line.strip()
+            if stripped and not stripped.startswith("#") and not line[0].isspace() \
+                    and not stripped.startswith("- ") and ":" not in stripped:
+                return 0
+        return 0
+
+    def _load_yaml(self, text: str) -> Dict[str, Any]:
+        """优先使用 PyYAML；未安装时支持 key: value、行内列表与 - 列表项"""
+        if yaml is not None:
+            try:
+                data = yaml.safe_load(text)
+                return data if isinstance(data, dict) else {}
+            except yaml.YAMLError:
+                return {}
+        data: Dict[str, Any] = {}
+        key = None
+        for line in text.split("\n"):
+            stripped = line.strip()
+            if not stripped or stripped.startswith("#"):
+                continue
+            if stripped.startswith("- ") and key:
+                if not isinstance(data.get(key), list):
+                    data[key] = []
+                data[key].append(stripped[2:].strip().strip("\"'"))
+                continue
+            if ":" in stripped and not line[0].isspace():
+                key, value = stripped.split(":", 1)
+                key, value = key.strip(), value.strip()
+                if value.startswith("[") and value.endswith("]"):
+                    data[key] = [v.strip().strip("\"'") for v in value[1:-1].split(",") if v.strip()]
+                else:
+                    data[key] = value.strip("\"'") if value else None
+        return data
+
+    def _count_text(self, line: str, meta: Dict[str, Any]):
+        """统计一行的中文字符、英文单词与图片数量"""
+        if not line.strip():
+            return
+        if meta["title"] is None and line.startswith("# "):
+            meta["title"] = line[2:].strip()
+        meta["images"] += line.count("![")
+        text = self.MARKUP_PATTERN.sub("]", line) if ("](" in line or "<" in line) else line
+        meta["cjk_chars"] += len(self.CJK_PATTERN.findall(text))
+        meta["words"] += len(self.WORD_PATTERN.findall(text))
+
+    def _reading_minutes(self, meta: Dict[str, Any]) -> int:
+        minutes = (meta["cjk_chars"] / self.CJK_PER_MINUTE
+                   + meta["words"] / self.WORDS_PER_MINUTE
+                   + meta["images"] * self.SECONDS_PER_IMAGE / 60)
+        return max(1, math.ceil(minutes)) if minutes else 0
+
+    def _render_toc(self, toc: List[Dict[str, Any]]) -> str:
+        """渲染目录；主题未定义 toc 样式时沿用引用块、加粗与列表项样式"""
+        components = self.theme["components"]
+        toc_theme = components.get("toc", {})
+        blocks = components["blocks"]
+        container = toc_theme.get("container", blocks.get("quote_default", blocks["quote_tip"]))
+        title_style = toc_theme.get("title", components["text"]["strong"])
+        item_style = toc_theme.get("item", components["lists"]["li"])
+        top = min(entry["level"] for entry in toc)
+        items = "\n".join(
+            f'<p style="{item_style} padding-left: {(entry["level"] - top) * 16}px;">'
+            f'{self._inline_parse(entry["text"])}</p>'
+            for entry in toc
+        )
+        return f'''<section style="{container}">
+<p style="{title_style}">目录</p>
+{items}
+</section>'''
 
     def _render_ul_open(self) -> str:
         style = self.theme["components"]["lists"].get("ul", "")
@@ -430,7 +2690,8 @@ class MarkdownParser:
 
     def _render_code_block(self, lang: str, code: str) -> str:
         style = self.theme["components"]["blocks"]["code_block"]
-        escaped = code.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+        highlighted = self.highlighter.highlight(lang, code) if self.highlighter else None
+        escaped = highlighted if highlighted is not None else _escape_code(code)
         return f'<pre style="{style}"><code>{escaped}</code></pre>'
 
     def _render_quote(self, text: str) -> str:
@@ -455,112 +2716,183 @@ class MarkdownParser:
                      self.theme["components"]["blocks"]["quote_tip"])
         return f'<blockquote style="{style}">{self._inline_parse(text)}</blockquote>'
 
-    def _render_task_item(self, line: str) -> str:
+    def _render_task(self, checked: bool, content: str) -> str:
         """渲染任务列表项"""
-        match = re.match(r'^[\s]*[-*+]\s*\[([x\s])\]\s*(.*)', line, re.IGNORECASE)
-        if match:
-            checked = match.group(1).lower() == 'x'
-            content = match.group(2)
-            li_style = self.theme["components"]["lists"]["li"]
-            if checked:
-                item_style = self.theme["components"]["lists"]["task_checked"]
-                symbol = "&#10003;"
-            else:
-                item_style = self.theme["components"]["lists"]["task_unchecked"]
-                symbol = "&#9724;"
-            return f'<li style="{li_style}"><span style="{item_style}">{symbol}</span> {self._inline_parse(content)}</li>'
-        return self._render_list_item(line, False)
+        li_style = self.theme["components"]["lists"]["li"]
+        if checked:
+            item_style = self.theme["components"]["lists"]["task_checked"]
+            symbol = "&#10003;"
+        else:
+            item_style = self.theme["components"]["lists"]["task_unchecked"]
+            symbol = "&#9724;"
+        return f'<li style="{li_style}"><span style="{item_style}">{symbol}</span> {self._inline_parse(content)}</li>'
 
-    def _render_list_item(self, line: str, ordered: bool) -> str:
+    def _render_item(self, content: str) -> str:
         """渲染普通列表项"""
-        match = re.match(r'^[\s]*([-*+]|\d+\.)\s+(.*)', line)
-        if match:
-            content = match.group(2)
-            li_style = self.theme["components"]["lists"]["li"]
-            return f'<li style="{li_style}">{self._inline_parse(content)}</li>'
-        return f'<li>{line}</li>'
-
-    def _render_image(self, line: str) -> str:
-        match = re.match(r'!\[([^\]]*)\]\(([^\)]+)\)', line)
-        if match:
-            alt, url = match.groups()
-            if self.use_real_images:
-                img_style = self.theme["components"]["media"].get("image",
-                    "max-width: 100%; height: auto; display: block; margin: 15px 0;")
-                return f'<img src="{url}" alt="{alt}" style="{img_style}" />'
-            else:
-                style = self.theme["components"]["media"]["image_placeholder"]
-                return f'<section style="{style}">[Image: {alt}]</section>'
-        return ""
+        li_style = self.theme["components"]["lists"]["li"]
+        return f'<li style="{li_style}">{self._inline_parse(content)}</li>'
 
     def _render_hr(self) -> str:
         style = self.theme["components"]["blocks"]["hr"]
         return f'<hr style="{style}">'
 
     def _inline_parse(self, text: str) -> str:
-        """行内元素解析"""
-        # 数学公式（优先处理）
-        text = re.sub(r'\$\$([^$]+)\$\$', self._replace_math_block, text)
-        text = re.sub(r'\$([^$]+)\$', self._replace_math_inline, text)
-        # 行内图片 ![alt](url) - 需要在其他替换之前处理
-        text = re.sub(r'!\[([^\]]*)\]\(([^\)]+)\)', self._replace_inline_image, text)
-        # 删除线
-        text = re.sub(r'~~([^~]+)~~', self._replace_strikethrough, text)
-        # 高亮 ==text== 或 ==text==
-        text = re.sub(r'==([^=]+)==', self._replace_highlight, text)
-        # 加粗 **text**
-        text = re.sub(r'\*\*([^*]+)\*\*', self._replace_bold, text)
-        # 斜体 *text*
-        text = re.sub(r'(?<!\*)\*([^*]+)\*(?!\*)', self._replace_italic, text)
-        # 行内代码 `code`
-        text = re.sub(r'`([^`]+)`', self._replace_inline_code, text)
-        # 链接 [text](url)
-        text = re.sub(r'\[([^\]]+)\]\(([^\)]+)\)', self._replace_link, text)
-        return text
+        """行内元素解析：所有行内规则组合为一个正则，单次扫描；嵌套内容递归解析"""
+        pattern = self.rules.inline_pattern
+        if pattern is None:
+            return text
+        handlers = self.rules.inline_handlers
+        out = []
+        last = 0
+        for m in pattern.finditer(text):
+            handler, offset, count = handlers[m.lastgroup]
+            out.append(text[last:m.start()])
+            out.append(handler(self, _RuleMatch(m, offset, count)))
+            last = m.end()
+        if not out:
+            return text
+        out.append(text[last:])
+        return "".join(out)
 
     def _replace_math_block(self, match):
         style = self.theme["components"]["math"]["block"]
-        return f'<div style="{style}">{match.group(1)}</div>'
+        return f'<div style="{style}">{self.math.render(match.group(1), display=True)}</div>'
 
     def _replace_math_inline(self, match):
         style = self.theme["components"]["math"]["inline"]
-        return f'<span style="{style}">{match.group(1)}</span>'
+        return f'<span style="{style}">{self.math.render(match.group(1))}</span>'
 
     def _replace_strikethrough(self, match):
         style = self.theme["components"]["text"].get("strikethrough", "text-decoration: line-through;")
-        return f'<span style="{style}">{match.group(1)}</span>'
+        return f'<span style="{style}">{self._inline_parse(match.group(1))}</span>'
 
     def _replace_highlight(self, match):
         style = self.theme["components"]["text"].get("highlight",
                  self.theme["components"]["text"].get("mark", "background-color: yellow;"))
-        return f'<span style="{style}">{match.group(1)}</span>'
+        return f'<span style="{style}">{self._inline_parse(match.group(1))}</span>'
+
+    def _replace_bold_italic(self, match):
+        """***文字***：斜体包裹加粗"""
+        strong = self.theme["components"]["text"]["strong"]
+        italic = self.theme["components"]["text"].get("italic", "font-style: italic;")
+        return (f'<span style="{italic}"><strong style="{strong}">'
+                f'{self._inline_parse(match.group(1))}</strong></span>')
 
     def _replace_bold(self, match):
         style = self.theme["components"]["text"]["strong"]
-        return f'<strong style="{style}">{match.group(1)}</strong>'
+        return f'<strong style="{style}">{self._inline_parse(match.group(1))}</strong>'
 
     def _replace_italic(self, match):
         style = self.theme["components"]["text"].get("italic", "font-style: italic;")
-        return f'<span style="{style}">{match.group(1)}</span>'
+        return f'<span style="{style}">{self._inline_parse(match.group(1))}</span>'
 
     def _replace_inline_code(self, match):
         style = self.theme["components"]["text"]["code_inline"]
         return f'<code style="{style}">{match.group(1)}</code>'
 
     def _replace_link(self, match):
+        text = self._inline_parse(match.group(1))
+        url = match.group(2)
+        if self.footnote_links and self.FOOTNOTE_URL.match(url) and not self.WECHAT_URL.match(url):
+            return self._footnote_ref(text, url)
         style = self.theme["base"]["link"]
-        return f'<a href="{match.group(2)}" style="{style}">{match.group(1)}</a>'
+        return f'<a href="{url}" style="{style}">{text}</a>'
+
+    def _footnote_ref(self, text: str, url: str) -> str:
+        """外部链接改为文字加编号，同一 URL 共用一个编号"""
+        entry = self.footnotes.get(url)
+        if entry is None:
+            entry = self.footnotes[url] = (len(self.footnotes) + 1, text)
+        style = self.theme["components"].get("footnotes", {}).get(
+            "ref", "font-size: 75%; vertical-align: super; color: #888;")
+        return f'{text}<sup style="{style}">[{entry[0]}]</sup>'
+
+    def _render_footnotes(self) -> str:
+        """渲染参考资料列表；主题未定义 footnotes 样式时沿用分隔线、加粗与列表项样式"""
+        components = self.theme["components"]
+        footnote_theme = components.get("footnotes", {})
+        container = footnote_theme.get("container", "margin-top: 20px; font-size: 13px; color: #888;")
+        title_style = footnote_theme.get("title", components["text"]["strong"])
+        item_style = footnote_theme.get("item", components["lists"]["li"])
+        items = "\n".join(
+            f'<p style="{item_style} word-break: break-all;">[{number}] {text}: {_escape_code(url)}</p>'
+            for url, (number, text) in self.footnotes.items()
+        )
+        return f'''<section style="{container}">
+<hr style="{components["blocks"]["hr"]}">
+<p style="{title_style}">参考资料</p>
+{items}
+</section>'''
 
     def _replace_inline_image(self, match):
         """替换行内图片"""
         alt, url = match.groups()
-        if self.use_real_images:
-            img_style = self.theme["components"]["media"].get("image",
-                "max-width: 100%; height: auto; display: block; margin: 15px 0;")
-            return f'<img src="{url}" alt="{alt}" style="{img_style}" />'
-        else:
+        return self._render_img_tag(alt, url)
+
+    def _render_img_tag(self, alt: str, url: str) -> str:
+        """渲染图片标签，已知尺寸时输出 width/height 与宽高比以避免重排"""
+        if not self.use_real_images:
             style = self.theme["components"]["media"]["image_placeholder"]
             return f'<section style="{style}">[Image: {alt}]</section>'
+        img_style = self.theme["components"]["media"].get("image",
+            "max-width: 100%; height: auto; display: block; margin: 15px 0;")
+        size = self.image_sizes.get(url)
+        if size:
+            w, h = size
+            return (f'<img src="{url}" alt="{alt}" width="{w}" height="{h}" '
+                    f'style="{img_style} aspect-ratio: {w} / {h};" />')
+        return f'<img src="{url}" alt="{alt}" style="{img_style}" />'
+
+
+def _default_rules() -> RuleRegistry:
+    """内置语法规则"""
+    P = MarkdownParser
+    rules = RuleRegistry()
+    rules.add_block("fence", r"```(.*)", P._block_fence, starts="`", priority=10)
+    rules.add_block("details", r"\s*<details>", P._block_details, starts="<", priority=20)
+    rules.add_block("summary", r"\s*<summary>", P._block_summary, starts="<", priority=20)
+    rules.add_block("details_close", r"\s*</details>", P._block_details_close, starts="<", priority=20)
+    rules.add_block("heading", r"(#{2,4}) (.*)", P._block_heading, starts="#", priority=30)
+    rules.add_block("hr", r"\s*---\s*\Z", P._block_hr, starts="-", priority=40)
+    rules.add_block("quote", r"> (.*)", P._block_quote, starts=">", priority=50)
+    rules.add_block("task", r"\s*[-*+]\s*\[([x\s])\]\s*(.*)", P._block_task, starts="-*+", priority=60)
+    rules.add_block("image", r"!\[", P._block_image, starts="!", priority=70)
+    rules.add_block("ul", r"\s*([-*+])\s+(.*)", P._block_list_item, starts="-*+", priority=80)
+    rules.add_block("ol", r"\s*(\d+\.)\s+(.*)", P._block_list_item, starts="0123456789", priority=90)
+    rules.add_block("table", r"[^\n]*\|", P._block_table, priority=990)
+    rules.add_block("paragraph", r"", P._block_paragraph, priority=1000)
+
+    # 同一位置可匹配多条规则时按优先级取第一条（如 $$ 先于 $）
+    rules.add_inline("math_block", r"\$\$([^$]+)\$\$", P._replace_math_block, priority=10)
+    rules.add_inline("math_inline", r"\$([^$]+)\$", P._replace_math_inline, priority=20)
+    rules.add_inline("image", r"!\[([^\]]*)\]\(([^\)]+)\)", P._replace_inline_image, priority=30)
+    rules.add_inline("strikethrough", r"~~([^~]+)~~", P._replace_strikethrough, priority=40)
+    rules.add_inline("highlight", r"==([^=]+)==", P._replace_highlight, priority=50)
+    rules.add_inline("bold_italic", r"\*\*\*([^*]+)\*\*\*", P._replace_bold_italic, priority=55)
+    rules.add_inline("bold", r"\*\*([^*]+)\*\*", P._replace_bold, priority=60)
+    # 斜体中可以嵌套加粗：*a **b** c*
+    rules.add_inline("italic", r"(?<!\*)\*((?:\*\*[^*]+\*\*|[^*])+)\*(?!\*)", P._replace_italic, priority=70)
+    rules.add_inline("code", r"`([^`]+)`", P._replace_inline_code, priority=80)
+    # 链接文字中允许出现图片：[![alt](src)](url)；不完整的 ![ 不能算作链接文字，[![alt](src) 是 [ 加图片
+    rules.add_inline("link", r"\[((?:!\[[^\]]*\]\([^\)]+\)|!(?!\[)|[^\]!])+)\]\(([^\)]+)\)", P._replace_link,
+                     priority=90)
+
+    for kind, renderer in {
+        "details_open": P._render_details_open, "summary": P._render_summary,
+        "details_close": P._render_details_close, "code": P._render_code_block,
+        "heading": P._render_heading, "hr": P._render_hr, "quote": P._render_quote,
+        "list_open": P._render_list_open, "list_close": P._render_list_close,
+        "task": P._render_task, "item": P._render_item, "image": P._render_img_tag,
+        "paragraph": P._render_paragraph, "toc": P._render_toc_block, "raw": P._render_raw,
+        "table_open": P._render_table_open, "table_head": P._render_table_head,
+        "table_row": P._render_table_row, "table_close": P._render_table_close,
+    }.items():
+        rules.add_renderer(kind, renderer)
+    return rules
+
+
+# 默认语法规则，扩展时基于它复制：RuleRegistry(DEFAULT_RULES)
+DEFAULT_RULES = _default_rules()
 
 
 # ============================================
@@ -575,16 +2907,22 @@ class HTMLGenerator:
 
     def generate(self, content_html: str) -> str:
         """生成完整的 HTML"""
-        container_style = self.theme["base"]["container"]
-        header = self._render_header()
-        footer = self._render_footer()
+        return "".join(self.iter_generate([content_html]))
 
-        return f'''<section id="nice" style="{container_style}">
-{header}
+    def iter_generate(self, content: Iterable[str]) -> Iterator[str]:
+        """逐段产出完整 HTML：页面头部、以换行连接的正文片段、页脚"""
+        container_style = self.theme["base"]["container"]
+        yield f'''<section id="nice" style="{container_style}">
+{self._render_header()}
 
-{content_html}
+'''
+        separator = ""
+        for chunk in content:
+            yield separator + chunk
+            separator = "\n"
+        yield f'''
 
-{footer}
+{self._render_footer()}
 </section>'''
 
     def _render_header(self) -> str:
@@ -606,32 +2944,750 @@ class HTMLGenerator:
 </div>'''
 
 
+# ============================================
+# 依赖图（增量重建）
+# ============================================
+
+def file_signature(path: Path) -> Dict[str, Any]:
+    """记录文件的 大小/修改时间/内容哈希，用于之后判断是否变化"""
+    path = Path(path)
+    stat = path.stat()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "digest": file_digest(path)}
+
+
+def signature_changed(path: Path, signature: Dict[str, Any]) -> bool:
+    """大小与修改时间一致视为未变；否则比较内容哈希"""
+    path = Path(path)
+    try:
+        stat = path.stat()
+    except OSError:
+        return True
+    if stat.st_size == signature.get("size") and stat.st_mtime_ns == signature.get("mtime_ns"):
+        return False
+    return stat.st_size != signature.get("size") or file_digest(path) != signature.get("digest")
+
+
+class DependencyGraph:
+    """持久化的依赖图：文章 -> 源文件、图片、主题文件与转换器版本
+
+    多个转换进程可同时更新同一个图文件（读-改-写在文件锁内完成）。
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.articles: Dict[str, Dict[str, Any]] = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.articles = data.get("articles", {})
+        except (OSError, ValueError):
+            self.articles = {}
+
+    def _save(self):
+        data = {"converter_version": CONVERTER_VERSION, "articles": self.articles}
+        text = json.dumps(data, ensure_ascii=False, indent=1, sort_keys=True)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write_bytes(self.path, text.encode("utf-8"))
+
+    def update(self, entries: Dict[str, Dict[str, Any]]):
+        """在锁内合并条目并保存，保留其他进程写入的文章"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with ManifestLock(self.path.with_name(self.path.name + ".lock")):
+            self.load()
+            self.articles.update(entries)
+            self._save()
+
+    @staticmethod
+    def make_entry(input_path: Path, output_path: Path, theme_path: Path,
+                   extractor: Optional["ImageExtractor"], options: Dict[str, Any],
+                   notes: List[str] = None, missing_notes: List[str] = None) -> Dict[str, Any]:
+        """根据一次转换的结果生成依赖条目"""
+        images = {}
+        missing: List[str] = []
+        if extractor:
+            for source in extractor.mapping:
+                images[str(Path(source).resolve())] = file_signature(Path(source))
+            missing = sorted(extractor.missing)
+        return {
+            "output": str(Path(output_path).resolve()),
+            "converter_version": CONVERTER_VERSION,
+            "source": file_signature(input_path),
+            "theme": {"path": str(Path(theme_path).resolve()), **file_signature(theme_path)},
+            "images": images,
+            "missing_images": missing,
+            "notes": {note: file_signature(Path(note)) for note in (notes or [])},
+            "missing_notes": sorted(missing_notes or []),
+            "options": options,
+        }
+
+    def stale_reasons(self, article: str) -> List[str]:
+        """返回文章需要重建的原因，空列表表示无需重建"""
+        entry = self.articles[article]
+        reasons = []
+        if entry.get("converter_version") != CONVERTER_VERSION:
+            reasons.append(f"converter {entry.get('converter_version')} -> {CONVERTER_VERSION}")
+        if signature_changed(Path(article), entry["source"]):
+            reasons.append("source changed")
+        if not Path(entry["output"]).exists():
+            reasons.append("output missing")
+        if signature_changed(Path(entry["theme"]["path"]), entry["theme"]):
+            reasons.append(f"theme changed: {Path(entry['theme']['path']).name}")
+        for image, signature in entry.get("images", {}).items():
+            if signature_changed(Path(image), signature):
+                reasons.append(f"image changed: {Path(image).name}")
+        missing = entry.get("missing_images", [])
+        if missing:
+            # 按转换时的搜索规则重新查找上次缺失的图片
+            options = entry.get("options", {})
+            finder = ImageExtractor(Path(article).parent, Path(entry["output"]).parent,
+                                    [Path(d) for d in options.get("assets_dirs", [])])
+            for image in missing:
+                if finder._find_image_file(image):
+                    reasons.append(f"image now available: {Path(image).name}")
+        for note, signature in entry.get("notes", {}).items():
+            if signature_changed(Path(note), signature):
+                reasons.append(f"embedded note changed: {Path(note).name}")
+        missing_notes = entry.get("missing_notes", [])
+        if missing_notes:
+            # 同样按转换时的规则重新查找上次缺失的笔记
+            embedder = NoteEmbedder(Path(article).parent, reporter=Reporter())
+            for name in missing_notes:
+                path = embedder.find_note(name)
+                if path is None:
+                    continue
+                try:
+                    load_note(path)
+                except (OSError, UnicodeDecodeError):
+                    continue
+                reasons.append(f"embedded note now available: {name}")
+        return reasons
+
+    def changed_articles(self) -> Dict[str, List[str]]:
+        """所有需要重建的文章及原因"""
+        # 本进程之前记下的缺失笔记可能已经出现：每次检查重新扫描（每个库最多一次）
+        _NOTE_MISSES.clear()
+        changed = {}
+        for article in self.articles:
+            reasons = self.stale_reasons(article)
+            if reasons:
+                changed[article] = reasons
+        return changed
+
+
+# ============================================
+# 解析快照（换主题时跳过图片提取与解析）
+# ============================================
+
+class DocumentSnapshot:
+    """与主题无关的转换中间结果：块列表、图片映射与元数据，以 JSON 保存在输出文件旁
+
+    源文本哈希、转换器版本、影响解析或图片处理的选项都一致，且嵌入的笔记与图片源文件未变化时，
+    换主题重新渲染可以直接使用，不再提取图片和解析。
+    是否提取图片也是选项之一：提取会改写图片引用，两种模式的块列表不能混用。
+    有缺失的图片或笔记时不保存：它们之后出现时快照无从察觉。
+    """
+
+    VERSION = 1
+
+    def __init__(self, blocks: List[Tuple[Any, ...]], metadata: Dict[str, Any],
+                 images: Optional[Dict[str, Any]], notes: List[str], missing_notes: List[str] = None):
+        self.blocks = blocks
+        self.metadata = metadata
+        self.images = images
+        self.notes = notes
+        self.missing_notes = missing_notes or []
+
+    @staticmethod
+    def path_for(output_path: Path) -> Path:
+        output_path = Path(output_path)
+        return output_path.with_name(f".{output_path.stem}.parsed.json")
+
+    @staticmethod
+    def options(extract_images: bool, inject_toc: bool, assets_dirs: Optional[List[Path]], fetch_remote: bool,
+                optimizer: Optional[ImageOptimizer]) -> Dict[str, Any]:
+        """影响解析结果或图片处理的选项；主题与脚注链接只影响渲染，不在其中"""
+        return {
+            "extract_images": extract_images,
+            "inject_toc": inject_toc,
+            "assets_dirs": [str(Path(d).resolve()) for d in (assets_dirs or [])],
+            "fetch_remote": fetch_remote,
+            "optimizer": optimizer.settings if optimizer else None,
+        }
+
+    @staticmethod
+    def source_digest(markdown: str) -> str:
+        return hashlib.sha1(markdown.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def load(cls, path: Path, source: str, options: Dict[str, Any],
+             images_dir: Optional[Path]) -> Optional["DocumentSnapshot"]:
+        """读取仍然有效的快照，无效或不存在时返回 None；images_dir 为 None 表示没有提取图片"""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f, object_hook=cls._decode)
+        except (OSError, ValueError):
+            return None
+        if (data.get("version") != cls.VERSION or data.get("converter_version") != CONVERTER_VERSION
+                or data.get("source") != source or data.get("options") != options):
+            return None
+        for note, signature in data["notes"].items():
+            if signature_changed(Path(note), signature):
+                return None
+        images = data["images"]
+        if images_dir is not None:
+            if images is None:
+                return None
+            for source_file, signature in images["sources"].items():
+                if signature_changed(Path(source_file), signature):
+                    return None
+            if not all((images_dir / name).exists() for name in images["digests"]):
+                return None
+        blocks = [tuple(block) for block in data["blocks"]]
+        return cls(blocks, data["metadata"], images, list(data["notes"]))
+
+    @property
+    def complete(self) -> bool:
+        """没有缺失的图片与笔记"""
+        return not self.missing_notes and not (self.images and self.images["missing"])
+
+    @staticmethod
+    def _encode(value: Any) -> Dict[str, str]:
+        """front matter 中 YAML 解析出的日期带类型标记保存，读取时还原"""
+        if isinstance(value, datetime.datetime):
+            return {"$datetime": value.isoformat()}
+        if isinstance(value, datetime.date):
+            return {"$date": value.isoformat()}
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+    @staticmethod
+    def _decode(obj: Dict[str, Any]) -> Any:
+        if len(obj) == 1:
+            if "$datetime" in obj:
+                return datetime.datetime.fromisoformat(obj["$datetime"])
+            if "$date" in obj:
+                return datetime.date.fromisoformat(obj["$date"])
+        return obj
+
+    def save(self, path: Path, source: str, options: Dict[str, Any]) -> bool:
+        """写入快照，返回是否写入；不完整或 front matter 无法原样还原时跳过"""
+        if not self.complete:
+            return False
+        front_matter = self.metadata.get("front_matter", {})
+        try:
+            restored = json.loads(json.dumps(front_matter, default=self._encode), object_hook=self._decode)
+        except (TypeError, ValueError):
+            return False
+        if restored != front_matter:
+            # 如非字符串键，JSON 会静默改写
+            return False
+        data = {
+            "version": self.VERSION,
+            "converter_version": CONVERTER_VERSION,
+            "source": source,
+            "options": options,
+            "notes": {note: file_signature(Path(note)) for note in self.notes},
+            "images": self.images,
+            "metadata": self.metadata,
+            "blocks": self.blocks,
+        }
+        text = json.dumps(data, ensure_ascii=False, default=self._encode)
+        atomic_write_bytes(Path(path), text.encode("utf-8"))
+        return True
+
+    @staticmethod
+    def image_state(extractor: Optional[ImageExtractor]) -> Optional[Dict[str, Any]]:
+        """提取器中需要保存的状态"""
+        if extractor is None:
+            return None
+        return {
+            "mapping": extractor.mapping,
+            "missing": extractor.missing,
+            "digests": extractor.digests,
+            "dimensions": extractor.dimensions,
+            "sources": {source: file_signature(Path(source)) for source in extractor.mapping},
+        }
+
+    def restore_extractor(self, input_dir: Path, output_dir: Path, assets_dirs: Optional[List[Path]],
+                          reporter: Reporter) -> ImageExtractor:
+        """按快照恢复提取结果（不查找、不复制图片），供内联输出与依赖图使用"""
+        extractor = ImageExtractor(input_dir, output_dir, assets_dirs, reporter=reporter)
+        extractor.mapping = dict(self.images["mapping"])
+        extractor.missing = list(self.images["missing"])
+        extractor.digests = dict(self.images["digests"])
+        extractor.dimensions = {url: tuple(size) for url, size in self.images["dimensions"].items()}
+        return extractor
+
+
 # ============================================
 # 主程序
 # ============================================
 
-def convert_markdown_to_html(
+class Conversion:
+    """一次转换的结果：完整 HTML、图片提取器（未提取图片时为 None）、文档元数据、
+    嵌入的笔记路径与找不到的笔记名
+
+    流式转换的结果只带一个逐块渲染的生成器（chunks）：iter_html() 边渲染边产出，只能消费一次。
+    """
+
+    def __init__(self, html: Optional[str], extractor: Optional[ImageExtractor], metadata: Dict[str, Any],
+                 notes: List[str] = None, missing_notes: List[str] = None, chunks: Iterator[str] = None):
+        self._html = html
+        self._chunks = chunks
+        self.extractor = extractor
+        self.metadata = metadata
+        self.notes = notes or []
+        self.missing_notes = missing_notes or []
+
+    @property
+    def html(self) -> str:
+        if self._html is None:
+            self._html = "".join(self.iter_html())
+        return self._html
+
+    def iter_html(self) -> Iterator[str]:
+        """逐段产出完整 HTML"""
+        if self._html is not None:
+            yield self._html
+            return
+        chunks, self._chunks = self._chunks, None
+        if chunks is None:
+            raise RuntimeError("Streamed HTML has already been consumed")
+        yield from chunks
+
+
+def convert_markdown(
     markdown: str,
     theme_name: str = "vibelight",
     use_real_images: bool = True,
     input_dir: Path = None,
     output_dir: Path = None,
-    assets_dirs: List[Path] = None
-) -> Tuple[str, ImageExtractor]:
-    """转换 Markdown 到 HTML"""
+    assets_dirs: List[Path] = None,
+    optimizer: ImageOptimizer = None,
+    fetch_remote: bool = True,
+    reporter: Reporter = None,
+    inject_toc: bool = False,
+    footnote_links: bool = False,
+    snapshot: Path = None,
+    source_path: Path = None,
+    stream: bool = False
+) -> Conversion:
+    """转换 Markdown，返回包含 HTML 与元数据的 Conversion
+
+    每个阶段结束时发出 DEBUG 级 stage.done 事件（extract_images/parse/generate，附耗时），
+    结束时发出 conversion.done，供性能分析与运行指标订阅。
+    传入 snapshot 路径时，快照有效则跳过图片提取与解析（阶段为 load_snapshot），否则转换后写入快照。
+    source_path 为文章自身的路径，笔记嵌入绕回文章本身时按循环引用跳过。
+    stream 为 True 时解析后即返回，块在消费 Conversion.iter_html() 时才逐个渲染（计入 generate 阶段）。
+    """
+    reporter = reporter or Reporter()
+    stages = StageTimer(reporter)
     manager = ThemeManager()
     theme = manager.load_theme(theme_name)
 
+    extract = bool(input_dir and output_dir and use_real_images)
+    if snapshot:
+        source = DocumentSnapshot.source_digest(markdown)
+        options = DocumentSnapshot.options(extract, inject_toc, assets_dirs, fetch_remote, optimizer)
+        cached = DocumentSnapshot.load(snapshot, source, options,
+                                       Path(output_dir) / "images" if extract else None)
+        if cached:
+            reporter.count("snapshot.hits")
+            stages.done("load_snapshot")
+            extractor = cached.restore_extractor(input_dir, output_dir, assets_dirs, reporter) if extract else None
+            parser = MarkdownParser(theme, use_real_images=use_real_images,
+                                    image_sizes=extractor.dimensions if extractor else None,
+                                    inject_toc=inject_toc, footnote_links=footnote_links)
+            parser.metadata = cached.metadata
+            return _finish_conversion(theme, parser, cached.blocks, extractor, cached.notes, stages, reporter,
+                                      stream=stream)
+        reporter.count("snapshot.misses")
+
+    notes = None
+    missing_notes = None
+    if input_dir:
+        embedder = NoteEmbedder(input_dir, reporter=reporter)
+        markdown = embedder.expand(markdown, source_path)
+        notes = embedder.notes
+        missing_notes = embedder.missing
+
     extractor = None
-    if input_dir and output_dir and use_real_images:
-        extractor = ImageExtractor(input_dir, output_dir, assets_dirs)
+    image_sizes = None
+    if extract:
+        fetcher = RemoteImageFetcher(reporter=reporter) if fetch_remote else None
+        extractor = ImageExtractor(input_dir, output_dir, assets_dirs, fetcher=fetcher, reporter=reporter)
         markdown = extractor.extract_images(markdown)
+        if optimizer:
+            optimizer.optimize(extractor)
+        image_sizes = extractor.probe_dimensions()
+    stages.done("extract_images")
+
+    parser = MarkdownParser(theme, use_real_images=use_real_images, image_sizes=image_sizes,
+                            inject_toc=inject_toc, footnote_links=footnote_links)
+    blocks = parser.parse_blocks(markdown)
+    if snapshot:
+        DocumentSnapshot(blocks, parser.metadata, DocumentSnapshot.image_state(extractor), notes or [],
+                         missing_notes).save(snapshot, source, options)
+    return _finish_conversion(theme, parser, blocks, extractor, notes, stages, reporter, missing_notes, stream)
+
+
+def _finish_conversion(theme: Dict[str, Any], parser: "MarkdownParser", blocks: List[Tuple[Any, ...]],
+                       extractor: Optional[ImageExtractor], notes: Optional[List[str]], stages: StageTimer,
+                       reporter: Reporter, missing_notes: List[str] = None, stream: bool = False) -> Conversion:
+    """渲染块列表、生成完整 HTML 并结束计时；stream 为 True 时推迟到消费 iter_html() 时进行"""
+    chunks = _iter_document(theme, parser, blocks, stages, reporter)
+    if stream:
+        stages.done("parse")
+        return Conversion(None, extractor, parser.metadata, notes, missing_notes, chunks=chunks)
+    content_html = parser.render_blocks(blocks)
+    parser.math.save()
+    stages.done("parse")
+    html = HTMLGenerator(theme).generate(content_html)
+    _conversion_done(stages, reporter)
+    return Conversion(html, extractor, parser.metadata, notes, missing_notes)
+
+
+def _iter_document(theme: Dict[str, Any], parser: "MarkdownParser", blocks: List[Tuple[Any, ...]],
+                   stages: StageTimer, reporter: Reporter) -> Iterator[str]:
+    """逐块渲染并产出完整 HTML；脚注式链接的参考资料在最后一块之后产出"""
+    yield from HTMLGenerator(theme).iter_generate(parser.iter_render(blocks))
+    parser.math.save()
+    _conversion_done(stages, reporter)
+
+
+def _conversion_done(stages: StageTimer, reporter: Reporter):
+    stages.done("generate")
+    reporter.count("conversions")
+    reporter.emit(DEBUG, "conversion.done", seconds=stages.elapsed())
+
+
+def convert_markdown_to_html(
+    markdown: str,
+    theme_name: str = "vibelight",
+    use_real_images: bool = True,
+    input_dir: Path = None,
+    output_dir: Path = None,
+    assets_dirs: List[Path] = None,
+    optimizer: ImageOptimizer = None,
+    fetch_remote: bool = True,
+    reporter: Reporter = None,
+    inject_toc: bool = False,
+    footnote_links: bool = False,
+    snapshot: Path = None,
+    source_path: Path = None
+) -> Tuple[str, ImageExtractor]:
+    """转换 Markdown 到 HTML"""
+    result = convert_markdown(markdown, theme_name, use_real_images, input_dir, output_dir,
+                              assets_dirs, optimizer, fetch_remote, reporter, inject_toc, footnote_links,
+                              snapshot, source_path)
+    return result.html, result.extractor
+
+
+def _dependency_options(theme_name: str, use_real_images: bool, assets_dirs: Optional[List[Path]],
+                        fetch_remote: bool, optimizer: Optional[ImageOptimizer], inject_toc: bool,
+                        inline_max_bytes: Optional[int], footnote_links: bool) -> Dict[str, Any]:
+    """依赖图中记录的转换选项，rebuild_changed.py 按它们重建"""
+    return {
+        "theme": theme_name,
+        "use_real_images": use_real_images,
+        "assets_dirs": [str(Path(d).resolve()) for d in (assets_dirs or [])],
+        "fetch_remote": fetch_remote,
+        "optimizer": optimizer.settings if optimizer else None,
+        "inject_toc": inject_toc,
+        "inline_max_bytes": inline_max_bytes,
+        "footnote_links": footnote_links,
+    }
+
+
+def convert_file(
+    input_path: Path,
+    output_path: Path,
+    theme_name: str = "vibelight",
+    use_real_images: bool = True,
+    assets_dirs: List[Path] = None,
+    optimizer: ImageOptimizer = None,
+    fetch_remote: bool = True,
+    reporter: Reporter = None,
+    deps: DependencyGraph = None,
+    inject_toc: bool = False,
+    inline_max_bytes: int = None,
+    footnote_links: bool = False,
+    snapshot: bool = True
+) -> Tuple[bool, Conversion]:
+    """转换单个 Markdown 文件并写入输出（内容未变化时跳过），返回 (是否写入, 转换结果)
+
+    传入 deps 时把本次转换的依赖记录到依赖图；传入 inline_max_bytes 时
+    不超过该大小的图片以 data URI 内联，生成单文件 HTML。
+    snapshot 为 True 时在输出旁保存解析快照，源文件未变时换主题重新渲染会跳过图片提取与解析。
+    HTML 逐块渲染并直接写入输出，不在内存中拼出全文；返回的 Conversion 不再带 html。
+    """
+    reporter = reporter or Reporter()
+    stages = StageTimer(reporter)
+    input_path = Path(input_path)
+    output_path = Path(output_path)
+    with open(input_path, "r", encoding="utf-8") as f:
+        markdown = f.read()
+        reporter.count("inputs.bytes_read", os.fstat(f.fileno()).st_size)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    stages.done("read")
+
+    result = convert_markdown(
+        markdown,
+        theme_name,
+        use_real_images=use_real_images,
+        input_dir=input_path.parent,
+        output_dir=output_path.parent,
+        assets_dirs=assets_dirs,
+        optimizer=optimizer,
+        fetch_remote=fetch_remote,
+        reporter=reporter,
+        inject_toc=inject_toc,
+        footnote_links=footnote_links,
+        snapshot=DocumentSnapshot.path_for(output_path) if snapshot else None,
+        source_path=input_path,
+        stream=True
+    )
+    written = _write_output(output_path, result, inline_max_bytes, stages, reporter)
+    stages.done("write")
+
+    if deps is not None:
+        options = _dependency_options(theme_name, use_real_images, assets_dirs, fetch_remote, optimizer,
+                                      inject_toc, inline_max_bytes, footnote_links)
+        entry = DependencyGraph.make_entry(input_path, output_path,
+                                           ThemeManager().theme_path(theme_name), result.extractor, options,
+                                           result.notes, result.missing_notes)
+        deps.update({str(input_path.resolve()): entry})
+    return written, result
+
 
-    parser = MarkdownParser(theme, use_real_images=use_real_images)
-    content_html = parser.parse(markdown)
+def _write_output(output_path: Path, result: Conversion, inline_max_bytes: Optional[int],
+                  stages: StageTimer, reporter: Reporter) -> bool:
+    """把流式转换结果边渲染边写入输出；渲染计入 generate 阶段，write 阶段只计比较与替换"""
+    def chunks() -> Iterator[str]:
+        yield from result.iter_html()
+        stages.restart()
 
-    generator = HTMLGenerator(theme)
-    return generator.generate(content_html), extractor
+    if inline_max_bytes is not None and result.extractor:
+        return InlineImageWriter(inline_max_bytes, reporter=reporter).write(output_path, chunks(), result.extractor)
+    return write_stream_if_changed(output_path, (chunk.encode("utf-8") for chunk in chunks()), reporter)
+
+
+# ============================================
+# 异步接口
+# ============================================
+
+# 异步接口共用的线程池大小：文件与图片 I/O 可以多线程并行；解析/渲染是纯 Python 计算，
+# 线程多了只会争抢 GIL、拖慢事件循环，因此单独限制为少量线程
+ASYNC_IO_WORKERS = min(8, (os.cpu_count() or 1) * 2)
+ASYNC_CPU_WORKERS = min(2, os.cpu_count() or 1)
+_ASYNC_EXECUTORS: Dict[str, ThreadPoolExecutor] = {}
+_ASYNC_EXECUTOR_LOCK = threading.Lock()
+
+
+def async_executor(kind: str = "io") -> ThreadPoolExecutor:
+    """异步接口默认使用的有界线程池（"io" 或 "cpu"，进程内共享，首次使用时创建）"""
+    with _ASYNC_EXECUTOR_LOCK:
+        executor = _ASYNC_EXECUTORS.get(kind)
+        if executor is None:
+            workers = ASYNC_CPU_WORKERS if kind == "cpu" else ASYNC_IO_WORKERS
+            executor = _ASYNC_EXECUTORS[kind] = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix=f"wx-article-{kind}")
+        return executor
+
+
+async def convert_markdown_async(
+    markdown: str,
+    theme_name: str = "vibelight",
+    use_real_images: bool = True,
+    input_dir: Path = None,
+    output_dir: Path = None,
+    assets_dirs: List[Path] = None,
+    optimizer: ImageOptimizer = None,
+    fetch_remote: bool = True,
+    reporter: Reporter = None,
+    inject_toc: bool = False,
+    footnote_links: bool = False,
+    executor: ThreadPoolExecutor = None,
+    cpu_executor: ThreadPoolExecutor = None,
+    snapshot: Path = None,
+    source_path: Path = None,
+    stream: bool = False
+) -> Conversion:
+    """convert_markdown 的异步版本
+
+    主题加载、图片查找（含 rglob）与复制在 I/O 线程池执行，解析与渲染在 CPU 线程池执行，
+    都不阻塞事件循环；图片复制、优化和尺寸探测与块级解析并行进行。
+    stream 为 True 时解析后即返回，渲染由消费 Conversion.iter_html() 的线程完成。
+    """
+    reporter = reporter or Reporter()
+    stages = StageTimer(reporter)
+    loop = asyncio.get_running_loop()
+    executor = executor or async_executor("io")
+    cpu_executor = cpu_executor or async_executor("cpu")
+
+    def run(func, *args, **kwargs):
+        return loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+    def compute(func, *args):
+        return loop.run_in_executor(cpu_executor, functools.partial(func, *args))
+
+    theme = await run(ThemeManager().load_theme, theme_name)
+    parser = MarkdownParser(theme, use_real_images=use_real_images, inject_toc=inject_toc,
+                            footnote_links=footnote_links)
+
+    extract = bool(input_dir and output_dir and use_real_images)
+    if snapshot:
+        source = DocumentSnapshot.source_digest(markdown)
+        options = DocumentSnapshot.options(extract, inject_toc, assets_dirs, fetch_remote, optimizer)
+        cached = await run(DocumentSnapshot.load, snapshot, source, options,
+                           Path(output_dir) / "images" if extract else None)
+        if cached:
+            reporter.count("snapshot.hits")
+            stages.done("load_snapshot")
+            extractor = None
+            if extract:
+                extractor = await run(cached.restore_extractor, input_dir, output_dir, assets_dirs, reporter)
+                parser.image_sizes = extractor.dimensions
+            parser.metadata = cached.metadata
+            return await _finish_conversion_async(theme, parser, cached.blocks, extractor, cached.notes, stages,
+                                                  reporter, None, stream, run, compute)
+        reporter.count("snapshot.misses")
+
+    notes = None
+    missing_notes = None
+    if input_dir:
+        embedder = NoteEmbedder(input_dir, reporter=reporter)
+        markdown = await run(embedder.expand, markdown, source_path)
+        notes = embedder.notes
+        missing_notes = embedder.missing
+
+    extractor = None
+    if extract:
+        fetcher = RemoteImageFetcher(reporter=reporter) if fetch_remote else None
+        extractor = await run(ImageExtractor, input_dir, output_dir, assets_dirs,
+                              fetcher=fetcher, reporter=reporter)
+        markdown = await run(extractor.resolve_images, markdown)
+
+        async def prepare_images() -> Dict[str, Tuple[int, int]]:
+            await run(extractor.copy_images)
+            if optimizer:
+                await run(optimizer.optimize, extractor)
+            return await run(extractor.probe_dimensions)
+
+        image_sizes, blocks = await asyncio.gather(prepare_images(), compute(parser.parse_blocks, markdown))
+        parser.image_sizes = image_sizes
+    else:
+        blocks = await compute(parser.parse_blocks, markdown)
+    stages.done("extract_images")
+
+    if snapshot:
+        await run(DocumentSnapshot(blocks, parser.metadata, DocumentSnapshot.image_state(extractor),
+                                   notes or [], missing_notes).save, snapshot, source, options)
+    return await _finish_conversion_async(theme, parser, blocks, extractor, notes, stages, reporter,
+                                          missing_notes, stream, run, compute)
+
+
+async def _finish_conversion_async(theme, parser, blocks, extractor, notes, stages, reporter, missing_notes,
+                                   stream, run, compute) -> Conversion:
+    """_finish_conversion 的异步版本：渲染与生成在 CPU 线程池，保存公式缓存在 I/O 线程池"""
+    if stream:
+        stages.done("parse")
+        chunks = _iter_document(theme, parser, blocks, stages, reporter)
+        return Conversion(None, extractor, parser.metadata, notes, missing_notes, chunks=chunks)
+    content_html = await compute(parser.render_blocks, blocks)
+    await run(parser.math.save)
+    stages.done("parse")
+    html = await compute(HTMLGenerator(theme).generate, content_html)
+    _conversion_done(stages, reporter)
+    return Conversion(html, extractor, parser.metadata, notes, missing_notes)
+
+
+async def convert_file_async(
+    input_path: Path,
+    output_path: Path,
+    theme_name: str = "vibelight",
+    use_real_images: bool = True,
+    assets_dirs: List[Path] = None,
+    optimizer: ImageOptimizer = None,
+    fetch_remote: bool = True,
+    reporter: Reporter = None,
+    deps: DependencyGraph = None,
+    inject_toc: bool = False,
+    inline_max_bytes: int = None,
+    footnote_links: bool = False,
+    timeout: float = None,
+    executor: ThreadPoolExecutor = None,
+    cpu_executor: ThreadPoolExecutor = None,
+    snapshot: bool = True
+) -> Tuple[bool, Conversion]:
+    """convert_file 的异步版本，timeout 秒内未完成时抛出 asyncio.TimeoutError
+
+    取消或超时后，已提交到线程池的单步操作会在后台做完；图片与输出都是临时文件加原子重命名，
+    不会留下写了一半的文件。
+    """
+    return await asyncio.wait_for(_convert_file_async(
+        Path(input_path), Path(output_path), theme_name, use_real_images, assets_dirs, optimizer,
+        fetch_remote, reporter or Reporter(), deps, inject_toc, inline_max_bytes, footnote_links,
+        executor or async_executor("io"), cpu_executor, snapshot
+    ), timeout)
+
+
+async def _convert_file_async(input_path, output_path, theme_name, use_real_images, assets_dirs,
+                              optimizer, fetch_remote, reporter, deps, inject_toc, inline_max_bytes,
+                              footnote_links, executor, cpu_executor, snapshot) -> Tuple[bool, Conversion]:
+    loop = asyncio.get_running_loop()
+    stages = StageTimer(reporter)
+
+    def run(func, *args):
+        return loop.run_in_executor(executor, functools.partial(func, *args))
+
+    def read() -> str:
+        with open(input_path, "r", encoding="utf-8") as f:
+            text = f.read()
+            reporter.count("inputs.bytes_read", os.fstat(f.fileno()).st_size)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        return text
+
+    markdown = await run(read)
+    stages.done("read")
+
+    result = await convert_markdown_async(
+        markdown,
+        theme_name,
+        use_real_images=use_real_images,
+        input_dir=input_path.parent,
+        output_dir=output_path.parent,
+        assets_dirs=assets_dirs,
+        optimizer=optimizer,
+        fetch_remote=fetch_remote,
+        reporter=reporter,
+        inject_toc=inject_toc,
+        footnote_links=footnote_links,
+        executor=executor,
+        cpu_executor=cpu_executor,
+        snapshot=DocumentSnapshot.path_for(output_path) if snapshot else None,
+        source_path=input_path,
+        stream=True
+    )
+    # 渲染与写出交错进行，以渲染为主，放在 CPU 线程池
+    written = await loop.run_in_executor(cpu_executor or async_executor("cpu"), _write_output,
+                                         output_path, result, inline_max_bytes, stages, reporter)
+    stages.done("write")
+
+    if deps is not None:
+        options = _dependency_options(theme_name, use_real_images, assets_dirs, fetch_remote, optimizer,
+                                      inject_toc, inline_max_bytes, footnote_links)
+
+        def record():
+            entry = DependencyGraph.make_entry(input_path, output_path,
+                                               ThemeManager().theme_path(theme_name), result.extractor, options,
+                                               result.notes, result.missing_notes)
+            deps.update({str(input_path.resolve()): entry})
+
+        await run(record)
+    return written, result
 
 
 def main():
@@ -658,6 +3714,35 @@ Examples:
     parser.add_argument("--list-themes", action="store_true", help="List all available themes")
     parser.add_argument("--no-images", action="store_true", help="Use placeholders instead of real images")
     parser.add_argument("-v", "--verbose", action="store_true", help="Show detailed information")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Only show warnings and errors")
+    parser.add_argument("--events", metavar="FILE",
+                        help="Write progress events as JSON lines to FILE ('-' for stdout)")
+    parser.add_argument("--toc", action="store_true",
+                        help="Insert a table of contents at [TOC] or at the top")
+    parser.add_argument("--footnote-links", action="store_true",
+                        help="Turn external links into numbered references listed at the end")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="Write run metrics to FILE (.prom/.txt: Prometheus text format, otherwise JSON)")
+    parser.add_argument("--no-snapshot", action="store_true",
+                        help="Do not save or reuse the parsed snapshot next to the output")
+    parser.add_argument("--deps", metavar="FILE",
+                        help="Record this article's dependencies in a graph file (see rebuild_changed.py)")
+    parser.add_argument("--inline-images", action="store_true",
+                        help="Embed images as data URIs to produce a single self-contained file")
+    parser.add_argument("--inline-max-bytes", type=int, default=256 * 1024,
+                        help="Only inline images up to this many bytes, link the rest (default: 262144)")
+    parser.add_argument("--no-remote", action="store_true",
+                        help="Keep http(s) image URLs instead of downloading them")
+    parser.add_argument("--optimize-images", action="store_true",
+                        help="Recompress/downsize large images (requires Pillow)")
+    parser.add_argument("--max-image-bytes", type=int, default=1024 * 1024,
+                        help="Optimize images larger than this many bytes (default: 1048576)")
+    parser.add_argument("--max-image-width", type=int, default=1080,
+                        help="Downsize images wider than this (default: 1080)")
+    parser.add_argument("--max-image-pixels", type=int, default=16 * 1024 * 1024,
+                        help="Downsize images with more pixels than this, e.g. long screenshots (default: 16777216)")
+    parser.add_argument("--image-quality", type=int, default=85,
+                        help="JPEG/WebP quality for optimized images (default: 85)")
 
     args = parser.parse_args()
 
@@ -678,34 +3763,69 @@ Examples:
         print(f"Error: File not found: {input_path}", file=sys.stderr)
         sys.exit(1)
 
-    with open(input_path, "r", encoding="utf-8") as f:
-        markdown = f.read()
-
     output_path = Path(args.output)
-    output_path.parent.mkdir(parents=True, exist_ok=True)
 
     use_images = not args.no_images
     assets_dirs = [Path(d) for d in args.assets_dirs] if args.assets_dirs else []
 
-    if args.verbose and assets_dirs:
-        print(f"[INFO] Assets directories: {assets_dirs}")
-
-    html, extractor = convert_markdown_to_html(
-        markdown,
-        args.theme,
-        use_real_images=use_images,
-        input_dir=input_path.parent,
-        output_dir=output_path.parent,
-        assets_dirs=assets_dirs
-    )
-
-    with open(output_path, "w", encoding="utf-8") as f:
-        f.write(html)
-
-    print(f"[OK] Generated: {output_path}")
-
-    if extractor:
-        print(extractor.get_summary())
+    reporter = Reporter()
+    if args.events == "-":
+        reporter.subscribe(JSONLinesSink(sys.stdout), DEBUG)
+    else:
+        reporter.subscribe(ConsoleSink(), WARNING if args.quiet else (DEBUG if args.verbose else INFO))
+    events_file = None
+    if args.events and args.events != "-":
+        events_file = open(args.events, "w", encoding="utf-8")
+        reporter.subscribe(JSONLinesSink(events_file), DEBUG)
+    try:
+        metrics = Metrics(reporter) if args.metrics else None
+
+        if assets_dirs:
+            reporter.emit(DEBUG, "assets.dirs", dirs=assets_dirs)
+
+        optimizer = None
+        if args.optimize_images:
+            optimizer = ImageOptimizer(args.max_image_bytes, args.max_image_width, args.image_quality,
+                                       reporter=reporter, max_pixels=args.max_image_pixels)
+
+        _, result = convert_file(
+            input_path,
+            output_path,
+            args.theme,
+            use_real_images=use_images,
+            assets_dirs=assets_dirs,
+            optimizer=optimizer,
+            fetch_remote=not args.no_remote,
+            reporter=reporter,
+            deps=DependencyGraph(Path(args.deps)) if args.deps else None,
+            inject_toc=args.toc,
+            inline_max_bytes=args.inline_max_bytes if args.inline_images else None,
+            footnote_links=args.footnote_links,
+            snapshot=not args.no_snapshot
+        )
+        extractor = result.extractor
+        meta = result.metadata
+        reporter.emit(INFO, "document.stats", words=meta["words"], cjk_chars=meta["cjk_chars"],
+                      images=meta["images"], minutes=meta["reading_minutes"], headings=len(meta["toc"]))
+
+        if extractor:
+            reporter.emit(INFO, "extract.summary", message=extractor.get_summary())
+        counters = reporter.counters
+        reporter.emit(INFO, "publish.summary",
+                      written=counters.get("outputs.written", 0),
+                      skipped=counters.get("outputs.skipped", 0),
+                      copied=counters.get("images.copied", 0),
+                      optimized=counters.get("images.optimized", 0),
+                      reused=counters.get("images.reused", 0))
+        if args.inline_images:
+            reporter.emit(INFO, "inline.summary", inlined=counters.get("images.inlined", 0),
+                          cached=counters.get("inline.cache_hits", 0))
+        reporter.emit(DEBUG, "run.counters", counters=reporter.counters)
+        if metrics:
+            metrics.write(Path(args.metrics))
+    finally:
+        if events_file:
+            events_file.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,601 @@
+#!/usr/bin/env python3
+"""
+差分测试：随机生成 Markdown，分别交给冻结的参考实现（reference_converter.py）与当前的
+converter.py，在所有主题下比较输出 HTML 与复制的图片；发现差异时把输入缩减到最小，
+并记录每个用例两者的相对速度。
+
+参考实现是基线版本（BASELINE_REVISION）的 ImageExtractor、MarkdownParser 与 HTMLGenerator，
+用 --freeze 从 git 历史中取出。之后有意改变的输出（KNOWN_CHANGES）在比较前从两边归一化掉，
+无法归一化的（KNOWN_DIVERGENCES）从输入中去掉触发它们的行；
+基线不支持的语法（表格、front matter、[TOC]、![[图片]]）不生成。
+"""
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+HERE = Path(__file__).parent
+REFERENCE_PATH = HERE / "reference_converter.py"
+
+# 优化前的基线提交，参考实现取自这里
+BASELINE_REVISION = "b77bebe"
+# 参考实现只包含这些类（及模块导入），不含主题加载、命令行等外围代码
+REFERENCE_CLASSES = ("ImageExtractor", "MarkdownParser", "HTMLGenerator")
+
+REFERENCE_HEADER = '''#!/usr/bin/env python3
+"""
+冻结的参考转换器：{revision} 版本 converter.py 中的 {classes}，供 diff_fuzz.py 做差分测试
+
+不要手工修改本文件；由 python diff_fuzz.py --freeze 生成。
+"""
+'''
+
+SECTION_BANNER = re.compile(r"^# =+\n# .*\n# =+\n", re.MULTILINE)
+
+
+def freeze_reference(revision: str = BASELINE_REVISION):
+    """从 git 历史取出 revision 的 converter.py，只保留模块导入与 REFERENCE_CLASSES 所在的段落"""
+    source = subprocess.run(["git", "show", f"{revision}:./converter.py"], cwd=HERE, check=True,
+                            capture_output=True, encoding="utf-8").stdout
+    banners = list(SECTION_BANNER.finditer(source))
+    start = source.index('"""')
+    end = source.index('"""', start + 3) + 3
+    parts = [source[end:banners[0].start()].strip("\n") + "\n"]
+    found = []
+    for i, banner in enumerate(banners):
+        section = source[banner.start():banners[i + 1].start() if i + 1 < len(banners) else len(source)]
+        classes = [name for name in REFERENCE_CLASSES if re.search(rf"^class {name}\b", section, re.MULTILINE)]
+        if classes:
+            found += classes
+            parts.append(section.strip("\n") + "\n")
+    missing = set(REFERENCE_CLASSES) - set(found)
+    if missing:
+        raise ValueError(f"{revision}: converter.py has no {', '.join(sorted(missing))}")
+    header = REFERENCE_HEADER.format(revision=revision, classes="、".join(REFERENCE_CLASSES))
+    text = header + "\n\n" + "\n\n".join(parts)
+    REFERENCE_PATH.write_text(text, encoding="utf-8")
+
+
+# ============================================
+# 随机 Markdown 生成
+# ============================================
+
+class MarkdownGrammar:
+    """按语法随机生成 Markdown：标题、列表、任务、引用与提示块、折叠块、代码、公式、图片等
+
+    行内内容会混入未闭合的标记与特殊字符，覆盖各种边界情况。
+    只生成基线实现支持的语法，新增语法的输出无从比较。
+    """
+
+    WORDS = ["微信", "文章", "hello", "world", "数据", "分析", "code", "x", "a_b", "1.5", "测试", "Vibe"]
+    NOISE = ["*", "**", "`", "$", "~~", "==", "[", "]", "(", ")", "|", "\\", "<b>", "&", "#", "!", "_"]
+    LANGS = ["python", "py", "javascript", "js", "bash", "rust", "go", "", "unknown"]
+    IMAGES = ["pic.png", "photo with space.png", "photo%20with%20space.png", "nested.gif", "missing.png"]
+    CALLOUTS = ["TIP", "T", "WARNING", "CAUTION", "NOTE", "N", "INFO", "I", "UNKNOWN"]
+    MATH = [r"E = mc^2", r"\frac{a}{b}", r"\sum_{i=1}^{n} i", r"\sqrt{x+1}", r"\alpha + \beta",
+            r"x_{i}^{2}", r"\int_{0}^{\infty} e^{-t} dt", r"\unknown{y}", r"a \pm b", r"{",
+            r"\sqrt[3 x", r"\sqrt[", r"\left( x", r"\left"]
+    URLS = ["https://example.com", "https://mp.weixin.qq.com/s/abc", "#anchor", "https://example.com/a_b?x=1"]
+
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+
+    def document(self) -> str:
+        blocks = [self.block() for _ in range(self.rng.randint(1, 12))]
+        return "".join(block + self.rng.choice(["\n\n", "\n", "\n\n\n"]) for block in blocks)
+
+    def block(self, depth: int = 0) -> str:
+        kinds = [self.heading, self.paragraph, self.unordered, self.ordered, self.tasks, self.quote,
+                 self.callout, self.code, self.math_block, self.image_block, self.hr]
+        if depth < 2:
+            kinds.append(self.details)
+        return self.rng.choice(kinds)(depth)
+
+    # ---------- 行内 ----------
+
+    def word(self) -> str:
+        return self.rng.choice(self.WORDS)
+
+    def inline(self, depth: int = 0) -> str:
+        atoms = []
+        for _ in range(self.rng.randint(1, 6)):
+            roll = self.rng.random()
+            if roll < 0.4 or depth > 2:
+                atoms.append(self.word())
+            elif roll < 0.5:
+                atoms.append(self.rng.choice(self.NOISE))
+            else:
+                atoms.append(self.rng.choice([
+                    lambda: f"**{self.inline(depth + 1)}**",
+                    lambda: f"*{self.inline(depth + 1)}*",
+                    lambda: f"~~{self.inline(depth + 1)}~~",
+                    lambda: f"=={self.inline(depth + 1)}==",
+                    lambda: f"`{self.inline(depth + 1)}`",
+                    lambda: f"[{self.inline(depth + 1)}]({self.rng.choice(self.URLS)})",
+                    lambda: f"${self.rng.choice(self.MATH)}$",
+                    lambda: f"![{self.word()}]({self.rng.choice(self.IMAGES)})",
+                ])())
+        return " ".join(atoms)
+
+    # ---------- 块级 ----------
+
+    def heading(self, depth: int) -> str:
+        return "#" * self.rng.randint(1, 5) + " " + self.inline()
+
+    def paragraph(self, depth: int) -> str:
+        return "\n".join(self.inline() for _ in range(self.rng.randint(1, 3)))
+
+    def unordered(self, depth: int) -> str:
+        return "\n".join(" " * self.rng.choice([0, 0, 2, 4]) + self.rng.choice("-*+") + " " + self.inline()
+                         for _ in range(self.rng.randint(1, 5)))
+
+    def ordered(self, depth: int) -> str:
+        return "\n".join(" " * self.rng.choice([0, 0, 3]) + f"{i + 1}. " + self.inline()
+                         for i in range(self.rng.randint(1, 5)))
+
+    def tasks(self, depth: int) -> str:
+        return "\n".join(f"- [{self.rng.choice(' xX')}] " + self.inline() for _ in range(self.rng.randint(1, 4)))
+
+    def quote(self, depth: int) -> str:
+        return "\n".join(self.rng.choice(["> ", ">"]) + self.inline() for _ in range(self.rng.randint(1, 3)))
+
+    def callout(self, depth: int) -> str:
+        return f"> [!{self.rng.choice(self.CALLOUTS)}]\n" + self.quote(depth)
+
+    def details(self, depth: int) -> str:
+        inner = "\n".join(self.block(depth + 1) for _ in range(self.rng.randint(0, 3)))
+        return f"<details>\n<summary>{self.inline()}</summary>\n{inner}\n</details>"
+
+    def code(self, depth: int) -> str:
+        lines = [self.rng.choice(["def f(x):", "    return x * 2", "const a = \"s\";", "echo $HOME",
+                                  "// 注释", "# comment", "<div>&amp;</div>", "", self.inline()])
+                 for _ in range(self.rng.randint(0, 5))]
+        closing = "```" if self.rng.random() < 0.9 else ""
+        return f"```{self.rng.choice(self.LANGS)}\n" + "\n".join(lines) + "\n" + closing
+
+    def math_block(self, depth: int) -> str:
+        return f"$${self.rng.choice(self.MATH)}$$"
+
+    def image_block(self, depth: int) -> str:
+        return f"![{self.word()}]({self.rng.choice(self.IMAGES)})"
+
+    def hr(self, depth: int) -> str:
+        return self.rng.choice(["---", "***", "___"])
+
+
+# ============================================
+# 引擎与比较
+# ============================================
+
+def _png(width: int, height: int) -> bytes:
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    chunk = b"IHDR" + ihdr
+    return (b"\x89PNG\r\n\x1a\n" + struct.pack(">I", len(ihdr)) + chunk
+            + struct.pack(">I", zlib.crc32(chunk)))
+
+
+def make_vault(root: Path) -> Path:
+    """创建包含测试图片的输入目录，返回文章所在目录"""
+    article_dir = root / "vault" / "notes"
+    (article_dir / "assets").mkdir(parents=True)
+    (root / "vault" / ".obsidian").mkdir()
+    (article_dir / "pic.png").write_bytes(_png(640, 480))
+    (article_dir / "photo with space.png").write_bytes(_png(1200, 300))
+    (article_dir / "assets" / "nested.gif").write_bytes(b"GIF89a" + struct.pack("<HH", 32, 16) + b"\x00" * 8)
+    return article_dir
+
+
+# ---------- 基线之后有意改变的输出 ----------
+
+IMAGE_SIZE = re.compile(r'(<img [^>]*?) width="\d+" height="\d+"')
+ASPECT_RATIO = re.compile(r" aspect-ratio: \d+ / \d+;")
+CODE_BLOCK = re.compile(r"(<pre [^>]*><code>)(.*?)(</code></pre>)", re.DOTALL)
+SPAN_TAG = re.compile(r"</?span\b[^>]*>")
+
+
+def _strip_image_size(html: str, theme: Dict[str, Any]) -> str:
+    return ASPECT_RATIO.sub("", IMAGE_SIZE.sub(r"\1", html))
+
+
+def _strip_code_highlight(html: str, theme: Dict[str, Any]) -> str:
+    return CODE_BLOCK.sub(lambda m: m.group(1) + SPAN_TAG.sub("", m.group(2)) + m.group(3), html)
+
+
+def _replace_elements(html: str, opening: str, tag: str, replacement: str) -> str:
+    """把以 opening 开头的元素（按同名标签配对）的内容替换为 replacement"""
+    tags = re.compile(rf"<(/?){tag}\b")
+    out, pos = [], 0
+    while True:
+        start = html.find(opening, pos)
+        if start < 0:
+            break
+        depth, end = 1, start + len(opening)
+        while depth:
+            match = tags.search(html, end)
+            if match is None:
+                return html
+            depth += -1 if match.group(1) else 1
+            end = match.end()
+        out.append(html[pos:start] + opening + replacement + f"</{tag}>")
+        pos = html.index(">", end) + 1
+    out.append(html[pos:])
+    return "".join(out)
+
+
+def _blank_math(html: str, theme: Dict[str, Any]) -> str:
+    math = theme["components"]["math"]
+    html = _replace_elements(html, f'<div style="{math["block"]}">', "div", "$$")
+    return _replace_elements(html, f'<span style="{math["inline"]}">', "span", "$")
+
+
+# (请求, 说明, 归一化函数)：比较前对两边的 HTML 依次应用
+KNOWN_CHANGES: List[Tuple[str, str, Callable[[str, Dict[str, Any]], str]]] = [
+    ("user-026", "<img> carries the probed width/height and aspect-ratio", _strip_image_size),
+    ("user-033", "code blocks are syntax highlighted", _strip_code_highlight),
+    ("user-034", "math is pre-rendered to static markup", _blank_math),
+]
+
+
+def normalize(html: str, theme: Dict[str, Any]) -> str:
+    for _, _, change in KNOWN_CHANGES:
+        html = change(html, theme)
+    return html
+
+
+OUTPUT_IMAGE = re.compile(r"images/(img_\d+\.\w+)")
+
+
+def address_images(html: str, images: Dict[str, str]) -> Tuple[str, List[str]]:
+    """user-029：同一来源只复制一次、编号不再跳号；两边都把图片引用换成内容哈希再比较"""
+    html = OUTPUT_IMAGE.sub(lambda m: "images/" + images.get(m.group(1), "missing"), html)
+    return html, sorted(set(images.values()))
+
+
+# ---------- 无法在输出上归一化的有意差异：比较前从输入中去掉触发它们的行 ----------
+
+# 基线按固定顺序对整行做多遍 re.sub，后面的规则会匹配到前面生成的 HTML 上
+BASELINE_INLINE = {
+    "$$": re.compile(r"\$\$([^$]+)\$\$"),
+    "$": re.compile(r"\$([^$]+)\$"),
+    "!": re.compile(r"!\[([^\]]*)\]\(([^\)]+)\)"),
+    "~~": re.compile(r"~~([^~]+)~~"),
+    "==": re.compile(r"==([^=]+)=="),
+    "**": re.compile(r"\*\*([^*]+)\*\*"),
+    "*": re.compile(r"(?<!\*)\*([^*]+)\*(?!\*)"),
+    "`": re.compile(r"`([^`]+)`"),
+    "[": re.compile(r"\[([^\]]+)\]\(([^\)]+)\)"),
+}
+# 模拟基线生成的标签：开标签带 style="..."（含 =），闭标签不含任何定界符
+OPEN_TAG, CLOSE_TAG = "\x01=", "\x02"
+
+
+def _code_span_markup(line: str) -> bool:
+    """行内代码中有其他行内标记（基线会继续渲染它们，现在保持原文）"""
+    return any(re.search(r"[*~=$\[\]!]", m.group(1)) for m in BASELINE_INLINE["`"].finditer(line))
+
+
+def _straddling_markup(line: str) -> bool:
+    """按基线的顺序逐遍替换，某次匹配里的模拟标签不配对（基线跨过已生成的 HTML 配对了定界符）"""
+    def balanced(text: str) -> bool:
+        depth = 0
+        for char in text:
+            depth += (char == OPEN_TAG[0]) - (char == CLOSE_TAG)
+            if depth < 0:
+                return False
+        return depth == 0
+
+    def wrap(match) -> str:
+        if not balanced(match.group(0)):
+            raise ValueError
+        return OPEN_TAG + match.group(1) + CLOSE_TAG
+
+    try:
+        for pattern in BASELINE_INLINE.values():
+            line = pattern.sub(wrap, line)
+    except ValueError:
+        return True
+    return False
+
+
+def _link_target_markup(line: str) -> bool:
+    """链接地址中有行内标记字符（基线会把地址也渲染成 HTML）"""
+    return any(re.search(r"[*~=$`]", m.group(2)) for m in BASELINE_INLINE["["].finditer(line))
+
+
+def _touching_emphasis(line: str) -> bool:
+    """连续三个以上的 * 与其他 * 同行（加粗紧挨斜体时基线分两遍替换，现在一遍从左到右配对）"""
+    if "***" not in line:
+        return False
+    return "*" in re.sub(r"(?<!\*)\*\*\*[^*]+\*\*\*(?!\*)", "", line)
+
+
+def _image_alt_markup(line: str) -> bool:
+    """图片 alt 中有行内标记（基线会把 HTML 渲染进 alt 属性）"""
+    return any(re.search(r"[*~=$`\[]", m.group(1)) for m in re.finditer(r"!\[([^\]]*)\]\(", line))
+
+
+def _highlight_around_rendered(line: str) -> bool:
+    """==...== 包含先渲染的公式、图片或删除线（基线生成的属性里有 =，高亮失效）"""
+    return any(re.search(r"\$|!\[|~~", m.group(1)) for m in BASELINE_INLINE["=="].finditer(line))
+
+
+# (请求, 说明, 判断一行是否触发)
+KNOWN_DIVERGENCES: List[Tuple[str, str, Callable[[str], bool]]] = [
+    ("user-037", "markup inside inline code stays literal", _code_span_markup),
+    ("user-037", "delimiters only pair within the text they enclose", _straddling_markup),
+    ("user-037", "link targets are not rendered as markup", _link_target_markup),
+    ("user-037", "image alt text is not rendered as markup", _image_alt_markup),
+    ("user-037", "touching bold and italic are paired in one scan", _touching_emphasis),
+    ("user-037", "highlight may contain math, images and strikethrough", _highlight_around_rendered),
+]
+
+
+# 行首的引用、列表、任务和标题标记不参与行内配对
+BLOCK_PREFIX = re.compile(r"^\s*(?:>\s*)*(?:[-*+]\s+(?:\[[ xX]\]\s+)?|\d+\.\s+|#{1,6}\s+)?")
+
+
+def strip_known_divergences(markdown: str) -> Tuple[str, int]:
+    """去掉触发有意差异的行，返回 (剩余输入, 去掉的行数)
+
+    代码块中的 <details>/<summary> 行基线当作折叠块处理，现在保留在代码中，也一并去掉；
+    首行的 --- 现在开启 front matter（user-035），同样去掉。
+    """
+    kept, skipped, in_code = [], 0, False
+    for line in markdown.split("\n"):
+        if not kept and not in_code and line.strip() == "---":
+            skipped += 1
+            continue
+        if line.startswith("```"):
+            in_code = not in_code
+        elif in_code:
+            if line.strip().startswith(("<details>", "<summary>", "</details>")):
+                skipped += 1
+                continue
+        elif any(triggers(BLOCK_PREFIX.sub("", line)) for _, _, triggers in KNOWN_DIVERGENCES):
+            skipped += 1
+            continue
+        kept.append(line)
+    return "\n".join(kept), skipped
+
+
+class Engine:
+    """一个转换器实现：render(markdown, 主题配置, 主题名, 输入目录, 输出目录) 返回 HTML"""
+
+    def __init__(self, name: str, render: Callable[..., str], work_dir: Path, themes):
+        self.name = name
+        self.render = render
+        self.work_dir = work_dir
+        self.themes = themes
+
+    def convert(self, markdown: str, theme: str, input_dir: Path, case: str) -> Tuple[str, List[str]]:
+        """返回 (归一化后的 HTML 或异常描述, 输出图片的内容哈希)"""
+        output_dir = self.work_dir / self.name / case
+        config = self.themes.load_theme(theme)
+        try:
+            html = normalize(self.render(markdown, config, theme, input_dir, output_dir), config)
+        except Exception as e:
+            html = f"!{type(e).__name__}: {e}"
+        images = {}
+        if (output_dir / "images").exists():
+            for path in sorted((output_dir / "images").iterdir()):
+                if not path.name.startswith("."):
+                    images[path.name] = hashlib.sha1(path.read_bytes()).hexdigest()
+        return address_images(html, images)
+
+
+def reference_engine(module, work_dir: Path, themes) -> Engine:
+    """按基线 convert_markdown_to_html 的流程组合参考类；主题由当前实现加载（基线只在 scripts/ 下找主题）"""
+    def render(markdown: str, config: Dict[str, Any], theme: str, input_dir: Path, output_dir: Path) -> str:
+        # 基线实现直接 print 进度与警告
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            extractor = module.ImageExtractor(input_dir, output_dir)
+            markdown = extractor.extract_images(markdown)
+        parser = module.MarkdownParser(config, use_real_images=True)
+        return module.HTMLGenerator(config).generate(parser.parse(markdown))
+    return Engine("reference", render, work_dir, themes)
+
+
+def candidate_engine(module, work_dir: Path, themes) -> Engine:
+    """当前实现；公式缓存写到独立的临时文件"""
+    module._MATH_RENDERER = module.MathRenderer(cache_path=work_dir / "candidate-math.json")
+
+    def render(markdown: str, config: Dict[str, Any], theme: str, input_dir: Path, output_dir: Path) -> str:
+        return module.convert_markdown(markdown, theme, input_dir=input_dir, output_dir=output_dir,
+                                       fetch_remote=False, reporter=module.Reporter()).html
+    return Engine("candidate", render, work_dir, themes)
+
+
+def first_difference(a: str, b: str, context: int = 60) -> Tuple[int, str, str]:
+    i = next((i for i, (x, y) in enumerate(zip(a, b)) if x != y), min(len(a), len(b)))
+    start = max(i - context, 0)
+    return i, a[start:i + context], b[start:i + context]
+
+
+def ddmin(items: List[str], failing: Callable[[List[str]], bool]) -> List[str]:
+    """Delta debugging：不断删除片段，保留仍然触发差异的最小子序列"""
+    n = 2
+    while len(items) >= 2:
+        chunk = -(-len(items) // n)
+        for start in range(0, len(items), chunk):
+            candidate = items[:start] + items[start + chunk:]
+            if candidate and failing(candidate):
+                items = candidate
+                n = max(n - 1, 2)
+                break
+        else:
+            if n >= len(items):
+                break
+            n = min(len(items), n * 2)
+    return items
+
+
+class Harness:
+    """对同一输入运行两个引擎并比较，发现差异时缩减输入"""
+
+    def __init__(self, reference: Engine, candidate: Engine, themes: Sequence[str], input_dir: Path):
+        self.reference = reference
+        self.candidate = candidate
+        self.themes = list(themes)
+        self.input_dir = input_dir
+        self._runs = 0
+
+    def compare(self, markdown: str, theme: str) -> Optional[Tuple[Any, Any]]:
+        """返回 None 表示一致，否则返回 (参考结果, 当前结果)"""
+        self._runs += 1
+        case = f"r{self._runs}"
+        expected = self.reference.convert(markdown, theme, self.input_dir, case)
+        actual = self.candidate.convert(markdown, theme, self.input_dir, case)
+        return None if expected == actual else (expected, actual)
+
+    def run_case(self, markdown: str) -> Dict[str, Any]:
+        """在所有主题下比较并计时，返回用例记录"""
+        timings = {self.reference.name: 0.0, self.candidate.name: 0.0}
+        mismatch = None
+        for theme in self.themes:
+            self._runs += 1
+            case = f"r{self._runs}"
+            results = {}
+            for engine in (self.reference, self.candidate):
+                start = time.perf_counter()
+                results[engine.name] = engine.convert(markdown, theme, self.input_dir, case)
+                timings[engine.name] += time.perf_counter() - start
+            if mismatch is None and results[self.reference.name] != results[self.candidate.name]:
+                mismatch = theme
+        ref_time, new_time = timings[self.reference.name], timings[self.candidate.name]
+        return {"bytes": len(markdown.encode("utf-8")), "mismatch": mismatch,
+                "reference_ms": round(ref_time * 1000, 3), "candidate_ms": round(new_time * 1000, 3),
+                "speedup": round(ref_time / new_time, 3) if new_time else None}
+
+    def reduce(self, markdown: str, theme: str) -> str:
+        """先按行、再按字符把输入缩减到仍有差异的最小形式"""
+        def failing(pieces: List[str], joiner: str) -> bool:
+            # 缩减不能落到已知差异上，否则报告的不是原来的问题
+            markdown = joiner.join(pieces)
+            return strip_known_divergences(markdown)[1] == 0 and self.compare(markdown, theme) is not None
+
+        lines = ddmin(markdown.split("\n"), lambda pieces: failing(pieces, "\n"))
+        return "".join(ddmin(list("\n".join(lines)), lambda pieces: failing(pieces, "")))
+
+
+def report_mismatch(harness: Harness, markdown: str, theme: str) -> Dict[str, Any]:
+    expected, actual = harness.compare(markdown, theme)
+    record = {"theme": theme, "input": markdown}
+    if expected[0] != actual[0]:
+        pos, ref_snippet, new_snippet = first_difference(expected[0], actual[0])
+        record.update(position=pos, reference=ref_snippet, candidate=new_snippet)
+        print(f"    HTML differs at {pos}:")
+        print(f"      reference: {ref_snippet!r}")
+        print(f"      candidate: {new_snippet!r}")
+    if expected[1] != actual[1]:
+        record.update(reference_images=expected[1], candidate_images=actual[1])
+        print(f"    Images differ: {expected[1]} != {actual[1]}")
+    return record
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Differential test: reference converter vs current converter")
+    parser.add_argument("--cases", type=int, default=50, help="Random documents to generate (default: 50)")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the first case (default: random)")
+    parser.add_argument("-t", "--theme", action="append", dest="themes", help="Only test these themes")
+    parser.add_argument("--input", action="append", default=[], help="Also test these Markdown files")
+    parser.add_argument("--no-reduce", action="store_true", help="Report mismatches without reducing them")
+    parser.add_argument("--save", metavar="DIR", help="Write reduced failing inputs to DIR")
+    parser.add_argument("--json", metavar="FILE", help="Write per-case results (including timings) as JSON")
+    parser.add_argument("--freeze", action="store_true",
+                        help="Extract the reference classes from git history into reference_converter.py and exit")
+    parser.add_argument("--revision", default=BASELINE_REVISION,
+                        help=f"Revision to freeze the reference from (default: {BASELINE_REVISION})")
+    parser.add_argument("--force", action="store_true", help="Allow --freeze to overwrite an existing reference")
+    args = parser.parse_args()
+
+    if args.freeze:
+        if REFERENCE_PATH.exists() and not args.force:
+            print(f"Error: Reference already exists: {REFERENCE_PATH} (use --force to overwrite)", file=sys.stderr)
+            sys.exit(1)
+        try:
+            freeze_reference(args.revision)
+        except (subprocess.CalledProcessError, ValueError) as e:
+            print(f"Error: Cannot freeze reference from {args.revision}: {getattr(e, 'stderr', None) or e}",
+                  file=sys.stderr)
+            sys.exit(1)
+        print(f"[OK] Frozen reference written: {REFERENCE_PATH} ({args.revision})")
+        return
+    if not REFERENCE_PATH.exists():
+        print(f"Error: Reference not found: {REFERENCE_PATH} (run with --freeze)", file=sys.stderr)
+        sys.exit(1)
+
+    work = tempfile.TemporaryDirectory()
+    # 远程下载、内联等缓存都放到临时目录，不读写本机缓存
+    os.environ["WX_ARTICLE_CACHE_DIR"] = str(Path(work.name) / "cache")
+    import converter
+    import reference_converter
+
+    work_dir = Path(work.name)
+    themes = converter.ThemeManager()
+    harness = Harness(reference_engine(reference_converter, work_dir, themes),
+                      candidate_engine(converter, work_dir, themes),
+                      args.themes or sorted(themes.list_themes()),
+                      make_vault(work_dir))
+
+    seed = args.seed if args.seed is not None else random.randrange(1 << 30)
+    cases: List[Tuple[str, str]] = [(name, Path(name).read_text(encoding="utf-8")) for name in args.input]
+    cases += [(f"seed {seed + i}", MarkdownGrammar(random.Random(seed + i)).document()) for i in range(args.cases)]
+    print(f"Testing {len(cases)} case(s) x {len(harness.themes)} theme(s), first seed {seed}")
+
+    records = []
+    failures = []
+    try:
+        for name, markdown in cases:
+            markdown, skipped = strip_known_divergences(markdown)
+            record = dict(harness.run_case(markdown), case=name, skipped_lines=skipped)
+            records.append(record)
+            if record["mismatch"] is None:
+                continue
+            theme = record["mismatch"]
+            print(f"[FAIL] {name} ({theme})")
+            reduced = markdown if args.no_reduce else harness.reduce(markdown, theme)
+            print(f"    reduced input ({len(reduced)} chars): {reduced!r}")
+            failures.append(dict(report_mismatch(harness, reduced, theme), case=name))
+    finally:
+        work.cleanup()
+
+    if args.save and failures:
+        save_dir = Path(args.save)
+        save_dir.mkdir(parents=True, exist_ok=True)
+        for i, failure in enumerate(failures, 1):
+            (save_dir / f"mismatch-{i:03d}.md").write_text(failure["input"], encoding="utf-8")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"seed": seed, "cases": records, "failures": failures}, f, ensure_ascii=False, indent=2)
+
+    speedups = [r["speedup"] for r in records if r["speedup"]]
+    if speedups:
+        print(f"Speed (reference / candidate): median {statistics.median(speedups):.2f}x, "
+              f"min {min(speedups):.2f}x, max {max(speedups):.2f}x")
+    skipped = sum(r["skipped_lines"] for r in records)
+    if skipped:
+        print(f"Skipped {skipped} line(s) with known intentional differences")
+    print(f"{len(records) - len(failures)}/{len(records)} case(s) identical")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
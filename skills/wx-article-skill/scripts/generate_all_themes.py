@@ -57,7 +57,9 @@ def main():
                 use_real_images=True,  # 使用真实图片（如果找不到会显示占位符）
                 input_dir=input_file.parent,
                 output_dir=output_dir,
-                assets_dirs=None
+                assets_dirs=None,
+                # 所有主题共用一份解析快照，只有第一个主题需要提取图片和解析
+                snapshot=output_dir / ".all_themes.parsed.json"
             )
 
             # 写入文件
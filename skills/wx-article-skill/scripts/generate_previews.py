@@ -1,9 +1,27 @@
 #!/usr/bin/env python3
-"""为所有主题生成预览 HTML"""
+"""
+为所有主题生成预览 HTML（增量）
 
+previews/.manifest.json 记录每个预览的 (主题文件哈希, 预览内容哈希, 转换器版本) 与输出哈希，
+只重新生成过期的预览；--check 只报告过期项，不写入任何文件。
+"""
+
+import argparse
+import hashlib
 import json
 import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
+from typing import Dict, List, Tuple
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from converter import (CONVERTER_VERSION, ThemeManager, atomic_write_bytes, convert_markdown_to_html,
+                       file_digest, write_if_changed)
+
+# 清单格式版本，结构变化时递增
+MANIFEST_VERSION = 1
 
 # 预览 Markdown 内容 - 完整覆盖所有 markdown 语法
 PREVIEW_MD = '''# 一级标题 H1
@@ -206,19 +224,46 @@ def hidden_function():
 > 引用块中也可以使用各种**样式**，比如*斜体*、==高亮==和`代码`。
 '''
 
-def generate_preview(theme_name: str, themes_dir: Path, output_dir: Path):
-    """为单个主题生成预览"""
-    theme_path = themes_dir / f"{theme_name}.json"
-    if not theme_path.exists():
-        return False
-
-    with open(theme_path, "r", encoding="utf-8") as f:
-        theme = json.load(f)
-
-    # 导入转换模块
-    sys.path.insert(0, str(Path(__file__).parent))
-    from converter import convert_markdown_to_html
-
+def text_digest(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def load_manifest(path: Path) -> Dict[str, Dict[str, str]]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get("version") != MANIFEST_VERSION:
+        return {}
+    return data.get("previews", {})
+
+
+def save_manifest(path: Path, previews: Dict[str, Dict[str, str]]):
+    data = {"version": MANIFEST_VERSION, "previews": dict(sorted(previews.items()))}
+    atomic_write_bytes(path, (json.dumps(data, ensure_ascii=False, indent=2) + "\n").encode("utf-8"))
+
+
+def stale_reasons(entry: Dict[str, str], inputs: Dict[str, str], output_path: Path) -> List[str]:
+    """对比清单记录与当前输入，返回过期原因（为空表示预览是最新的）"""
+    if not entry:
+        return ["new"]
+    reasons = []
+    if entry.get("theme") != inputs["theme"]:
+        reasons.append("theme changed")
+    if entry.get("source") != inputs["source"]:
+        reasons.append("preview source changed")
+    if entry.get("converter") != inputs["converter"]:
+        reasons.append(f"converter {entry.get('converter')} -> {inputs['converter']}")
+    if not output_path.exists():
+        reasons.append("output missing")
+    elif entry.get("output") != file_digest(output_path):
+        reasons.append("output modified")
+    return reasons
+
+
+def generate_preview(theme_name: str, output_path: str) -> Tuple[str, bool, str]:
+    """为单个主题生成预览（可在工作进程中执行），返回 (主题, 是否写入, 输出哈希)"""
     html, _ = convert_markdown_to_html(
         PREVIEW_MD,
         theme_name,
@@ -226,41 +271,90 @@ def generate_preview(theme_name: str, themes_dir: Path, output_dir: Path):
         input_dir=None,
         output_dir=None
     )
+    written = write_if_changed(Path(output_path), html)
+    return theme_name, written, text_digest(html)
 
-    output_path = output_dir / f"{theme_name}.html"
-    with open(output_path, "w", encoding="utf-8") as f:
-        f.write(html)
-
-    return True
 
 def main():
     """主程序"""
-    base_dir = Path(__file__).parent
-    themes_dir = base_dir / "themes"
-    preview_dir = base_dir / "previews"
-    preview_dir.mkdir(exist_ok=True)
-
-    # 获取所有主题
-    theme_files = [f for f in themes_dir.glob("*.json") if f.name != "_schema.json"]
-    theme_names = sorted([f.stem for f in theme_files])
-
-    print(f"Generating previews for {len(theme_names)} themes...")
-
-    success_count = 0
+    parser = argparse.ArgumentParser(description="Generate theme previews, rebuilding only stale ones")
+    parser.add_argument("themes", nargs="*", help="Only consider these themes (default: all)")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Parallel workers (default: CPU count)")
+    parser.add_argument("--check", action="store_true",
+                        help="Report stale previews without writing; exit 1 if any")
+    parser.add_argument("--force", action="store_true", help="Regenerate all previews")
+    args = parser.parse_args()
+
+    manager = ThemeManager()
+    preview_dir = manager.themes_dir.parent / "previews"
+    manifest_path = preview_dir / ".manifest.json"
+    theme_names = sorted(args.themes or manager.list_themes())
+    manifest = load_manifest(manifest_path)
+
+    source = text_digest(PREVIEW_MD)
+    stale: Dict[str, Dict[str, str]] = {}
     for theme_name in theme_names:
-        try:
-            if generate_preview(theme_name, themes_dir, preview_dir):
-                print(f"[OK] {theme_name}")
-                success_count += 1
-            else:
-                print(f"[SKIP] {theme_name}")
-        except Exception as e:
-            print(f"[ERROR] {theme_name}: {e}")
+        theme_path = manager.theme_path(theme_name)
+        if not theme_path.exists():
+            print(f"[SKIP] {theme_name}: theme not found")
+            continue
+        inputs = {"theme": file_digest(theme_path), "source": source, "converter": CONVERTER_VERSION}
+        reasons = ["forced"] if args.force else stale_reasons(
+            manifest.get(theme_name), inputs, preview_dir / f"{theme_name}.html")
+        if reasons:
+            stale[theme_name] = inputs
+            print(f"[STALE] {theme_name}: {', '.join(reasons)}")
+
+    # 主题已删除的预览
+    removed = [] if args.themes else [name for name in manifest if name not in theme_names]
+    for name in removed:
+        print(f"[STALE] {name}: theme removed")
+
+    print(f"{len(theme_names)} theme(s), {len(stale)} stale preview(s)")
+    if args.check:
+        if stale or removed:
+            sys.exit(1)
+        return
+    if not stale and not removed:
+        return
+
+    preview_dir.mkdir(exist_ok=True)
+    failed = 0
+    results: List[Tuple[str, bool, str]] = []
+    if len(stale) == 1 or args.jobs == 1:
+        # 只有一个过期预览时直接在本进程生成，省去启动工作进程的开销
+        for theme_name in stale:
+            try:
+                results.append(generate_preview(theme_name, str(preview_dir / f"{theme_name}.html")))
+            except Exception as e:
+                failed += 1
+                print(f"[ERROR] {theme_name}: {e}")
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            futures = {pool.submit(generate_preview, name, str(preview_dir / f"{name}.html")): name
+                       for name in stale}
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    failed += 1
+                    print(f"[ERROR] {futures[future]}: {e}")
+
+    for theme_name, written, output in results:
+        manifest[theme_name] = dict(stale[theme_name], output=output)
+        print(f"[OK] {theme_name}" + ("" if written else " (output unchanged)"))
+    for name in removed:
+        (preview_dir / f"{name}.html").unlink(missing_ok=True)
+        del manifest[name]
+        print(f"[OK] Removed {name}")
+    save_manifest(manifest_path, manifest)
 
     print(f"\n{'='*50}")
-    print(f"Generated {success_count}/{len(theme_names)} previews")
+    print(f"Generated {len(results)}/{len(stale)} stale preview(s)")
     print(f"Output directory: {preview_dir}")
-    print(f"\nOpen previews/{theme_names[0]}.html to start viewing!")
+    if failed:
+        sys.exit(1)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+内存分析：用 tracemalloc 记录一次转换各阶段（read / extract_images / parse / generate / write）
+的内存占用与峰值，列出分配最多的代码位置，并可按基线检查"每 MB 输入的峰值内存"是否回退。
+
+默认使用临时缓存目录与临时输出目录，结果不受本机缓存状态影响。
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+MB = 1024 * 1024
+
+
+class MemoryProfiler:
+    """订阅 stage.done 事件，在每个阶段结束时记录当前内存、阶段峰值与增长最多的分配位置
+
+    快照本身也占用被追踪的内存：记录数值前先读取计数器，并把保留的快照大小从后续阶段中扣除。
+    """
+
+    FILTERS = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        tracemalloc.Filter(False, "<unknown>"),
+        tracemalloc.Filter(False, __file__),
+    ]
+
+    def __init__(self, top: int = 5):
+        self.top = top
+        self.stages: List[Dict[str, Any]] = []
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._overhead = 0
+        self._start = 0
+
+    def start(self):
+        tracemalloc.start()
+        self._start = self._mark(None)
+
+    def stop(self):
+        self._snapshot = None
+        tracemalloc.stop()
+
+    def __call__(self, record: Dict[str, Any]):
+        if record["event"] == "stage.done":
+            self._mark(record["stage"])
+
+    @property
+    def peak(self) -> int:
+        return max((stage["peak"] for stage in self.stages), default=0)
+
+    def _mark(self, stage: Optional[str]) -> int:
+        """记录一个阶段结束，返回扣除快照开销后的当前内存"""
+        current, peak = tracemalloc.get_traced_memory()
+        current -= self._overhead
+        peak -= self._overhead
+
+        sites = []
+        snapshot = tracemalloc.take_snapshot().filter_traces(self.FILTERS) if self.top else None
+        if snapshot is not None and self._snapshot is not None:
+            for stat in snapshot.compare_to(self._snapshot, "lineno")[:self.top]:
+                if stat.size_diff > 0:
+                    frame = stat.traceback[0]
+                    sites.append({"site": f"{frame.filename}:{frame.lineno}",
+                                  "size_diff": stat.size_diff, "count_diff": stat.count_diff})
+        self._snapshot = snapshot
+        self._overhead = max(tracemalloc.get_traced_memory()[0] - current, 0)
+        tracemalloc.reset_peak()
+
+        if stage is not None:
+            self.stages.append({"stage": stage, "current": current - self._start,
+                                "peak": peak - self._start, "sites": sites})
+        return current
+
+
+def profile_file(input_path: Path, theme: str, use_images: bool, fetch_remote: bool,
+                 top: int) -> Dict[str, Any]:
+    """在临时目录中转换一次并返回各阶段内存数据"""
+    from converter import DEBUG, Reporter, convert_file
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        reporter = Reporter()
+        profiler = MemoryProfiler(top)
+        reporter.subscribe(profiler, DEBUG)
+        profiler.start()
+        try:
+            convert_file(input_path, Path(out_dir) / "output.html", theme,
+                         use_real_images=use_images, fetch_remote=fetch_remote, reporter=reporter)
+        finally:
+            profiler.stop()
+
+    input_mb = max(input_path.stat().st_size / MB, 1 / 1024)
+    return {
+        "input_bytes": input_path.stat().st_size,
+        "peak": profiler.peak,
+        "peak_per_input_mb": profiler.peak / MB / input_mb,
+        "stages": profiler.stages,
+    }
+
+
+def print_report(name: str, result: Dict[str, Any]):
+    print(f"{name}: input {result['input_bytes'] / 1024:.1f} KB, peak {result['peak'] / MB:.2f} MB "
+          f"({result['peak_per_input_mb']:.1f} MB per input MB)")
+    print(f"  {'stage':<16}{'current MB':>12}{'peak MB':>12}")
+    for stage in result["stages"]:
+        print(f"  {stage['stage']:<16}{stage['current'] / MB:>12.2f}{stage['peak'] / MB:>12.2f}")
+    for stage in result["stages"]:
+        for site in stage["sites"]:
+            print(f"    [{stage['stage']}] +{site['size_diff'] / 1024:.1f} KB "
+                  f"({site['count_diff']:+d} blocks) {site['site']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile conversion memory with tracemalloc")
+    parser.add_argument("inputs", nargs="+", help="Markdown files to convert")
+    parser.add_argument("-t", "--theme", default="vibelight", help="Theme name (default: vibelight)")
+    parser.add_argument("--no-images", action="store_true", help="Use placeholders instead of real images")
+    parser.add_argument("--remote", action="store_true", help="Download http(s) images (off by default)")
+    parser.add_argument("--top", type=int, default=5, help="Allocation sites to list per stage (0 to disable)")
+    parser.add_argument("--keep-cache", action="store_true",
+                        help="Use the normal cache directory instead of a fresh temporary one")
+    parser.add_argument("--baseline", metavar="FILE", help="Baseline JSON of peak MB per input MB")
+    parser.add_argument("--update-baseline", action="store_true", help="Write current results to --baseline")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="Allowed increase over the baseline before failing (default: 0.10)")
+    parser.add_argument("--json", metavar="FILE", help="Also write the full report as JSON")
+    args = parser.parse_args()
+
+    cache = None
+    if not args.keep_cache:
+        cache = tempfile.TemporaryDirectory()
+        os.environ["WX_ARTICLE_CACHE_DIR"] = cache.name
+
+    results = {}
+    try:
+        for name in args.inputs:
+            path = Path(name)
+            if not path.exists():
+                print(f"Error: File not found: {path}", file=sys.stderr)
+                sys.exit(1)
+            results[path.name] = profile_file(path, args.theme, not args.no_images, args.remote, args.top)
+            print_report(path.name, results[path.name])
+    finally:
+        if cache:
+            cache.cleanup()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if not args.baseline:
+        return
+    baseline_path = Path(args.baseline)
+    if args.update_baseline:
+        baseline = {name: round(r["peak_per_input_mb"], 3) for name, r in results.items()}
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2)
+        print(f"[OK] Baseline written: {baseline_path}")
+        return
+
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    failed = 0
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"[!] No baseline for {name}")
+            continue
+        limit = baseline[name] * (1 + args.tolerance)
+        ratio = result["peak_per_input_mb"]
+        if ratio > limit:
+            failed += 1
+            print(f"[FAIL] {name}: {ratio:.1f} MB per input MB > {limit:.1f} (baseline {baseline[name]:.1f})")
+        else:
+            print(f"[OK] {name}: {ratio:.1f} MB per input MB <= {limit:.1f}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
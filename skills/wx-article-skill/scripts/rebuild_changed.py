@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+增量重建：根据依赖图只重新转换受影响的文章
+
+依赖图由 converter.py --deps FILE 生成，记录每篇文章的源文件、图片、主题文件与转换器版本。
+"""
+
+import argparse
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Dict, Tuple
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from converter import DependencyGraph, ImageOptimizer, Reporter, convert_file
+
+
+def rebuild_article(graph_path: str, article: str, options: Dict[str, Any],
+                    output: str) -> Tuple[str, bool, Dict[str, int]]:
+    """在工作进程中重建一篇文章，返回 (文章, 是否写入, 计数)"""
+    reporter = Reporter()
+    optimizer = None
+    if options.get("optimizer"):
+        optimizer = ImageOptimizer(**options["optimizer"], reporter=reporter)
+    written, _ = convert_file(
+        Path(article),
+        Path(output),
+        options["theme"],
+        use_real_images=options["use_real_images"],
+        assets_dirs=[Path(d) for d in options.get("assets_dirs", [])],
+        optimizer=optimizer,
+        fetch_remote=options.get("fetch_remote", True),
+        reporter=reporter,
+        deps=DependencyGraph(Path(graph_path)),
+        inject_toc=options.get("inject_toc", False),
+        inline_max_bytes=options.get("inline_max_bytes"),
+        footnote_links=options.get("footnote_links", False)
+    )
+    return article, written, reporter.counters
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild only the articles whose dependencies changed")
+    parser.add_argument("deps", help="Dependency graph file written by converter.py --deps")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Parallel workers (default: CPU count)")
+    parser.add_argument("--dry-run", action="store_true", help="List affected articles without rebuilding")
+    args = parser.parse_args()
+
+    graph = DependencyGraph(Path(args.deps))
+    changed = graph.changed_articles()
+
+    print(f"Tracked {len(graph.articles)} article(s), {len(changed)} need rebuilding")
+    for article, reasons in changed.items():
+        print(f"[STALE] {Path(article).name}: {', '.join(reasons)}")
+    if args.dry_run or not changed:
+        return
+
+    print("-" * 50)
+    totals = Reporter()
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = {
+            pool.submit(rebuild_article, args.deps, article,
+                        graph.articles[article]["options"], graph.articles[article]["output"]): article
+            for article in changed
+        }
+        for future in as_completed(futures):
+            article = futures[future]
+            try:
+                _, written, counters = future.result()
+                totals.merge(counters)
+                print(f"[OK] {Path(article).name}" + ("" if written else " (output unchanged)"))
+            except Exception as e:
+                failed += 1
+                print(f"[FAIL] {Path(article).name}: {e}")
+
+    counters = totals.counters
+    print("-" * 50)
+    print(f"Rebuilt {len(changed) - failed}/{len(changed)} article(s): "
+          f"{counters.get('outputs.written', 0)} written, {counters.get('outputs.skipped', 0)} unchanged, "
+          f"{counters.get('images.copied', 0)} image(s) copied")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,63 @@
 """批量更新主题文件"""
 
 import json
+import re
 from pathlib import Path
 
+# 代码高亮配色：根据代码块背景的明暗选择
+SYNTAX_LIGHT = {
+    "keyword": "color: #cf222e;",
+    "builtin": "color: #8250df;",
+    "string": "color: #0a3069;",
+    "number": "color: #0550ae;",
+    "comment": "color: #6e7781; font-style: italic;",
+    "function": "color: #8250df;",
+    "property": "color: #0550ae;",
+    "tag": "color: #116329;",
+    "attr": "color: #953800;",
+    "meta": "color: #953800;",
+    "variable": "color: #953800;"
+}
+SYNTAX_DARK = {
+    "keyword": "color: #ff7b72;",
+    "builtin": "color: #d2a8ff;",
+    "string": "color: #a5d6ff;",
+    "number": "color: #79c0ff;",
+    "comment": "color: #8b949e; font-style: italic;",
+    "function": "color: #d2a8ff;",
+    "property": "color: #79c0ff;",
+    "tag": "color: #7ee787;",
+    "attr": "color: #ffa657;",
+    "meta": "color: #ffa657;",
+    "variable": "color: #ffa657;"
+}
+
+# 表格配色：根据正文容器背景的明暗选择
+TABLE_LIGHT = {
+    "wrapper": "overflow-x: auto; margin-bottom: 15px;",
+    "table": "width: 100%; border-collapse: collapse; font-size: 14px;",
+    "th": "border: 1px solid #d0d7de; padding: 6px 10px; background-color: #f6f8fa; font-weight: bold;",
+    "td": "border: 1px solid #d0d7de; padding: 6px 10px;"
+}
+TABLE_DARK = {
+    "wrapper": "overflow-x: auto; margin-bottom: 15px;",
+    "table": "width: 100%; border-collapse: collapse; font-size: 14px;",
+    "th": "border: 1px solid #30363d; padding: 6px 10px; background-color: #161b22; font-weight: bold;",
+    "td": "border: 1px solid #30363d; padding: 6px 10px;"
+}
+
+
+def is_dark_background(style: str) -> bool:
+    """取样式中 background 的第一个十六进制颜色判断明暗"""
+    match = re.search(r'background[^;]*?#([0-9a-fA-F]{6}|[0-9a-fA-F]{3})\b', style)
+    if not match:
+        return False
+    hex_color = match.group(1)
+    if len(hex_color) == 3:
+        hex_color = "".join(c * 2 for c in hex_color)
+    r, g, b = (int(hex_color[i:i + 2], 16) for i in (0, 2, 4))
+    return 0.299 * r + 0.587 * g + 0.114 * b < 128
+
 def update_theme_file(file_path: Path):
     """更新单个主题文件"""
     with open(file_path, 'r', encoding='utf-8') as f:
@@ -68,6 +123,20 @@ def update_theme_file(file_path: Path):
             "block": "background-color: #f6f8fa; padding: 15px; border-radius: 6px; text-align: center; margin: 15px 0; overflow-x: auto; font-family: 'Times New Roman', serif;"
         }
 
+    # 添加代码高亮样式
+    if 'syntax' not in components:
+        dark = is_dark_background(blocks.get('code_block', ''))
+        components['syntax'] = dict(SYNTAX_DARK if dark else SYNTAX_LIGHT)
+
+    # 添加表格样式，表头下边框使用主题链接色
+    if 'table' not in components:
+        dark = is_dark_background(theme.get('base', {}).get('container', ''))
+        table = dict(TABLE_DARK if dark else TABLE_LIGHT)
+        accent = re.search(r'(?<![-\w])color:\s*(#[0-9a-fA-F]{3,6})', theme.get('base', {}).get('link', ''))
+        if accent:
+            table['th'] += f" border-bottom: 2px solid {accent.group(1)};"
+        components['table'] = table
+
     # 添加 h1 和 h4 样式
     headings = components.setdefault('headings', {})
     if 'h1' not in headings:
@@ -83,6 +152,8 @@ def update_theme_file(file_path: Path):
 
 def main():
     themes_dir = Path(__file__).parent / "themes"
+    if not themes_dir.exists():
+        themes_dir = Path(__file__).parent.parent / "themes"
     theme_files = [f for f in themes_dir.glob("*.json") if f.name != "_schema.json"]
 
     for theme_file in theme_files: